@@ -0,0 +1,377 @@
+"""
+Backend Pool
+Spreads completion requests over several API keys and OpenAI-compatible endpoints
+Each backend has its own shared rate-limit state, health tracking and circuit breaker;
+requests go to the backend with the most headroom and fail over on 429/5xx
+"""
+
+import sys
+sys.dont_write_bytecode = True
+
+import os
+import time
+import random
+import asyncio
+import hashlib
+from pathlib import Path
+from urllib.parse import urlparse
+from llm_client import CompletionClient, GROQ_API_URL, DEFAULT_MODEL
+from upstream_transport import UpstreamTransport
+from shared_rate_limiter import (SharedRateLimiter, RATE_LIMIT_FILE, RATE_LIMIT_PERIOD, MAX_REQUESTS_PER_MINUTE,
+                                 MAX_TOKENS_PER_MINUTE, REQUEST_BURST)
+from metrics import counter, histogram
+
+# Circuit breaker: this many consecutive failures (5xx, timeouts, rejected keys) open the circuit
+FAILURE_THRESHOLD = 3
+# An open circuit lets one trial request through after the cooldown; every failed trial doubles it
+BREAKER_COOLDOWN = 30.0  # seconds
+MAX_BREAKER_COOLDOWN = 300.0  # seconds
+
+# A request that got 429 from every backend is retried this many times, once the soonest
+# backend's Retry-After has passed plus a random jitter (doubling each time) so processes
+# do not all retry at the same instant - unless that is further away than MAX_RETRY_WAIT
+RATE_LIMIT_RETRIES = 3
+RETRY_JITTER = 0.5  # seconds
+MAX_RETRY_WAIT = 30.0  # seconds
+
+# Statuses that say the backend (not the request) is the problem, so another backend may succeed
+FAILOVER_STATUSES = {401, 403, 429}
+
+# Margin kept below each provider's token limit for estimate error (300 of Groq's 6000)
+TOKEN_SAFETY_MARGIN = 0.05
+
+# Requests reach the server up to this long after their reserved slot (opening a new
+# connection vs reusing one, scheduling), so each budget is spread over period + this
+# and arrivals still fit inside the server's own window
+ARRIVAL_JITTER = 0.05  # seconds
+
+UPSTREAM_LATENCY = histogram('chatbot_upstream_latency_seconds',
+                             'Completion API response time (whole stream for streamed requests)', ('backend',))
+UPSTREAM_REQUESTS = counter('chatbot_upstream_requests_total', 'Completion API requests by outcome',
+                            ('backend', 'status'))
+TOKENS_USED = counter('chatbot_tokens_total', 'Tokens reported by the completion API', ('backend', 'kind'))
+
+def backend_config(api_url, model, api_key, requests_per_minute=MAX_REQUESTS_PER_MINUTE,
+                   tokens_per_minute=MAX_TOKENS_PER_MINUTE):
+    """One backend's settings; the name identifies its key without revealing it"""
+    digest = hashlib.blake2b(f"{api_url}\n{api_key}".encode(), digest_size=3).hexdigest()
+    return {
+        'name': f"{urlparse(api_url).hostname}-{digest}",
+        'api_url': api_url,
+        'model': model,
+        'api_key': api_key,
+        'requests_per_minute': int(requests_per_minute),
+        'tokens_per_minute': int(tokens_per_minute),
+    }
+
+def parse_backends(api_key=None, extra_keys='', endpoints=''):
+    """Backend configs for the primary Groq key, extra Groq keys and extra endpoints
+
+    `extra_keys` is a comma separated list of Groq keys; `endpoints` a comma separated list
+    of url|model|api_key[|requests_per_minute|tokens_per_minute] (the provider's limits).
+    """
+    backends = []
+    for key in [api_key or ''] + extra_keys.split(','):
+        key = key.strip()
+        if key and all(backend['api_key'] != key for backend in backends):
+            backends.append(backend_config(GROQ_API_URL, DEFAULT_MODEL, key))
+    for entry in endpoints.split(','):
+        if not entry.strip():
+            continue
+        fields = [field.strip() for field in entry.split('|')]
+        if len(fields) not in (3, 5):
+            raise ValueError(f"LLM_BACKENDS entry for {fields[0]} must be "
+                             f"url|model|api_key[|requests_per_minute|tokens_per_minute]")
+        backends.append(backend_config(*fields))
+    return backends
+
+def load_backends(api_key=None):
+    """Backend configs from GROQ_API_KEY (or api_key), GROQ_API_KEYS and LLM_BACKENDS"""
+    return parse_backends(api_key or os.getenv('GROQ_API_KEY'),
+                          os.getenv('GROQ_API_KEYS', ''), os.getenv('LLM_BACKENDS', ''))
+
+class Backend:
+    """One API key on one endpoint: its own client, shared rate limiter and circuit breaker
+
+    The breaker is closed while requests succeed. FAILURE_THRESHOLD failures in a row open
+    it for the cooldown; after that one trial request is let through (half-open), which
+    closes it again on success or reopens it for twice as long on failure.
+    """
+
+    def __init__(self, config, bot_name, state_file, worker=None, period=RATE_LIMIT_PERIOD, transport=None,
+                 limiter_class=SharedRateLimiter):
+        self.name = config['name']
+        self.client = CompletionClient(config['api_key'], config['api_url'], config['model'], transport=transport)
+        # Same margins as the Groq defaults: sustained rate + burst never exceed the limit in a minute
+        requests_per_minute = config['requests_per_minute']
+        burst = min(REQUEST_BURST, max(1, requests_per_minute // 6))
+        self.limiter = limiter_class(
+            bot_name, state_file,
+            requests_per_minute=max(1, requests_per_minute - burst), request_burst=burst,
+            tokens_per_minute=int(config['tokens_per_minute'] * (1 - TOKEN_SAFETY_MARGIN)),
+            period=period + ARRIVAL_JITTER, worker=worker)
+        self.in_flight = 0
+        self.failures = 0        # consecutive failures
+        self.open_until = 0.0    # no requests before this time while the circuit is open
+        self.cooldown = BREAKER_COOLDOWN
+        self.trial = False       # the half-open trial request is in flight
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+
+    @property
+    def state(self):
+        """Circuit breaker state: closed, open or half-open"""
+        if self.failures < FAILURE_THRESHOLD:
+            return 'closed'
+        return 'open' if self.open_until > time.time() else 'half-open'
+
+    def breaker_wait(self, now):
+        """Seconds until the circuit breaker lets a request through (0 while closed)"""
+        if self.failures < FAILURE_THRESHOLD:
+            return 0.0
+        # Open: nothing until the cooldown ends; half-open: one trial request at a time
+        return max(0.0, self.open_until - now, self.cooldown if self.trial else 0.0)
+
+    def ready_in(self, estimated_tokens, now):
+        """Seconds until this backend could take a request (rate budget and circuit breaker)"""
+        return max(self.limiter.available_in(estimated_tokens, now), self.breaker_wait(now))
+
+    def begin(self):
+        self.in_flight += 1
+        self.requests += 1
+        if self.failures >= FAILURE_THRESHOLD:
+            self.trial = True
+
+    def end(self):
+        self.in_flight -= 1
+
+    def record_success(self):
+        if self.failures >= FAILURE_THRESHOLD:
+            print(f"[{self.limiter.bot_name}] ✅ {self.name} recovered, circuit closed", flush=True)
+        self.failures = 0
+        self.open_until = 0.0
+        self.cooldown = BREAKER_COOLDOWN
+        self.trial = False
+
+    def record_failure(self):
+        self.errors += 1
+        self.failures += 1
+        if self.trial:
+            self.cooldown = min(self.cooldown * 2, MAX_BREAKER_COOLDOWN)
+            self.trial = False
+        if self.failures >= FAILURE_THRESHOLD:
+            self.open_until = time.time() + self.cooldown
+            print(f"[{self.limiter.bot_name}] ⚠️ {self.name} failed {self.failures} times in a row, "
+                  f"circuit open for {self.cooldown:.0f}s", flush=True)
+
+    async def close(self):
+        await self.client.close()
+        self.limiter.close()
+
+class PoolTicket:
+    """A reservation on one backend; failover moves it to the backend that served the request"""
+    __slots__ = ('backend', 'ticket', 'estimated_tokens')
+
+    def __init__(self, backend, ticket, estimated_tokens=0):
+        self.backend = backend
+        self.ticket = ticket
+        self.estimated_tokens = estimated_tokens
+
+class BackendPool:
+    """Completion client and rate limiter over several backends
+
+    Used in place of both a CompletionClient and a SharedRateLimiter: wait_if_needed()
+    reserves a slot on the backend with the most headroom (soonest available, then fewest
+    requests in flight, then most burst left), complete()/stream_complete() send on the backend the ticket was
+    reserved on, and record_usage() charges that backend. A backend answering 429, 401/403
+    or 5xx (or not answering) gets its reservation back and the request fails over to the
+    next best backend. Every response's rate-limit headers go into that backend's shared
+    state, so a 429 holds it off in every process for exactly the server's Retry-After;
+    when all backends are rate limited the request is retried with jittered backoff.
+
+    The first backend keeps the default rate limit state file, so a pool of one behaves
+    exactly like the plain client + shared limiter (and shares their budget). With
+    limiter_class=InMemoryRateLimiter the budgets live in this process only (bot_host.py).
+    """
+
+    def __init__(self, configs, bot_name="unknown", worker=None, state_file=RATE_LIMIT_FILE,
+                 period=RATE_LIMIT_PERIOD, transport=None, limiter_class=SharedRateLimiter):
+        if not configs:
+            raise ValueError("BackendPool needs at least one backend")
+        self.bot_name = bot_name
+        # One connection pool for every backend (keys on the same host reuse the same connections)
+        self.transport = transport if transport is not None else UpstreamTransport()
+        self._transport_errors = self.transport.errors()
+        state_file = Path(state_file)
+        self.backends = []
+        for i, config in enumerate(configs):
+            name = bot_name if len(configs) == 1 else f"{bot_name}@{config['name']}"
+            backend_state = state_file if i == 0 else state_file.with_name(f"{state_file.name}.{config['name']}")
+            self.backends.append(Backend(config, name, backend_state, worker, period, self.transport, limiter_class))
+        self.failovers = 0
+
+    def _choose(self, estimated_tokens, exclude=()):
+        """Backend with the most headroom (None once every backend has been tried)"""
+        candidates = [backend for backend in self.backends if backend not in exclude]
+        if len(candidates) <= 1:
+            return candidates[0] if candidates else None
+        now = time.time()
+        # Among backends that could send now, the one with the emptiest request bucket
+        # (earliest theoretical arrival time) has the most burst left
+        return min(candidates, key=lambda backend: (max(0.0, backend.ready_in(estimated_tokens, now)),
+                                                     backend.in_flight, backend.limiter.read_state()[0]))
+
+    async def wait_if_needed(self, estimated_tokens=0, exclude=()):
+        """Wait for room on the best backend (never blocks the event loop); returns a PoolTicket"""
+        backend = self._choose(estimated_tokens, exclude)
+        breaker_wait = backend.breaker_wait(time.time())
+        while breaker_wait > 0:
+            # Every backend's circuit is open or has its trial request in flight - wait for the
+            # next trial, then choose again (the trial may have closed or reopened a circuit)
+            await asyncio.sleep(breaker_wait)
+            backend = self._choose(estimated_tokens, exclude)
+            breaker_wait = backend.breaker_wait(time.time())
+        return PoolTicket(backend, await backend.limiter.wait_if_needed(estimated_tokens), estimated_tokens)
+
+    def available_in(self, estimated_tokens=0, now=None):
+        """Seconds until some backend could take a request of this size (reserves nothing)"""
+        if now is None:
+            now = time.time()
+        return min(backend.ready_in(estimated_tokens, now) for backend in self.backends)
+
+    def service_interval(self, estimated_tokens=0):
+        """Seconds between requests of this size that the backends sustain together"""
+        serving = [backend for backend in self.backends if backend.state != 'open'] or self.backends
+        return 1 / sum(1 / backend.limiter.service_interval(estimated_tokens) for backend in serving)
+
+    def record_usage(self, ticket, usage):
+        """Replace the reservation's estimated tokens with the real usage on its backend"""
+        if ticket is not None:
+            ticket.backend.limiter.record_usage(ticket.ticket, usage)
+
+    def set_demand(self, queued):
+        """Publish this worker's queue depth to every backend's budget"""
+        for backend in self.backends:
+            backend.limiter.set_demand(queued)
+
+    async def _request(self, send, ticket, can_retry=None):
+        """Send on the ticket's backend, failing over to the others on backend errors"""
+        estimated_tokens = ticket.estimated_tokens
+        tried = []
+        retries = 0
+        while True:
+            backend = ticket.backend
+            tried.append(backend)
+            result = error = None
+            backend.begin()
+            started = time.perf_counter()
+            try:
+                result = await send(backend.client)
+            except self._transport_errors as e:
+                error = e
+            finally:
+                backend.end()
+            UPSTREAM_LATENCY.labels(backend.name).observe(time.perf_counter() - started)
+            UPSTREAM_REQUESTS.labels(backend.name, type(error).__name__ if error is not None
+                                     else result.status_code).inc()
+
+            if result is not None:
+                # Every process sharing this backend's budget follows the server's own numbers
+                backend.limiter.apply_server_limits(result.rate_limit, rate_limited=result.status_code == 429)
+            if error is not None:
+                backend.record_failure()
+            elif result.status_code == 429:
+                # Healthy but out of budget (held off until its Retry-After), not a breaker failure
+                backend.record_success()
+                backend.rate_limited += 1
+            elif result.status_code in FAILOVER_STATUSES or result.status_code >= 500:
+                backend.record_failure()
+            else:
+                backend.record_success()
+                usage = result.usage
+                TOKENS_USED.labels(backend.name, 'prompt').inc(usage.get('prompt_tokens', 0))
+                TOKENS_USED.labels(backend.name, 'completion').inc(usage.get('completion_tokens', 0))
+                return result
+
+            # The request was refused, so it used none of this backend's tokens
+            backend.limiter.record_usage(ticket.ticket, {'total_tokens': 0})
+            jitter = None
+            if self._choose(estimated_tokens, tried) is None and result is not None and result.status_code == 429:
+                # Every backend is out of budget - retry on the one that frees up first
+                jitter = random.uniform(0, RETRY_JITTER * 2 ** retries)
+                soonest = min(other.ready_in(estimated_tokens, time.time()) for other in self.backends)
+                if retries < RATE_LIMIT_RETRIES and soonest + jitter <= MAX_RETRY_WAIT:
+                    retries += 1
+                    tried = []
+            if self._choose(estimated_tokens, tried) is None or (can_retry is not None and not can_retry()):
+                if error is not None:
+                    raise error
+                return result
+
+            if tried:
+                self.failovers += 1
+                retry = await self.wait_if_needed(estimated_tokens, exclude=tried)
+                reason = f"{type(error).__name__}" if error is not None else f"status {result.status_code}"
+                print(f"[{self.bot_name}] ↪️ {backend.name} failed ({reason}), retrying on {retry.backend.name}",
+                      flush=True)
+            else:
+                print(f"[{self.bot_name}] 🔁 Rate limited on every backend, retrying after "
+                      f"{soonest + jitter:.1f}s ({retries}/{RATE_LIMIT_RETRIES})", flush=True)
+                # Jitter first, then the limiter waits out the rest of the server's Retry-After
+                await asyncio.sleep(jitter)
+                retry = await self.wait_if_needed(estimated_tokens)
+            ticket.backend, ticket.ticket = retry.backend, retry.ticket
+
+    async def complete(self, messages, ticket=None, **overrides):
+        """Request a completion on the ticket's backend (reserving one first if no ticket is given)"""
+        if ticket is None:
+            ticket = await self.wait_if_needed()
+        return await self._request(lambda client: client.complete(messages, **overrides), ticket)
+
+    async def stream_complete(self, messages, on_delta=None, ticket=None, **overrides):
+        """Streamed completion on the ticket's backend (fails over only until the first text arrives)"""
+        if ticket is None:
+            ticket = await self.wait_if_needed()
+        received = []
+
+        def forward(delta):
+            received.append(delta)
+            if on_delta is not None:
+                on_delta(delta)
+
+        return await self._request(lambda client: client.stream_complete(messages, on_delta=forward, **overrides),
+                                   ticket, can_retry=lambda: not received)
+
+    def stats(self):
+        """Per-backend health and traffic"""
+        return [{
+            'name': backend.name,
+            'state': backend.state,
+            'in_flight': backend.in_flight,
+            'requests': backend.requests,
+            'errors': backend.errors,
+            'rate_limited': backend.rate_limited,
+        } for backend in self.backends]
+
+    async def close(self):
+        """Close every backend's rate limit state and the shared transport"""
+        for backend in self.backends:
+            await backend.close()
+        await self.transport.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+# Global instance (one pool per process)
+_backend_pool = None
+
+def get_backend_pool(bot_name="unknown", worker=None, api_key=None):
+    """Get or create the shared backend pool (backends from GROQ_API_KEY, GROQ_API_KEYS and LLM_BACKENDS)"""
+    global _backend_pool
+    if _backend_pool is None:
+        _backend_pool = BackendPool(load_backends(api_key), bot_name, worker=worker)
+    return _backend_pool
@@ -0,0 +1,90 @@
+"""
+Benchmark: Bot Host vs One Process per Bot
+Memory of N bots run as N discord_bot processes vs hosted together by bot_host.BotHost,
+and the per-message coordination cost (rate limit reservation + turn decision) with the
+flock'd state files vs the in-memory limiter and turn manager
+Run: python benchmarks/bench_bot_host.py --bots 3 --messages 20000
+"""
+
+import sys
+sys.dont_write_bytecode = True
+
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT))
+
+# Builds the bots without connecting them, then reports the process's peak RSS (KiB)
+CHILD = """
+import sys, json, resource
+from discord_bot import create_bot, load_config
+from bot_host import BotHost
+names = {names!r}
+configs = [dict(load_config({{'GROQ_API_KEY': 'offline'}}), bot_name=name) for name in names]
+if len(names) == 1:
+    bots = [create_bot(configs[0])]
+else:
+    bots = BotHost(configs).bots
+print(json.dumps(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+"""
+
+def peak_rss(names, state_dir):
+    env = {'PATH': '', 'RATE_LIMIT_STATE_FILE': str(Path(state_dir) / '.rate_limit_state')}
+    result = subprocess.run([sys.executable, '-c', CHILD.format(names=names)], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def coordination_cost(limiter, turns, bots, messages):
+    """Microseconds per message: every bot decides its turn, the responder reserves and records usage"""
+    started = time.perf_counter()
+    for message_id in range(1, messages + 1):
+        for bot in bots:
+            if turns.should_respond(bot, message_id):
+                _, ticket = limiter.reserve(0, now=0.0)
+                limiter.record_usage(ticket, {'total_tokens': 0})
+    return (time.perf_counter() - started) / messages * 1e6
+
+def main():
+    from shared_rate_limiter import SharedRateLimiter, InMemoryRateLimiter
+    from turn_manager import TurnManager, InMemoryTurnManager
+
+    parser = argparse.ArgumentParser(description='Bot host vs process-per-bot benchmark')
+    parser.add_argument('--bots', type=int, default=3)
+    parser.add_argument('--messages', type=int, default=20000, help='messages for the coordination cost')
+    args = parser.parse_args()
+    names = [f"Bot{i + 1}" for i in range(args.bots)]
+
+    with tempfile.TemporaryDirectory() as state_dir:
+        per_process = peak_rss(names[:1], state_dir)
+        hosted = peak_rss(names, state_dir)
+        print(f"Memory for {args.bots} bots:")
+        print(f"  one process per bot   {per_process * args.bots / 1024:7.1f} MiB  ({per_process / 1024:.1f} MiB per bot)")
+        print(f"  bot_host (one process) {hosted / 1024:7.1f} MiB  ({hosted / args.bots / 1024:.1f} MiB per bot)")
+        print(f"  -> {per_process * args.bots / hosted:.1f}x less memory\n")
+
+        # A huge budget so reservations never wait: this measures coordination overhead only
+        budget = {'requests_per_minute': 10 ** 9, 'request_burst': 10 ** 9, 'tokens_per_minute': 10 ** 9}
+        shared = SharedRateLimiter('bench', Path(state_dir) / '.rate_limit_state', **budget)
+        file_turns = TurnManager(names, state_file=Path(state_dir) / '.turn_state')
+        file_cost = coordination_cost(shared, file_turns, names, args.messages)
+        shared.close()
+        file_turns.close()
+
+        local = InMemoryRateLimiter('bench', **budget)
+        local_turns = InMemoryTurnManager(names)
+        memory_cost = coordination_cost(local, local_turns, names, args.messages)
+        local.close()
+        local_turns.close()
+
+    print(f"Coordination per message ({args.bots} turn decisions + 1 reservation, {args.messages} messages):")
+    print(f"  state files + flock    {file_cost:7.1f} us")
+    print(f"  in memory (bot_host)   {memory_cost:7.1f} us")
+    print(f"  -> {file_cost / memory_cost:.1f}x faster")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Benchmark: Prompt Prefix Stability
+Share of every request that is byte-identical to the start of the same conversation's
+previous request (what a provider's prompt/prefix cache can reuse), for the sliding context
+window vs the stable prefix mode, with and without the running summary, plus the prompt
+tokens sent per request
+Run: python benchmarks/bench_context_prefix.py --users 50 --turns 40 --budget 1000
+"""
+
+import sys
+sys.dont_write_bytecode = True
+
+import random
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from context_builder import ContextBuilder, count_message_tokens
+from conversation_store import Conversation
+from fake_discord import PROMPTS
+
+PERSONALITY = "You are a helpful and friendly AI assistant. Keep responses concise. " * 10
+
+def simulate(builder, users, turns, seed, summarize):
+    """Prompt tokens per request over `users` conversations of `turns` exchanges"""
+    rng = random.Random(seed)
+    system = {'role': 'system', 'content': PERSONALITY}
+    tokens = []
+    for _ in range(users):
+        conversation = Conversation(system, summarize=summarize)
+        for _ in range(turns):
+            conversation.append('user', ' '.join(rng.choice(PROMPTS) for _ in range(rng.randint(1, 3))))
+            tokens.append(count_message_tokens(builder.build(conversation)))
+            conversation.append('assistant', ' '.join(rng.choice(PROMPTS) for _ in range(rng.randint(2, 8))))
+    return sum(tokens) / len(tokens)
+
+def main():
+    parser = argparse.ArgumentParser(description='Prompt prefix stability benchmark')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--turns', type=int, default=40, help='exchanges per conversation')
+    parser.add_argument('--budget', type=int, default=1000, help='CONTEXT_TOKEN_BUDGET')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{args.users} conversations x {args.turns} exchanges, {args.budget}-token context budget")
+    print(f"  {'layout':<28} {'identical prefix':>16} {'prompt tokens':>14} {'checkpoints':>12}")
+    for stable_prefix in (False, True):
+        for summarize in (False, True):
+            builder = ContextBuilder(args.budget, summarize=summarize, stable_prefix=stable_prefix)
+            tokens = simulate(builder, args.users, args.turns, args.seed, summarize)
+            stats = builder.stats()
+            layout = ('stable prefix' if stable_prefix else 'sliding window') + (' + summary' if summarize else '')
+            print(f"  {layout:<28} {stats['prefix_reuse']:>15.0%} {tokens:>14.0f} {stats['checkpoints']:>12}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Benchmark: Conversation Persistence Overhead
+Measures per-message cost of ConversationStore.append with and without the SQLite
+write-behind backend, and the cost of lazy-loading a history after a restart
+Run: python benchmarks/bench_conversation_db.py --users 1000 --messages 20000
+"""
+
+import sys
+sys.dont_write_bytecode = True
+
+import os
+import time
+import random
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from conversation_store import ConversationStore
+from conversation_db import ConversationDB
+
+PERSONALITY = "You are a helpful and friendly AI assistant. " * 20
+
+def run_messages(store, users, messages, seed=1):
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    for i in range(messages):
+        user_id = rng.randrange(users)
+        store.append(user_id, 'user', f"message {i} from user {user_id}, how's it going?")
+        store.append(user_id, 'assistant', "Doing great, thanks for asking! What have you been up to today?")
+    return (time.perf_counter() - start) / (messages * 2) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description='Conversation persistence overhead benchmark')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=20000)
+    args = parser.parse_args()
+
+    memory_only = run_messages(ConversationStore(PERSONALITY), args.users, args.messages)
+    print(f"in-memory store:          {memory_only:6.2f} us per turn")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'conversations.db')
+        db = ConversationDB(path)
+        persisted = run_messages(ConversationStore(PERSONALITY, backend=db), args.users, args.messages)
+        print(f"with SQLite write-behind: {persisted:6.2f} us per turn  (+{persisted - memory_only:.2f} us)")
+
+        start = time.perf_counter()
+        db.flush(timeout=120)
+        print(f"background flush of the remaining queue: {time.perf_counter() - start:.2f}s")
+        db.close()
+
+        # Simulated restart: a fresh store lazily loads each user's history on first access
+        db = ConversationDB(path)
+        store = ConversationStore(PERSONALITY, backend=db)
+        start = time.perf_counter()
+        for user_id in range(args.users):
+            store.get(user_id)
+        load = (time.perf_counter() - start) / args.users * 1e6
+        turns = sum(len(store.get(user_id)) for user_id in range(args.users))
+        print(f"lazy load after restart:  {load:6.2f} us per user ({turns} turns restored)")
+        db.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Benchmark: Per-User vs Per-Channel Conversation History
+Memory held and context seen when a busy channel is stored as one history per user
+(CONVERSATION_SCOPE=user) vs one shared ring buffer per channel with per-user views
+(CONVERSATION_SCOPE=channel), plus the time to append a message and build its request
+Run: python benchmarks/bench_conversation_scope.py --users 500 --channels 5 --messages 20000
+"""
+
+import sys
+sys.dont_write_bytecode = True
+
+import time
+import random
+import argparse
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from context_builder import ContextBuilder
+from conversation_store import ConversationStore, MAX_HISTORY_TURNS, CHANNEL_HISTORY_TURNS
+from fake_discord import PROMPTS
+
+PERSONALITY = "You are a helpful and friendly AI assistant. Keep responses concise."
+
+def run(scope, args):
+    """(store, KiB allocated, us per message, average other users' turns in each request)"""
+    rng = random.Random(args.seed)
+    store = ConversationStore(PERSONALITY, max_turns=CHANNEL_HISTORY_TURNS if scope == 'channel' else MAX_HISTORY_TURNS,
+                              max_conversations=10 ** 6, memory_limit=1 << 40, scope=scope)
+    builder = ContextBuilder()
+    others = 0
+    tracemalloc.start()
+    started = time.perf_counter()
+    for i in range(args.messages):
+        user = rng.randrange(args.users)
+        channel = user % args.channels
+        name = f"user{user}"
+        if scope == 'channel':
+            conversation = store.append(channel, 'user', f"{name}: {rng.choice(PROMPTS)}")
+        else:
+            conversation = store.append(user, 'user', rng.choice(PROMPTS))
+        messages = builder.build(conversation)
+        others += sum(1 for m in messages if m['role'] == 'user' and not m['content'].startswith(name + ':')) \
+            if scope == 'channel' else 0
+        store.append(channel if scope == 'channel' else user, 'assistant', f"Reply {i}: {rng.choice(PROMPTS)}")
+    elapsed = time.perf_counter() - started
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return store, allocated / 1024, elapsed / args.messages * 1e6, others / args.messages
+
+def main():
+    parser = argparse.ArgumentParser(description='Conversation scope benchmark')
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--channels', type=int, default=5)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{args.messages} messages from {args.users} users in {args.channels} channels")
+    for scope in ('user', 'channel'):
+        store, allocated, micros, others = run(scope, args)
+        print(f"  {scope:<8} {len(store):5} histories  {store.memory_used / 1024:8.0f} KiB of turns  "
+              f"{allocated:8.0f} KiB allocated  {micros:6.1f} us/message  "
+              f"{others:4.1f} other users' messages in context")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Benchmark: Import Time and Cold Start
+Runs each entry point in fresh interpreters under `python -X importtime` and reports the
+median time to import it, the slowest imports, and whether the heavy optional libraries
+(discord.py, dotenv, aiohttp, sqlite3, httpx) stayed unloaded until they are needed
+Exits with status 1 if one was imported eagerly or a --budget-ms is exceeded, for CI
+Run: python benchmarks/bench_import_time.py --runs 5
+"""
+
+import sys
+sys.dont_write_bytecode = True
+
+import os
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+
+# Libraries the entry points must not load at import (only when the bot/chat actually runs)
+LAZY_MODULES = ('discord', 'dotenv', 'aiohttp', 'sqlite3', 'httpx')
+
+# name -> code timed in a fresh interpreter
+SCENARIOS = {
+    'import chat': 'import chat',
+    'import discord_bot': 'import discord_bot',
+    'import discord': 'import discord',
+    'create_bot (cold start)': "import discord_bot\n"
+                               "discord_bot.create_bot(discord_bot.load_config({'GROQ_API_KEY': 'offline'}))",
+}
+
+CHILD = """
+import sys, time, json
+started = time.perf_counter()
+exec(compile({code!r}, '<scenario>', 'exec'))
+elapsed = time.perf_counter() - started
+print(json.dumps({{'elapsed': elapsed, 'loaded': [name for name in {lazy!r} if name in sys.modules]}}))
+"""
+
+def parse_importtime(stderr):
+    """{module: microseconds spent in the module itself} from -X importtime output"""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        own, _, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = int(own)
+    return modules
+
+def run_scenario(code, state_dir):
+    env = dict(os.environ, RATE_LIMIT_STATE_FILE=str(Path(state_dir) / '.rate_limit_state'))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD.format(code=code, lazy=LAZY_MODULES)],
+                            cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    outcome = json.loads(result.stdout.strip().splitlines()[-1])
+    outcome['modules'] = parse_importtime(result.stderr)
+    return outcome
+
+def main():
+    parser = argparse.ArgumentParser(description='Entry point import time benchmark')
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per scenario')
+    parser.add_argument('--top', type=int, default=6, help='slowest modules to list per scenario')
+    parser.add_argument('--budget-ms', type=float, default=0, help='fail if importing an entry point takes longer')
+    args = parser.parse_args()
+
+    problems = []
+    with tempfile.TemporaryDirectory() as state_dir:
+        for name, code in SCENARIOS.items():
+            runs = [run_scenario(code, state_dir) for _ in range(args.runs)]
+            elapsed = statistics.median(run['elapsed'] for run in runs) * 1000
+            print(f"{name:<26} {elapsed:7.1f} ms (median of {args.runs})")
+            slowest = sorted(runs[-1]['modules'].items(), key=lambda item: item[1], reverse=True)[:args.top]
+            print('    ' + ', '.join(f"{module} {micros / 1000:.1f}ms" for module, micros in slowest))
+
+            if name.startswith('import ') and name != 'import discord':
+                if runs[-1]['loaded']:
+                    problems.append(f"{name} loads {', '.join(runs[-1]['loaded'])} eagerly")
+                if args.budget_ms and elapsed > args.budget_ms:
+                    problems.append(f"{name} took {elapsed:.0f} ms (budget {args.budget_ms:.0f} ms)")
+
+    for problem in problems:
+        print(f"❌ {problem}")
+    if not problems:
+        print(f"\n✅ Entry points import without {', '.join(LAZY_MODULES)}")
+    sys.exit(1 if problems else 0)
+
+if __name__ == '__main__':
+    main()
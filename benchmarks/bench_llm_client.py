@@ -0,0 +1,86 @@
+"""
+Benchmark: Concurrent Completion Throughput
+Compares the old blocking requests.post path with the async pooled CompletionClient
+against a local mock server (no API key or network needed), and reports how many requests
+reused a pooled connection over several rounds
+Run: python benchmarks/bench_llm_client.py --requests 50 --latency 0.2 --rounds 3 [--http2]
+"""
+
+import sys
+sys.dont_write_bytecode = True
+
+import time
+import asyncio
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import requests
+from llm_client import CompletionClient
+from upstream_transport import UpstreamTransport
+from mock_server import MockServer
+
+MESSAGES = [
+    {'role': 'system', 'content': 'You are a helpful assistant.'},
+    {'role': 'user', 'content': "hey what's up?"}
+]
+
+async def blocking_handler(url):
+    """What discord_bot.on_message used to do: requests.post inside a coroutine"""
+    response = requests.post(
+        url,
+        headers={'Authorization': 'Bearer mock', 'Content-Type': 'application/json'},
+        json={'model': 'llama-3.1-8b-instant', 'messages': MESSAGES, 'max_tokens': 200, 'temperature': 0.9},
+        timeout=15
+    )
+    return response.status_code
+
+async def run_blocking(url, count):
+    start = time.perf_counter()
+    statuses = await asyncio.gather(*(blocking_handler(url) for _ in range(count)))
+    return time.perf_counter() - start, statuses
+
+async def run_async(url, count, rounds=1, http2=False):
+    """`rounds` waves of `count` concurrent requests; later waves can reuse the first wave's connections"""
+    async with UpstreamTransport({'http2': http2}) as transport:
+        client = CompletionClient('mock', api_url=url, transport=transport)
+        start = time.perf_counter()
+        statuses = []
+        for _ in range(rounds):
+            results = await asyncio.gather(*(client.complete(MESSAGES) for _ in range(count)))
+            statuses.extend(r.status_code for r in results)
+        elapsed = time.perf_counter() - start
+        return elapsed, statuses, transport.stats()
+
+def report(label, count, elapsed, statuses):
+    ok = sum(1 for s in statuses if s == 200)
+    print(f"{label:<28} {count} requests in {elapsed:6.2f}s  ->  {count / elapsed:7.1f} req/s  ({ok}/{count} ok)")
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent completion throughput benchmark')
+    parser.add_argument('--requests', type=int, default=50, help='concurrent conversations')
+    parser.add_argument('--latency', type=float, default=0.2, help='mock server latency per completion (s)')
+    parser.add_argument('--rounds', type=int, default=3, help='waves of requests on the pooled client')
+    parser.add_argument('--http2', action='store_true', help='use the httpx HTTP/2 transport')
+    args = parser.parse_args()
+
+    with MockServer(latency=args.latency) as server:
+        print(f"Mock server: {server.url} (latency {args.latency}s)\n")
+        elapsed, statuses = asyncio.run(run_blocking(server.url, args.requests))
+        report('before (blocking requests)', args.requests, elapsed, statuses)
+        blocking_elapsed = elapsed
+
+        elapsed, statuses, stats = asyncio.run(run_async(server.url, args.requests))
+        report('after (async client)', args.requests, elapsed, statuses)
+
+        print(f"\nSpeedup: {blocking_elapsed / elapsed:.1f}x")
+
+        elapsed, statuses, stats = asyncio.run(run_async(server.url, args.requests, args.rounds, args.http2))
+        print()
+        report(f"pooled, {args.rounds} rounds", len(statuses), elapsed, statuses)
+        print(f"Connections: {stats['new_connections']} opened, {stats['reused_connections']} reused "
+              f"({stats['reuse_rate']:.0%} reuse), protocols {stats['protocols']}")
+
+if __name__ == '__main__':
+    main()
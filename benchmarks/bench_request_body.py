@@ -0,0 +1,92 @@
+"""
+Benchmark: Request Body Encoding
+CPU time and allocations per request for building the JSON body (plus the scheduler's
+coalescing key) of a conversation with a long system prompt: json.dumps of the whole payload
+every time vs joining pre-encoded, cached message segments (request_body)
+Run: python benchmarks/bench_request_body.py --personality-chars 4000 --turns 12
+"""
+
+import sys
+sys.dont_write_bytecode = True
+
+import json
+import time
+import random
+import hashlib
+import argparse
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from llm_client import CompletionClient
+from request_scheduler import prompt_key
+from fake_discord import PROMPTS
+
+def old_request(client, messages):
+    """Previous path: the transport's json= encoding plus the scheduler's own json.dumps"""
+    key = hashlib.sha1(json.dumps(messages, separators=(',', ':'), ensure_ascii=False).encode()).hexdigest()
+    return key, json.dumps(client.build_payload(messages)).encode()
+
+def new_request(client, messages):
+    return prompt_key(messages), client.build_body(messages)
+
+def conversations(count, turns, personality, seed):
+    """Request message lists the way the bot sends them: a sliding window over each history"""
+    rng = random.Random(seed)
+    system = {'role': 'system', 'content': personality}
+    history = []
+    requests = []
+    for i in range(count):
+        history.append({'role': 'user', 'content': f"{rng.choice(PROMPTS)} ({i})"})
+        requests.append([system] + history[-turns:])
+        history.append({'role': 'assistant', 'content': f"Reply number {i}: " + rng.choice(PROMPTS) * 3})
+    return requests
+
+def measure(build, client, requests, samples=200):
+    """(microseconds per request, average peak bytes allocated while building one request)"""
+    started = time.perf_counter()
+    for messages in requests:
+        build(client, messages)
+    elapsed = time.perf_counter() - started
+
+    # Peak memory in use while building (the body plus every temporary), above the baseline
+    tracemalloc.start()
+    transient = 0
+    for messages in requests[-samples:]:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        build(client, messages)
+        transient += tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    return elapsed / len(requests) * 1e6, transient / min(samples, len(requests))
+
+def main():
+    parser = argparse.ArgumentParser(description='Request body encoding benchmark')
+    parser.add_argument('--personality-chars', type=int, default=4000, help='system prompt length')
+    parser.add_argument('--turns', type=int, default=12, help='history turns per request')
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    personality = ("You are a helpful assistant with a distinct voice. Keep replies short. " *
+                   (args.personality_chars // 70 + 1))[:args.personality_chars]
+    client = CompletionClient('offline')
+    requests = conversations(args.requests, args.turns, personality, args.seed)
+
+    # Both paths must send the same request
+    for messages in requests[:50]:
+        old_key, old_body = old_request(client, messages)
+        new_key, new_body = new_request(client, messages)
+        assert json.loads(old_body) == json.loads(new_body) and old_key == new_key
+
+    print(f"{args.requests} requests, {args.personality_chars}-char system prompt, {args.turns} turns each "
+          f"(body ~{len(new_request(client, requests[-1])[1]) / 1024:.1f} KiB)")
+    (old_cpu, old_memory), (new_cpu, new_memory) = (measure(build, client, requests)
+                                                    for build in (old_request, new_request))
+    print(f"  json.dumps per request  {old_cpu:7.1f} us/request  {old_memory / 1024:6.1f} KiB allocated at peak")
+    print(f"  cached segments         {new_cpu:7.1f} us/request  {new_memory / 1024:6.1f} KiB allocated at peak")
+    print(f"  -> {old_cpu / new_cpu:.1f}x less CPU, {old_memory / new_memory:.1f}x less memory per request")
+
+if __name__ == '__main__':
+    main()
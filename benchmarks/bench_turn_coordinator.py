@@ -0,0 +1,128 @@
+"""
+Benchmark: Turn Coordination
+Several bot processes ask "should I respond to message X" for the same stream of messages:
+through the file-based TurnManager (flock per call), its lock-free snapshot mode (only the
+responder takes the lock) and the in-memory turn coordinator over a Unix socket
+Reports decisions/sec, messages without exactly one responder and decay updates recorded
+Run: python benchmarks/bench_turn_coordinator.py --bots 3 --messages 2000
+"""
+
+import sys
+sys.dont_write_bytecode = True
+
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from turn_manager import TurnManager
+from turn_coordinator import TurnCoordinator, TurnCoordinatorClient
+
+# Discord-style message ids (increasing integers)
+FIRST_MESSAGE_ID = 1_200_000_000_000_000_000
+# Every bot sees a message at about the same time - bots sync up after this many messages
+# so one process cannot run hundreds of messages ahead of the others
+MESSAGES_PER_SYNC = 16
+
+def message_ids(messages, barriers):
+    """The message stream every bot sees; the first wait also releases the timer"""
+    ready, sync = barriers
+    ready.wait()
+    for i in range(messages):
+        if i and i % MESSAGES_PER_SYNC == 0:
+            sync.wait()
+        yield FIRST_MESSAGE_ID + i
+
+def file_worker(directory, bot_name, bots, messages, barriers, results, lock_free=False):
+    manager = TurnManager(bots, state_file=Path(directory) / '.turn_state', lock_free=lock_free)
+    results.put([manager.should_respond(bot_name, message_id) for message_id in message_ids(messages, barriers)])
+
+def lock_free_worker(directory, bot_name, bots, messages, barriers, results):
+    file_worker(directory, bot_name, bots, messages, barriers, results, lock_free=True)
+
+def coordinator_worker(socket_path, bot_name, bots, messages, barriers, results):
+    async def run():
+        client = TurnCoordinatorClient(socket_path)
+        answers = [await client.should_respond(bot_name, message_id) for message_id in message_ids(messages, barriers)]
+        await client.close()
+        return answers
+    results.put(asyncio.run(run()))
+
+def run_bots(target, argument, bots, messages):
+    """Start one process per bot, release them together and time until all are done"""
+    # The timer starts once every bot is ready for the first message
+    ready = multiprocessing.Barrier(len(bots) + 1)
+    barriers = (ready, multiprocessing.Barrier(len(bots)))
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=target, args=(argument, bot, bots, messages, barriers, results))
+                 for bot in bots]
+    for process in processes:
+        process.start()
+    ready.wait()
+    start = time.perf_counter()
+    answers = [results.get() for _ in processes]
+    elapsed = time.perf_counter() - start
+    for process in processes:
+        process.join()
+    # Exactly one bot must answer "yes" for every message
+    conflicts = sum(sum(responses) != 1 for responses in zip(*answers))
+    return len(bots) * messages / elapsed, conflicts
+
+def published_updates(directory, bots):
+    """Decay updates recorded in the state file (one per message is the goal)"""
+    manager = TurnManager(bots, state_file=Path(directory) / '.turn_state')
+    updates = manager.version() - 1
+    manager.close()
+    return updates
+
+def start_coordinator(socket_path, bots):
+    """Run the coordinator on its own event loop in a background thread"""
+    loop = asyncio.new_event_loop()
+    coordinator = TurnCoordinator(socket_path, bots)
+    ready = threading.Event()
+
+    def serve():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(coordinator.start())
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=serve, daemon=True).start()
+    ready.wait()
+    return coordinator
+
+def main():
+    parser = argparse.ArgumentParser(description='Turn coordination benchmark')
+    parser.add_argument('--bots', type=int, default=3)
+    parser.add_argument('--messages', type=int, default=2000)
+    args = parser.parse_args()
+    bots = [f"Bot{i + 1}" for i in range(args.bots)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        locked_dir = os.path.join(directory, 'locked')
+        rate, conflicts = run_bots(file_worker, locked_dir, bots, args.messages)
+        print(f"file-based TurnManager (flock): {rate:10,.0f} decisions/sec  "
+              f"({conflicts}/{args.messages} messages without exactly one responder, "
+              f"{published_updates(locked_dir, bots)} decay updates)")
+
+        lock_free_dir = os.path.join(directory, 'lock-free')
+        rate_lock_free, conflicts = run_bots(lock_free_worker, lock_free_dir, bots, args.messages)
+        print(f"lock-free snapshot:             {rate_lock_free:10,.0f} decisions/sec  "
+              f"({conflicts}/{args.messages} messages without exactly one responder, "
+              f"{published_updates(lock_free_dir, bots)} decay updates)")
+
+        socket_path = os.path.join(directory, 'coordinator.sock')
+        coordinator = start_coordinator(socket_path, bots)
+        rate_coordinated, conflicts = run_bots(coordinator_worker, socket_path, bots, args.messages)
+        print(f"turn coordinator (socket):      {rate_coordinated:10,.0f} decisions/sec  "
+              f"({conflicts}/{args.messages} messages without exactly one responder, "
+              f"{coordinator.selections} selections, {coordinator.cache_hits} cache hits)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark: Turn Selection vs Number of Bots
+Cost of one responder selection as the number of bots grows, for the old path (flock +
+parse an N-line text file, O(N) recovery/normalize/choices, rewrite the file) and the
+Fenwick-tree TurnManager (in-place updates in a memory-mapped file)
+Run: python benchmarks/bench_turn_scaling.py --selections 2000
+"""
+
+import sys
+sys.dont_write_bytecode = True
+
+import os
+import time
+import fcntl
+import random
+import hashlib
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from turn_manager import TurnManager, DECAY_FACTOR, RECOVERY_FACTOR, MIN_PROBABILITY
+
+BOT_COUNTS = (3, 10, 30, 100, 300, 1000)
+
+def legacy_select(bots, lock_path, state_path, message_id):
+    """The old algorithm generalized to N bots: one text line per bot, rewritten every time"""
+    with open(lock_path, 'a+') as lock_f:
+        fcntl.flock(lock_f.fileno(), fcntl.LOCK_EX)
+        try:
+            probabilities = {bot: 1.0 for bot in bots}
+            if os.path.exists(state_path):
+                with open(state_path, 'r') as f:
+                    lines = f.read().strip().split('\n')
+                    probabilities = {bot: float(line) for bot, line in zip(bots, lines[1:])}
+            for bot in probabilities:
+                if probabilities[bot] < 1.0:
+                    probabilities[bot] = min(1.0, probabilities[bot] * RECOVERY_FACTOR)
+            total = sum(probabilities.values())
+            normalized = {k: v / total for k, v in probabilities.items()}
+            seed = int(hashlib.md5(str(message_id).encode()).hexdigest()[:8], 16)
+            selected = random.Random(seed).choices(list(normalized.keys()), weights=list(normalized.values()), k=1)[0]
+            new_probs = probabilities.copy()
+            new_probs[selected] = max(MIN_PROBABILITY, probabilities[selected] * DECAY_FACTOR)
+            with open(state_path, 'w') as f:
+                f.write(f"{selected}\n")
+                for bot in bots:
+                    f.write(f"{new_probs[bot]}\n")
+            return selected
+        finally:
+            fcntl.flock(lock_f.fileno(), fcntl.LOCK_UN)
+
+def main():
+    parser = argparse.ArgumentParser(description='Turn selection scaling benchmark')
+    parser.add_argument('--selections', type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'bots':>6}  {'old text file':>14}  {'Fenwick mmap':>13}  {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        for count in BOT_COUNTS:
+            bots = [f"bot-{i}" for i in range(count)]
+            lock_path = os.path.join(directory, f'legacy-{count}.lock')
+            state_path = os.path.join(directory, f'legacy-{count}.state')
+            start = time.perf_counter()
+            for i in range(args.selections):
+                legacy_select(bots, lock_path, state_path, f"msg-{i}")
+            legacy = (time.perf_counter() - start) / args.selections * 1e6
+
+            manager = TurnManager(bots, state_file=os.path.join(directory, f'turns-{count}.state'))
+            start = time.perf_counter()
+            for i in range(args.selections):
+                manager.select_responder(f"msg-{i}")
+            fenwick = (time.perf_counter() - start) / args.selections * 1e6
+            manager.close()
+
+            print(f"{count:>6}  {legacy:>11.1f} us  {fenwick:>10.1f} us  {legacy / fenwick:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Fake Discord Gateway
+Stand-ins for the discord.py objects discord_bot.on_message touches (messages, channels,
+users), a deterministic synthetic message stream from many users and channels, and a
+fake login that gives the bot a user - so the real handler can be driven fully offline
+"""
+
+import sys
+sys.dont_write_bytecode = True
+
+import time
+import random
+import asyncio
+
+# Discord-style snowflake ids for the synthetic users, channels and messages
+FIRST_USER_ID = 100_000_000_000_000_000
+FIRST_CHANNEL_ID = 200_000_000_000_000_000
+FIRST_MESSAGE_ID = 1_300_000_000_000_000_000
+BOT_USER_ID = 999_000_000_000_000_000
+
+PROMPTS = (
+    "hey what's up?", "how's your day going", "any good movie recommendations?",
+    "i just got back from the gym", "what do you think about pineapple on pizza",
+    "can you help me name my cat", "lol that's funny", "what's the best way to learn python?",
+    "tell me something interesting", "good morning!", "i'm bored", "what are you up to tonight?",
+)
+
+class FakeUser:
+    def __init__(self, user_id, name, bot=False):
+        self.id = user_id
+        self.name = name
+        self.display_name = name
+        self.bot = bot
+        self.mention = f"<@{user_id}>"
+
+    def __eq__(self, other):
+        return isinstance(other, FakeUser) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+class FakeSentMessage:
+    """A message the bot sent (streaming replies edit it)"""
+
+    def __init__(self, channel, content):
+        self.channel = channel
+        self.content = content
+
+    async def edit(self, content=None):
+        if self.channel.send_latency:
+            await asyncio.sleep(self.channel.send_latency)
+        self.channel.edits += 1
+        self.channel.edit_times.append(time.perf_counter())
+        self.content = content
+
+class _Typing:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+class FakeChannel:
+    """Records what the bot sends; `send_latency` simulates the Discord REST round trip (send and edit)"""
+
+    def __init__(self, channel_id, send_latency=0.0):
+        self.id = channel_id
+        self.send_latency = send_latency
+        self.sent = []
+        self.edits = 0
+        self.edit_times = []
+        # Set by the driver to learn when a message has been answered
+        self.on_send = None
+
+    def typing(self):
+        return _Typing()
+
+    async def send(self, content):
+        if self.send_latency:
+            await asyncio.sleep(self.send_latency)
+        message = FakeSentMessage(self, content)
+        self.sent.append(message)
+        if self.on_send is not None:
+            self.on_send(self, content)
+        return message
+
+class FakeMessage:
+    """The attributes of discord.Message that on_message and process_commands read"""
+
+    def __init__(self, message_id, author, channel, content, mentions=()):
+        self.id = message_id
+        # The model's full answer to this message (recorded by the load test)
+        self.response = None
+        self.author = author
+        self.channel = channel
+        self.content = content
+        self.mentions = list(mentions)
+        self.guild = None
+        self.created_at = time.time()
+        self._state = None
+
+def login(bot, name='LoadTestBot', user_id=BOT_USER_ID):
+    """Give the bot a user as if the gateway's READY event had arrived; returns it"""
+    user = FakeUser(user_id, name, bot=True)
+    bot._connection.user = user
+    return user
+
+def message_stream(count, users=100, channels=10, mention=None, seed=0, send_latency=0.0):
+    """A deterministic list of `count` messages from `users` users across `channels` channels
+
+    Every bot that builds the stream with the same arguments gets the same message ids,
+    authors and contents (several bots watching the same channels). Messages mention
+    `mention` (the bot user) when given. Each message gets its own view of its channel,
+    so message.channel.sent holds exactly this bot's replies to that message.
+    """
+    rng = random.Random(seed)
+    authors = [FakeUser(FIRST_USER_ID + i, f"user{i}") for i in range(users)]
+    messages = []
+    for i in range(count):
+        author = rng.choice(authors)
+        content = rng.choice(PROMPTS)
+        if mention is not None:
+            content = f"{mention.mention} {content}"
+        channel = FakeChannel(FIRST_CHANNEL_ID + rng.randrange(channels), send_latency)
+        messages.append(FakeMessage(FIRST_MESSAGE_ID + i, author, channel, content,
+                                    [mention] if mention is not None else ()))
+    return messages
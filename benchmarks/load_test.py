@@ -0,0 +1,397 @@
+"""
+Load Test
+Offline end-to-end load harness: a mock Groq server (latency, Groq-style request/token
+limits, injected 429s, streaming) driven through chat.py's request path and through
+discord_bot.on_message with a synthetic message stream from many users and channels, the
+latter from several bot processes sharing shared_rate_limiter and turn_manager state (or,
+with --host, from every bot hosted in one process by bot_host)
+Reports throughput, p50/p95/p99 latency and rate-limit violations; exits with status 1 on
+any violation, turn conflict, failed or truncated reply, burst of streaming edits over Discord's
+per-channel limit or request superseded by another bot's so CI can catch regressions
+Run: python benchmarks/load_test.py --bots 3 --messages 300 --period 1
+"""
+
+import sys
+sys.dont_write_bytecode = True
+
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import contextvars
+import multiprocessing
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from mock_server import MockServer, ServerLimits
+from fake_discord import message_stream, login, PROMPTS, BOT_USER_ID, FIRST_CHANNEL_ID
+
+# Groq free tier limits, enforced by the mock server over a compressed period
+RATE_LIMIT = 30      # requests per period
+TOKEN_LIMIT = 6000   # tokens per period
+
+# Reply sent when the request scheduler turns a request away under overload
+SHED_NOTICE = '⏳ Too busy'
+
+# The bot whose on_message is running in the current task, and the message it handles (set by the harness)
+DELIVERING_BOT = contextvars.ContextVar('delivering_bot', default=None)
+DELIVERING_MESSAGE = contextvars.ContextVar('delivering_message', default=None)
+
+# Discord's edit limit: about 5 message edits per 5 seconds in a channel (per bot)
+EDIT_WINDOW = 5.0  # seconds
+EDIT_LIMIT = 5
+
+def percentile(samples, p):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+def latency_report(latencies):
+    return (f"p50 {percentile(latencies, 0.50):5.2f}s  p95 {percentile(latencies, 0.95):5.2f}s  "
+            f"p99 {percentile(latencies, 0.99):5.2f}s")
+
+def make_pool(url, name, state_dir, period, in_memory=False):
+    """One mock backend with the Groq free tier limits, accounted over `period` seconds"""
+    from backend_pool import BackendPool, backend_config
+    from shared_rate_limiter import SharedRateLimiter, InMemoryRateLimiter
+    return BackendPool([backend_config(url, 'mock', 'mock', RATE_LIMIT, TOKEN_LIMIT)], name,
+                       state_file=Path(state_dir) / '.rate_limit_state', period=period,
+                       limiter_class=InMemoryRateLimiter if in_memory else SharedRateLimiter)
+
+async def replay(messages, rate, handle):
+    """Deliver messages at a steady rate, like a busy set of channels; returns the elapsed time"""
+    tasks = []
+    start = time.perf_counter()
+    for i, message in enumerate(messages):
+        delay = start + i / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.get_running_loop().create_task(handle(i, message)))
+    await asyncio.gather(*tasks)
+    return time.perf_counter() - start
+
+def served(message):
+    """Whether the bot answered the message (not turned away, not superseded by a newer one)"""
+    return any(not sent.content.startswith(SHED_NOTICE) for sent in message.channel.sent)
+
+def peak_edits(stream):
+    """Most edits one bot made in a single channel within any EDIT_WINDOW seconds"""
+    channels = {}
+    for message in stream:
+        channels.setdefault(message.channel.id, []).extend(message.channel.edit_times)
+    peak = 0
+    for times in channels.values():
+        times.sort()
+        first = 0
+        for last, at in enumerate(times):
+            while at - times[first] >= EDIT_WINDOW:
+                first += 1
+            peak = max(peak, last - first + 1)
+    return peak
+
+def watch_scheduler(scheduler):
+    """Count the scheduler's superseded requests per bot (wraps submit; DELIVERING_BOT names the bot)
+
+    Also counts requests replaced by anything other than the same bot's next request for
+    that user and channel - with several bots on one scheduler, a bot's request must never
+    cancel another bot's - and records each answer on its message (message.response).
+    """
+    from request_scheduler import RequestSuperseded
+    submit = scheduler.submit
+    submitted = Counter()  # (bot, user, channel) -> requests submitted
+    counts = {'per_bot': Counter(), 'foreign': 0}
+
+    async def counting_submit(messages, user_id, **kwargs):
+        key = (DELIVERING_BOT.get(), user_id, kwargs.get('channel_id'))
+        submitted[key] += 1
+        number = submitted[key]
+        try:
+            result = await submit(messages, user_id, **kwargs)
+        except RequestSuperseded:
+            counts['per_bot'][key[0]] += 1
+            if submitted[key] == number:
+                counts['foreign'] += 1
+            raise
+        if result.status_code == 200 and DELIVERING_MESSAGE.get() is not None:
+            DELIVERING_MESSAGE.get().response = result.content
+        return result
+
+    scheduler.submit = counting_submit
+    return counts
+
+def shown(message):
+    """What the bot's reply to a message finally shows (its chunks, after every edit)"""
+    return ''.join(sent.content for sent in message.channel.sent)
+
+def reply_outcome(elapsed, latencies, responded, streams, superseded, supersedes):
+    """Result dict of a Discord scenario (streams: each bot's copy of the messages)"""
+    messages = [message for stream in streams for message in stream]
+    sent = [reply.content for message in messages for reply in message.channel.sent]
+    # Answers whose reply does not end up showing the model's full response
+    truncated = [message for message in messages if message.response is not None and shown(message) != message.response]
+    # Replies that are an error or a "rate limited" notice instead of an answer; "too busy"
+    # notices are admission control shedding load on purpose, counted separately
+    failed = [content for content in sent if content.startswith(('❌', '⏳')) and not content.startswith(SHED_NOTICE)]
+    return {'elapsed': elapsed, 'latencies': latencies, 'responded': responded, 'failed': len(failed),
+            'shed': sum(1 for content in sent if content.startswith(SHED_NOTICE)), 'errors': failed[:3],
+            'superseded': superseded, 'superseded_per_bot': dict(supersedes['per_bot']),
+            'foreign_supersedes': supersedes['foreign'],
+            'truncated': len(truncated), 'truncated_examples': [(shown(m)[-40:], m.response[-40:]) for m in truncated[:3]],
+            'turn_fallbacks': 0,
+            'edits': sum(message.channel.edits for message in messages),
+            'edit_peak': max(peak_edits(stream) for stream in streams)}
+
+async def run_chat_sessions(url, state_dir, args):
+    """Concurrent terminal sessions, each sending through chat.request_reply"""
+    import chat
+    from context_builder import ContextBuilder, CONTEXT_TOKEN_BUDGET
+    from conversation_store import Conversation
+
+    latencies = []
+    statuses = Counter()
+    async with make_pool(url, 'load-chat', state_dir, args.period) as pool:
+        async def session(number):
+            rng = random.Random(number)
+            conversation = Conversation({'role': 'system', 'content': chat.DEFAULT_PERSONALITY})
+            context_builder = ContextBuilder(CONTEXT_TOKEN_BUDGET)
+            for _ in range(args.messages // args.sessions):
+                conversation.append('user', rng.choice(PROMPTS))
+                started = time.perf_counter()
+                response = await chat.request_reply(pool, context_builder.build(conversation),
+                                                    stream=args.stream, on_delta=lambda delta: None)
+                latencies.append(time.perf_counter() - started)
+                statuses[response.status_code] += 1
+                if response.status_code == 200:
+                    conversation.append('assistant', response.content)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(session(i) for i in range(args.sessions)))
+        elapsed = time.perf_counter() - start
+    return elapsed, latencies, statuses
+
+def coordinator_process(socket_path, bots):
+    """turn_coordinator.py serving the bot processes"""
+    from turn_coordinator import TurnCoordinator
+
+    async def serve():
+        coordinator = TurnCoordinator(socket_path, bots)
+        try:
+            await coordinator.serve_forever()
+        finally:
+            await coordinator.close()
+
+    asyncio.run(serve())
+
+def bot_process(bot_name, bots, url, state_dir, args, ready, results):
+    """One discord_bot process: the real on_message handler fed by the fake gateway
+
+    The harness decides the turns and mentions the responder, or with --coordinator the
+    messages mention nobody and the bot asks the turn coordinator from on_message itself.
+    """
+    from discord_bot import create_bot, load_config
+    from turn_manager import TurnManager
+    from turn_coordinator import TurnCoordinatorClient
+
+    # The real bot with default settings, pointed at the mock server with the compressed period
+    pool = make_pool(url, bot_name, state_dir, args.period)
+    config = dict(load_config({}), bot_name=bot_name, stream_responses=args.stream, conversation_scope=args.scope,
+                  queue_max_wait=args.max_wait)
+    client = None
+    if args.coordinator:
+        config['target_channel_id'] = FIRST_CHANNEL_ID
+        client = TurnCoordinatorClient(Path(state_dir) / '.turn_coordinator.sock', bots=bots)
+    bot = create_bot(config, backend_pool=pool, turn_manager=client)
+    supersedes = watch_scheduler(bot.scheduler)
+    user = login(bot, bot_name)
+    messages = message_stream(args.messages, args.users, 1 if client else args.channels,
+                              mention=None if client else user, seed=args.seed, send_latency=args.send_latency)
+    turns = TurnManager(bots, state_file=Path(state_dir) / '.turn_state', lock_free=args.lock_free) \
+        if len(bots) > 1 and client is None else None
+
+    async def run():
+        latencies = []
+        responded = []
+
+        async def handle(i, message):
+            DELIVERING_BOT.set(bot_name)
+            DELIVERING_MESSAGE.set(message)
+            if turns is None or turns.should_respond(bot_name, message.id):
+                responded.append(message.id)
+                started = time.perf_counter()
+                await bot.on_message(message)
+                if served(message):
+                    latencies.append(time.perf_counter() - started)
+
+        ready.wait()
+        elapsed = await replay(messages, args.rate, handle)
+        await pool.close()
+        if client is not None:
+            # on_message asked the coordinator: the bot took the messages it answered
+            responded[:] = [message.id for message in messages if message.channel.sent]
+            await client.close()
+        outcome = reply_outcome(elapsed, latencies, responded, [messages], bot.scheduler.superseded, supersedes)
+        outcome['turn_fallbacks'] = client.fallbacks if client else 0
+        return outcome
+
+    results.put(asyncio.run(run()))
+
+async def run_host(url, state_dir, args):
+    """Every bot in this process (bot_host.BotHost): one pool, in-memory limiter and turns
+
+    Messages go to every bot's client like the gateway would deliver them, in one target
+    channel without mentions, so the bots' own turn check picks the responder.
+    """
+    from bot_host import BotHost
+    from discord_bot import load_config
+
+    pool = make_pool(url, 'load-host', state_dir, args.period, in_memory=True)
+    configs = [dict(load_config({}), bot_name=f"LoadBot{i + 1}", stream_responses=args.stream,
+                    conversation_scope=args.scope, queue_max_wait=args.max_wait,
+                    target_channel_id=FIRST_CHANNEL_ID) for i in range(args.bots)]
+    host = BotHost(configs, backend_pool=pool)
+    supersedes = watch_scheduler(host.scheduler)
+    for i, bot in enumerate(host.bots):
+        login(bot, bot.config['bot_name'], BOT_USER_ID + i)
+    # Each client has its own copy of every message (and so its own record of what it sent)
+    streams = [message_stream(args.messages, args.users, channels=1, seed=args.seed, send_latency=args.send_latency)
+               for _ in host.bots]
+    latencies = []
+
+    async def handle(i, _):
+        async def deliver(bot, message):
+            DELIVERING_BOT.set(bot.config['bot_name'])
+            DELIVERING_MESSAGE.set(message)
+            started = time.perf_counter()
+            await bot.on_message(message)
+            if served(message):
+                latencies.append(time.perf_counter() - started)
+        await asyncio.gather(*(deliver(bot, stream[i]) for bot, stream in zip(host.bots, streams)))
+
+    elapsed = await replay(streams[0], args.rate, handle)
+    await host.close()
+    responded = [message.id for stream in streams for message in stream if message.channel.sent]
+    return reply_outcome(elapsed, latencies, responded, streams, host.scheduler.superseded, supersedes)
+
+def run_bots(url, state_dir, args):
+    """Start one process per bot, release them together and collect their results"""
+    bots = [f"LoadBot{i + 1}" for i in range(args.bots)]
+    context = multiprocessing.get_context('spawn')
+    coordinator = None
+    if args.coordinator:
+        socket_path = Path(state_dir) / '.turn_coordinator.sock'
+        socket_path.parent.mkdir(parents=True, exist_ok=True)
+        coordinator = context.Process(target=coordinator_process, args=(socket_path, bots))
+        coordinator.start()
+        while not socket_path.exists():
+            time.sleep(0.05)
+    ready = context.Barrier(len(bots))
+    results = context.Queue()
+    processes = [context.Process(target=bot_process, args=(bot, bots, url, state_dir, args, ready, results))
+                 for bot in bots]
+    for process in processes:
+        process.start()
+    outcomes = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    if coordinator is not None:
+        coordinator.terminate()
+        coordinator.join()
+    return outcomes
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline end-to-end load test')
+    parser.add_argument('--messages', type=int, default=300, help='messages per scenario')
+    parser.add_argument('--sessions', type=int, default=20, help='concurrent chat.py sessions')
+    parser.add_argument('--bots', type=int, default=3, help='bots taking turns (one process each unless --host)')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--channels', type=int, default=20)
+    parser.add_argument('--rate', type=float, default=50.0, help='incoming Discord messages per second')
+    parser.add_argument('--period', type=float, default=1.0, help='rate limit window in seconds (60 = real time)')
+    parser.add_argument('--latency', type=float, default=0.05, help='mock server latency per completion (s)')
+    parser.add_argument('--inject-429', type=float, default=0.02, help='fraction of requests answered 429 at random')
+    parser.add_argument('--send-latency', type=float, default=0.02, help='fake Discord send/edit round trip (s)')
+    parser.add_argument('--stream', action='store_true', help='stream responses')
+    parser.add_argument('--lock-free', action='store_true', help='lock-free turn decisions')
+    parser.add_argument('--host', action='store_true', help='run every bot in one process (bot_host)')
+    parser.add_argument('--coordinator', action='store_true',
+                        help='bot processes take turns through turn_coordinator.py, asked from on_message')
+    parser.add_argument('--scope', choices=('user', 'channel'), default='user', help='conversation history per user or channel')
+    parser.add_argument('--max-wait', type=float, default=None,
+                        help='longest estimated queue wait admitted (s, default: 30s scaled to --period)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    if args.coordinator and args.host:
+        parser.error('--coordinator runs bot processes; --host takes turns in memory')
+    if args.max_wait is None:
+        from request_scheduler import MAX_ESTIMATED_WAIT
+        args.max_wait = MAX_ESTIMATED_WAIT * args.period / 60
+
+    print(f"Limits: {RATE_LIMIT} requests / {TOKEN_LIMIT} tokens per {args.period:g}s, "
+          f"{args.inject_429:.0%} injected 429s, mock latency {args.latency}s\n")
+    problems = 0
+
+    with tempfile.TemporaryDirectory() as directory:
+        limits = ServerLimits(RATE_LIMIT, TOKEN_LIMIT, args.period, args.inject_429, seed=args.seed)
+        with MockServer(latency=args.latency, token_delay=0.002, limits=limits) as server:
+            state_dir = Path(directory) / 'chat'
+            elapsed, latencies, statuses = asyncio.run(run_chat_sessions(server.url, state_dir, args))
+            sent = sum(statuses.values())
+            print(f"chat.py request path ({args.sessions} sessions): {sent} requests in {elapsed:.1f}s "
+                  f"-> {sent / elapsed:5.1f} req/s  latency {latency_report(latencies)}")
+            print(f"  statuses {dict(statuses)}; server: {limits.accepted} accepted, "
+                  f"{limits.violations} limit violations, {limits.injected} injected 429s")
+            problems += limits.violations + sent - statuses[200]
+
+        limits = ServerLimits(RATE_LIMIT, TOKEN_LIMIT, args.period, args.inject_429, seed=args.seed)
+        with MockServer(latency=args.latency, token_delay=0.002, limits=limits) as server:
+            if args.host:
+                outcomes = [asyncio.run(run_host(server.url, Path(directory) / 'discord', args))]
+            else:
+                outcomes = run_bots(server.url, Path(directory) / 'discord', args)
+            elapsed = max(outcome['elapsed'] for outcome in outcomes)
+            latencies = [latency for outcome in outcomes for latency in outcome['latencies']]
+            answers = Counter(message_id for outcome in outcomes for message_id in outcome['responded'])
+            # A message superseded by its author's next one is answered by that reply instead
+            superseded = sum(outcome['superseded'] for outcome in outcomes)
+            conflicts = sum(1 for count in answers.values() if count > 1) + \
+                max(0, args.messages - len(answers) - superseded)
+            failed = sum(outcome['failed'] for outcome in outcomes)
+            shed = sum(outcome['shed'] for outcome in outcomes)
+            edit_peak = max(outcome['edit_peak'] for outcome in outcomes)
+            per_bot = Counter()
+            for outcome in outcomes:
+                per_bot.update(outcome['superseded_per_bot'])
+            foreign = sum(outcome['foreign_supersedes'] for outcome in outcomes)
+            truncated = sum(outcome['truncated'] for outcome in outcomes)
+            # With --coordinator every turn must come from the coordinator, not the state file fallback
+            fallbacks = sum(outcome['turn_fallbacks'] for outcome in outcomes)
+            layout = (f"{args.bots} bots in one process, {args.users} users, 1 channel" if args.host
+                      else f"{args.bots} bot processes, {args.users} users, 1 channel, turn coordinator" if args.coordinator
+                      else f"{args.bots} bot processes, {args.users} users, {args.channels} channels")
+            print(f"discord_bot.on_message ({layout}): "
+                  f"{len(latencies)} replies in {elapsed:.1f}s -> {len(latencies) / elapsed:5.1f} msg/s  "
+                  f"latency {latency_report(latencies)}")
+            print(f"  admission control: {shed} turned away, {superseded} superseded by the author's next message")
+            print(f"  superseded per bot: {', '.join(f'{bot} {count}' for bot, count in sorted(per_bot.items(), key=str)) or 'none'}; "
+                  f"{foreign} replaced by another bot's request")
+            if args.coordinator:
+                print(f"  turn coordinator: {fallbacks} decisions fell back to the turn state file")
+            for error in [error for outcome in outcomes for error in outcome['errors']][:3]:
+                print(f"  failed reply: {error}")
+            for shown_text, response in [example for outcome in outcomes for example in outcome['truncated_examples']][:3]:
+                print(f"  truncated reply: shows ...{shown_text!r}, response ends ...{response!r}")
+            print(f"  {conflicts}/{args.messages} messages without exactly one responder, {failed} failed replies, "
+                  f"{truncated} replies not showing the full response, {sum(outcome['edits'] for outcome in outcomes)} streaming edits (peak {edit_peak} per channel "
+                  f"in {EDIT_WINDOW:g}s, limit {EDIT_LIMIT}); server: {limits.accepted} accepted, "
+                  f"{limits.violations} limit violations, {limits.injected} injected 429s")
+            problems += limits.violations + conflicts + failed + max(0, edit_peak - EDIT_LIMIT) + foreign + truncated + fallbacks
+
+    print(f"\n{'✅ no violations' if not problems else f'❌ {problems} problems (violations, conflicts or failures)'}")
+    sys.exit(1 if problems else 0)
+
+if __name__ == '__main__':
+    main()
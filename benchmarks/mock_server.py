@@ -0,0 +1,225 @@
+"""
+Mock OpenAI-Compatible Server
+Local stand-in for the Groq chat completions endpoint, used by the benchmarks
+Optionally enforces Groq-style request/token limits (429 + retry-after and x-ratelimit-*
+headers) and injects random 429s, counting every request that broke the limit
+Run: python benchmarks/mock_server.py --port 8080 --latency 0.2 [--rate-limit 30 --token-limit 6000]
+"""
+
+import sys
+sys.dont_write_bytecode = True
+
+import json
+import time
+import random
+import argparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MOCK_REPLY = "Hey! Doing great, thanks for asking."
+
+class MockCompletionHandler(BaseHTTPRequestHandler):
+    """Answers POST /v1/chat/completions after a configurable delay (streamed when asked)"""
+
+    # HTTP/1.1 so clients can keep connections alive between requests
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output clean
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+
+        prompt_tokens = sum(len(m.get('content', '')) for m in request.get('messages', [])) // 4
+        completion_tokens = len(MOCK_REPLY) // 4
+        usage = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens
+        }
+
+        # Limits are checked on arrival, like the real API
+        allowed, self.limit_headers = self.server.limits.admit(usage['total_tokens'])
+        if not allowed:
+            self.send_response(429)
+            for name, value in self.limit_headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        time.sleep(self.server.latency)
+
+        if request.get('stream'):
+            self.send_stream(request, usage)
+            return
+
+        body = json.dumps({
+            'id': 'chatcmpl-mock',
+            'object': 'chat.completion',
+            'model': request.get('model', 'mock'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': MOCK_REPLY},
+                'finish_reason': 'stop'
+            }],
+            'usage': usage
+        }).encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in self.limit_headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_stream(self, request, usage):
+        """Send the reply word by word as SSE chunks (chunked transfer encoding)"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        for name, value in self.limit_headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        def send_event(payload):
+            event = f"data: {payload}\n\n".encode()
+            self.wfile.write(f"{len(event):x}\r\n".encode() + event + b"\r\n")
+            self.wfile.flush()
+
+        words = MOCK_REPLY.split(' ')
+        for i, word in enumerate(words):
+            piece = word if i == 0 else ' ' + word
+            send_event(json.dumps({
+                'id': 'chatcmpl-mock',
+                'object': 'chat.completion.chunk',
+                'model': request.get('model', 'mock'),
+                'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]
+            }))
+            time.sleep(self.server.token_delay)
+        send_event(json.dumps({'id': 'chatcmpl-mock', 'object': 'chat.completion.chunk', 'choices': [], 'usage': usage}))
+        send_event('[DONE]')
+        self.wfile.write(b"0\r\n\r\n")
+
+class ServerLimits:
+    """Groq-style limits over a sliding window: requests and tokens per `period` seconds
+
+    A request that arrives with the window full is answered 429 and counted as a violation
+    (the client sent more than the limit allows); `inject_429` is the fraction of requests
+    answered 429 at random on top of that (retry-after of a tenth of the period).
+    """
+
+    def __init__(self, requests=0, tokens=0, period=60.0, inject_429=0.0, seed=None):
+        self.requests = requests
+        self.tokens = tokens
+        self.period = period
+        self.inject_429 = inject_429
+        self._random = random.Random(seed)
+        self._window = deque()  # (arrival time, tokens) of accepted requests
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.violations = 0
+        self.injected = 0
+
+    def _headers(self, now, used):
+        if not (self.requests or self.tokens):
+            return {}
+        reset = f"{max(0.0, self._window[0][0] + self.period - now) if self._window else 0.0:.3f}s"
+        headers = {}
+        if self.requests:
+            headers['x-ratelimit-remaining-requests'] = str(max(0, self.requests - len(self._window)))
+            headers['x-ratelimit-reset-requests'] = reset
+        if self.tokens:
+            headers['x-ratelimit-remaining-tokens'] = str(max(0, self.tokens - used))
+            headers['x-ratelimit-reset-tokens'] = reset
+        return headers
+
+    def admit(self, tokens):
+        """(allowed, response headers) for a request arriving now"""
+        now = time.time()
+        with self._lock:
+            while self._window and self._window[0][0] <= now - self.period:
+                self._window.popleft()
+            used = sum(entry[1] for entry in self._window)
+            if self.inject_429 and self._random.random() < self.inject_429:
+                self.injected += 1
+                headers = self._headers(now, used)
+                headers['retry-after'] = f"{self.period / 10:.3f}"
+                return False, headers
+            if ((self.requests and len(self._window) >= self.requests) or
+                    (self.tokens and used + tokens > self.tokens)):
+                self.violations += 1
+                headers = self._headers(now, used)
+                retry_after = self._window[0][0] + self.period - now if self._window else self.period
+                headers['retry-after'] = f"{retry_after:.3f}"
+                return False, headers
+            self._window.append((now, tokens))
+            self.accepted += 1
+            return True, self._headers(now, used + tokens)
+
+class MockHTTPServer(ThreadingHTTPServer):
+    """Threaded server with a listen backlog big enough for bursts of concurrent clients"""
+    request_queue_size = 1024
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients dropping idle keep-alive connections when they shut down is not an error
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+class MockServer:
+    """Runs the mock server on a background thread"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.2, token_delay=0.02, limits=None):
+        self.httpd = MockHTTPServer((host, port), MockCompletionHandler)
+        self.httpd.latency = latency
+        self.httpd.token_delay = token_delay
+        self.httpd.limits = limits or ServerLimits()
+        self._thread = None
+
+    @property
+    def limits(self):
+        return self.httpd.limits
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/v1/chat/completions'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mock OpenAI-compatible completion server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds per completion')
+    parser.add_argument('--token-delay', type=float, default=0.02, help='seconds between streamed chunks')
+    parser.add_argument('--rate-limit', type=int, default=0, help='requests per period (0 = unlimited)')
+    parser.add_argument('--token-limit', type=int, default=0, help='tokens per period (0 = unlimited)')
+    parser.add_argument('--period', type=float, default=60.0, help='rate limit window (s)')
+    parser.add_argument('--inject-429', type=float, default=0.0, help='fraction of requests answered 429 at random')
+    args = parser.parse_args()
+
+    limits = ServerLimits(args.rate_limit, args.token_limit, args.period, args.inject_429)
+    server = MockServer(args.host, args.port, args.latency, args.token_delay, limits)
+    print(f"Mock server listening on {server.url} (latency {args.latency}s)")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
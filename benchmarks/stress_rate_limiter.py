@@ -0,0 +1,144 @@
+"""
+Stress Test: Shared Rate Limiter
+Runs several processes against one SharedRateLimiter state file and checks that the
+request and token limits are never exceeded in any window, then compares per-request
+lock overhead with the old flock + text-file read/write path
+Run: python benchmarks/stress_rate_limiter.py --processes 4 --duration 6
+"""
+
+import sys
+sys.dont_write_bytecode = True
+
+import os
+import time
+import fcntl
+import random
+import argparse
+import tempfile
+import multiprocessing
+from bisect import bisect_left
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from shared_rate_limiter import (
+    SharedRateLimiter, MAX_REQUESTS_PER_MINUTE, MAX_TOKENS_PER_MINUTE,
+    SAFE_REQUESTS_PER_MINUTE, REQUEST_BURST, SAFE_TOKENS_PER_MINUTE
+)
+
+def worker(state_file, period, deadline, results):
+    """Send as fast as the limiter allows and record the scheduled send times and real usage"""
+    limiter = SharedRateLimiter(f"worker-{os.getpid()}", state_file=state_file, period=period)
+    rng = random.Random(os.getpid())
+    sends = []
+    while True:
+        # Estimate = prompt estimate + max_tokens; real usage is usually well below it
+        estimated = rng.randint(10, 300) + 200
+        now = time.time()
+        wait_time, ticket = limiter.reserve(estimated, now=now)
+        scheduled = now + wait_time
+        if scheduled > deadline:
+            break
+        time.sleep(wait_time)
+        used = rng.randint(estimated // 3, estimated)
+        limiter.record_usage(ticket, {'total_tokens': used})
+        sends.append((scheduled, used))
+    results.put(sends)
+
+def max_in_window(sends, period):
+    """Largest request count and token sum inside any half-open window [t, t + period)"""
+    times = [t for t, _ in sends]
+    max_requests = max_tokens = 0
+    for i, start in enumerate(times):
+        end = bisect_left(times, start + period)
+        max_requests = max(max_requests, end - i)
+        max_tokens = max(max_tokens, sum(tokens for _, tokens in sends[i:end]))
+    return max_requests, max_tokens
+
+def legacy_round_trip(lock_path, state_path):
+    """The old per-request path: flock + parse text file, then flock + rewrite it"""
+    for write in (False, True):
+        with open(lock_path, 'a+') as lock_f:
+            fcntl.flock(lock_f.fileno(), fcntl.LOCK_EX)
+            try:
+                if write:
+                    with open(state_path, 'w') as f:
+                        f.write(f"{time.time()}\n1\n")
+                elif os.path.exists(state_path):
+                    with open(state_path, 'r') as f:
+                        lines = f.read().strip().split('\n')
+                        float(lines[0]), int(lines[1])
+            finally:
+                fcntl.flock(lock_f.fileno(), fcntl.LOCK_UN)
+
+def overhead_worker(kind, directory, iterations, results):
+    if kind == 'legacy':
+        lock_path = os.path.join(directory, 'legacy.lock')
+        state_path = os.path.join(directory, 'legacy.state')
+        start = time.perf_counter()
+        for _ in range(iterations):
+            legacy_round_trip(lock_path, state_path)
+    else:
+        # Huge rates so reserve() never asks us to wait - we only measure the lock + update
+        limiter = SharedRateLimiter('bench', state_file=os.path.join(directory, 'gcra.state'),
+                                    requests_per_minute=1e12, tokens_per_minute=1e12)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            limiter.reserve(100)
+    results.put(time.perf_counter() - start)
+
+def measure_overhead(kind, directory, processes, iterations):
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=overhead_worker, args=(kind, directory, iterations, results))
+               for _ in range(processes)]
+    for p in workers:
+        p.start()
+    elapsed = [results.get() for _ in workers]
+    for p in workers:
+        p.join()
+    return sum(elapsed) / (processes * iterations) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description='Multiprocess stress test for SharedRateLimiter')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=6.0, help='seconds of traffic')
+    parser.add_argument('--period', type=float, default=1.0,
+                        help='compressed rate-limit period in seconds (60 in production)')
+    parser.add_argument('--iterations', type=int, default=2000, help='reserves per process for the overhead test')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        state_file = os.path.join(directory, 'rate_limit_state')
+        SharedRateLimiter('init', state_file=state_file, period=args.period)
+
+        results = multiprocessing.Queue()
+        deadline = time.time() + args.duration
+        workers = [multiprocessing.Process(target=worker, args=(state_file, args.period, deadline, results))
+                   for _ in range(args.processes)]
+        for p in workers:
+            p.start()
+        sends = sorted(s for _ in workers for s in results.get())
+        for p in workers:
+            p.join()
+
+        max_requests, max_tokens = max_in_window(sends, args.period)
+        print(f"Limits per period: {MAX_REQUESTS_PER_MINUTE} requests, {MAX_TOKENS_PER_MINUTE} tokens "
+              f"(GCRA: {SAFE_REQUESTS_PER_MINUTE}+{REQUEST_BURST} burst, token window: {SAFE_TOKENS_PER_MINUTE})")
+        print(f"{args.processes} processes sent {len(sends)} requests over {args.duration:.0f}s "
+              f"(period compressed to {args.period}s)")
+        print(f"Busiest window: {max_requests} requests, {max_tokens} tokens")
+
+        violated = max_requests > MAX_REQUESTS_PER_MINUTE or max_tokens > MAX_TOKENS_PER_MINUTE
+        print("Limits respected: " + ("NO - VIOLATION" if violated else "yes"))
+
+        print("\nLock overhead per request:")
+        for processes in (1, args.processes):
+            legacy = measure_overhead('legacy', directory, processes, args.iterations)
+            gcra = measure_overhead('gcra', directory, processes, args.iterations)
+            print(f"  {processes} process(es): legacy flock+text {legacy:8.1f} us   "
+                  f"mmap GCRA reserve {gcra:6.1f} us   ({legacy / gcra:.1f}x less)")
+
+    sys.exit(1 if violated else 0)
+
+if __name__ == '__main__':
+    main()
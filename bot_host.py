@@ -0,0 +1,115 @@
+"""
+Bot Host
+Runs several personality bots in one process on one event loop: each is its own Discord
+client, and they share one backend pool (one HTTP connection pool), one request queue,
+in-memory rate limiters and an in-memory turn manager instead of flock'd state files
+Run: python bot_host.py (bots from TURN_BOTS, per-bot settings as <NAME>_<SETTING>)
+"""
+
+import sys
+sys.dont_write_bytecode = True
+
+import os
+import re
+import asyncio
+from pathlib import Path
+from discord_bot import create_bot, create_scheduler, load_config, config_errors
+from turn_manager import InMemoryTurnManager, load_bot_names
+
+# Rate limiter / backend pool name for the whole host
+HOST_NAME = 'bot_host'
+
+def bot_env(name, env=None):
+    """Environment for one hosted bot: <NAME>_<SETTING> overrides SETTING (e.g. BOT1_PERSONALITY)"""
+    env = os.environ if env is None else env
+    prefix = re.sub(r'\W', '_', name).upper() + '_'
+    overrides = {key[len(prefix):]: value for key, value in env.items() if key.startswith(prefix)}
+    return {**env, **overrides}
+
+def load_host_configs(env=None):
+    """One load_config() dict per bot named in TURN_BOTS"""
+    env = os.environ if env is None else env
+    names = [name.strip() for name in env.get('TURN_BOTS', '').split(',') if name.strip()] or load_bot_names()
+    configs = []
+    for name in names:
+        config = load_config(bot_env(name, env))
+        config['bot_name'] = name
+        if config['conversation_db'] and config['conversation_db'] == env.get('CONVERSATION_DB'):
+            # Histories are keyed by user, so each bot needs its own database file
+            path = Path(config['conversation_db'])
+            config['conversation_db'] = str(path.with_name(f"{path.stem}.{name}{path.suffix}"))
+        configs.append(config)
+    return configs
+
+class BotHost:
+    """N bots on one event loop, sharing everything that is not per personality
+
+    Each bot keeps its own Discord client (and gateway connection), conversations and
+    response cache. The backend pool, request queue, rate budget and turn state are
+    shared: a reservation or a turn decision is a function call, not a flock on a file.
+    Nothing else may use the same API keys, as the budget is not visible to other processes.
+    """
+
+    def __init__(self, configs, backend_pool=None, turn_manager=None):
+        if not configs:
+            raise ValueError("BotHost needs at least one bot")
+        if backend_pool is None:
+            from backend_pool import BackendPool, load_backends
+            from shared_rate_limiter import InMemoryRateLimiter
+            backend_pool = BackendPool(load_backends(configs[0]['groq_api_key']), HOST_NAME,
+                                       limiter_class=InMemoryRateLimiter)
+        self.backend_pool = backend_pool
+        self.scheduler = create_scheduler(configs[0], backend_pool)
+        names = [config['bot_name'] for config in configs]
+        if turn_manager is None and len(configs) > 1:
+            turn_manager = InMemoryTurnManager(names)
+        self.turn_manager = turn_manager
+        self.bots = [create_bot(config, backend_pool=backend_pool, scheduler=self.scheduler,
+                                turn_manager=turn_manager) for config in configs]
+
+    async def start(self):
+        """Log every bot in and run them until one of them stops"""
+        await asyncio.gather(*(bot.start(bot.config['discord_bot_token']) for bot in self.bots))
+
+    async def close(self):
+        """Disconnect every bot and release the shared components"""
+        for bot in self.bots:
+            if not bot.is_closed():
+                await bot.close()
+            if bot.conversation_db is not None:
+                bot.conversation_db.close()
+        await self.backend_pool.close()
+        if self.turn_manager is not None:
+            self.turn_manager.close()
+
+    async def serve(self):
+        try:
+            await self.start()
+        finally:
+            await self.close()
+
+def main():
+    # Imported here so importing this module does not need python-dotenv
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    configs = load_host_configs()
+
+    # Validate configuration (each bot needs its own Discord token)
+    errors = [f"[{config['bot_name']}] {error}" for config in configs for error in config_errors(config)]
+    for error in errors:
+        print(f"ERROR: {error}")
+    if errors:
+        sys.exit(1)
+
+    try:
+        print(f"Starting {len(configs)} bots in one process: {', '.join(config['bot_name'] for config in configs)}")
+        asyncio.run(BotHost(configs).serve())
+    except KeyboardInterrupt:
+        print("👋 Stopped")
+    except Exception as e:
+        print(f"Fatal error: {e}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
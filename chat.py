@@ -7,39 +7,35 @@ import sys
 sys.dont_write_bytecode = True
 
 import os
-import time
-import requests
-from dotenv import load_dotenv
+import asyncio
+from llm_client import DEFAULT_MAX_TOKENS
+from backend_pool import get_backend_pool
+from context_builder import ContextBuilder, count_message_tokens, CONTEXT_TOKEN_BUDGET
+from conversation_store import Conversation
 
 # Request throttling: Groq free tier allows 30 requests/minute, ~6000 tokens/minute
-MIN_REQUEST_INTERVAL = 2.5  # seconds between requests
-last_request_time = 0
+# Budget is shared with any other bot processes through shared_rate_limiter (one per backend)
+RATE_LIMITER_NAME = 'chat'
 
-def estimate_tokens(text):
-    """Rough token estimation: 1 token ≈ 4 characters"""
-    return len(text) // 4
+def print_delta(delta):
+    """Print streamed text as it arrives"""
+    print(delta, end='', flush=True)
 
-def throttle_request(estimated_tokens=0):
-    """Ensure minimum time between requests to avoid rate limits"""
-    global last_request_time
-    current_time = time.time()
-    time_since_last = current_time - last_request_time
-    
-    min_interval = MIN_REQUEST_INTERVAL
-    if estimated_tokens > 4000:
-        min_interval = max(MIN_REQUEST_INTERVAL, estimated_tokens / 100)
-    
-    if time_since_last < min_interval:
-        wait_time = min_interval - time_since_last
-        if wait_time > 0.1:
-            print(f"⏳ Throttling: waiting {wait_time:.1f}s to avoid rate limits...\n")
-        time.sleep(wait_time)
-    
-    last_request_time = time.time()
+def estimate_request_tokens(messages):
+    """Estimate what a request counts against the token budget (whole prompt + max completion)"""
+    return count_message_tokens(messages) + DEFAULT_MAX_TOKENS
 
-# Load personality from environment variable or use default
-load_dotenv()
-PERSONALITY = os.getenv('PERSONALITY', """You are a helpful and friendly AI assistant. 
+async def request_reply(client, conversation_history, stream=False, on_delta=print_delta):
+    """One request: wait for room in a backend's shared budget, send it, record the real usage"""
+    ticket = await client.wait_if_needed(estimate_request_tokens(conversation_history))
+    if stream:
+        response = await client.stream_complete(conversation_history, on_delta=on_delta, ticket=ticket)
+    else:
+        response = await client.complete(conversation_history, ticket=ticket)
+    client.record_usage(ticket, response.usage)
+    return response
+
+DEFAULT_PERSONALITY = """You are a helpful and friendly AI assistant. 
 You enjoy helping people and having conversations.
 
 CURRENT STATE & BEHAVIOR:
@@ -54,26 +50,31 @@ RULES:
 - DO NOT use asterisks, parentheses, or action descriptions
 - You are a REAL PERSON, NOT an AI assistant
 - Respond naturally to EVERYTHING people say
-- Match their energy and language style""")
+- Match their energy and language style"""
 
-if __name__ == '__main__':
-    try:
-        API_KEY = os.getenv('GROQ_API_KEY')
-        
-        if not API_KEY:
-            print("ERROR: GROQ_API_KEY not found in .env file!")
-            print("Please copy .env.example to .env and add your API key.")
-            print("Get your free API key at: https://console.groq.com/")
-            input("\nPress Enter to exit...")
-            sys.exit(1)
-        
-        print("Chatbot ready! Type 'quit' to exit.\n")
-        print(f"Personality loaded: {len(PERSONALITY)} characters\n")
-        
-        conversation_history = [
-            {'role': 'system', 'content': PERSONALITY}
-        ]
-        
+def load_config(env=None):
+    """Chat settings from environment variables (os.environ, after load_dotenv, by default)"""
+    env = os.environ if env is None else env
+    return {
+        'groq_api_key': env.get('GROQ_API_KEY'),
+        'stream_responses': env.get('STREAM_RESPONSES', 'true').lower() in ('1', 'true', 'yes'),
+        'context_token_budget': int(env.get('CONTEXT_TOKEN_BUDGET', CONTEXT_TOKEN_BUDGET)),
+        'context_summary': env.get('CONTEXT_SUMMARY', 'false').lower() in ('1', 'true', 'yes'),
+        'context_stable_prefix': env.get('CONTEXT_STABLE_PREFIX', 'false').lower() in ('1', 'true', 'yes'),
+        # Load personality from environment variable or use default
+        'personality': env.get('PERSONALITY', DEFAULT_PERSONALITY),
+    }
+
+async def chat_loop(config):
+    """Interactive chat loop (one backend pool for the whole session)"""
+    stream_responses = config['stream_responses']
+    # Newest turns are packed into a token budget for each request
+    conversation = Conversation({'role': 'system', 'content': config['personality']},
+                                summarize=config['context_summary'])
+    context_builder = ContextBuilder(config['context_token_budget'], summarize=config['context_summary'],
+                                     stable_prefix=config['context_stable_prefix'])
+    
+    async with get_backend_pool(RATE_LIMITER_NAME, api_key=config['groq_api_key']) as client:
         while True:
             try:
                 message = input("You: ")
@@ -83,41 +84,27 @@ if __name__ == '__main__':
                 if not message.strip():
                     continue
                 
-                # Estimate tokens and throttle
-                estimated_tokens = estimate_tokens(PERSONALITY + message)
-                throttle_request(estimated_tokens)
-                
                 # Add user message
-                conversation_history.append({'role': 'user', 'content': message})
-                
-                # Keep history manageable (last 4 exchanges)
-                if len(conversation_history) > 9:  # system + 4 exchanges
-                    conversation_history = [conversation_history[0]] + conversation_history[-8:]
+                conversation.append('user', message)
+                conversation_history = context_builder.build(conversation)
                 
-                # Make API request
-                response = requests.post(
-                    'https://api.groq.com/openai/v1/chat/completions',
-                    headers={
-                        'Authorization': f'Bearer {API_KEY}',
-                        'Content-Type': 'application/json'
-                    },
-                    json={
-                        'model': 'llama-3.1-8b-instant',
-                        'messages': conversation_history,
-                        'max_tokens': 200,
-                        'temperature': 0.9
-                    },
-                    timeout=15
-                )
+                # Make API request once the shared budget has room (streamed: tokens are printed as they arrive)
+                if stream_responses:
+                    print("\nBot: ", end='', flush=True)
+                response = await request_reply(client, conversation_history, stream=stream_responses)
                 
                 if response.status_code == 200:
-                    response_data = response.json()
-                    bot_response = response_data['choices'][0]['message']['content']
-                    print(f"\nBot: {bot_response}\n")
-                    conversation_history.append({'role': 'assistant', 'content': bot_response})
+                    bot_response = response.content
+                    if stream_responses:
+                        print("\n")
+                    else:
+                        print(f"\nBot: {bot_response}\n")
+                    conversation.append('assistant', bot_response)
                 elif response.status_code == 429:
-                    print("\n⏳ Rate limited! Waiting 60 seconds...\n")
-                    time.sleep(60)
+                    # Already retried; the shared limiter holds the next request until the server allows it
+                    retry_after = response.rate_limit.get('retry_after')
+                    wait = f" Try again in {retry_after:.0f}s." if retry_after is not None else ""
+                    print(f"\n⏳ Rate limited!{wait}\n")
                 else:
                     print(f"\nError: {response.status_code}\n")
                     
@@ -126,7 +113,30 @@ if __name__ == '__main__':
                 break
             except Exception as e:
                 print(f"\nError: {e}\n")
+
+def main():
+    # Imported here so importing this module does not need python-dotenv
+    from dotenv import load_dotenv
+
+    try:
+        load_dotenv()
+        config = load_config()
+        
+        if not config['groq_api_key']:
+            print("ERROR: GROQ_API_KEY not found in .env file!")
+            print("Please copy .env.example to .env and add your API key.")
+            print("Get your free API key at: https://console.groq.com/")
+            input("\nPress Enter to exit...")
+            sys.exit(1)
+        
+        print("Chatbot ready! Type 'quit' to exit.\n")
+        print(f"Personality loaded: {len(config['personality'])} characters\n")
+        
+        asyncio.run(chat_loop(config))
                 
     except Exception as e:
         print(f"Fatal error: {e}")
         sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""
+Context Builder
+Packs the newest conversation turns into a token budget (instead of a fixed "last 4 exchanges")
+and optionally folds older turns into a short running summary, or keeps the start of every
+prompt stable between checkpoints so providers with prompt (prefix) caching can reuse it
+"""
+
+import sys
+sys.dont_write_bytecode = True
+
+import re
+from functools import lru_cache
+from request_body import encode_message
+from metrics import counter, histogram
+
+# Prompt tokens allowed for conversation turns (the system prompt is not counted here)
+CONTEXT_TOKEN_BUDGET = 1000
+# Tokens allowed for the summary of turns that no longer fit
+SUMMARY_TOKEN_BUDGET = 150
+# Chat templates add a few tokens per message for the role and separators
+MESSAGE_OVERHEAD_TOKENS = 4
+# Longest excerpt of a single turn kept in the summary
+SUMMARY_LINE_CHARS = 120
+# Stable prefix mode: share of the token budget the turns kept at a checkpoint may use (the
+# rest is room for new turns to be appended before the next checkpoint)
+CHECKPOINT_FILL = 0.5
+
+PROMPT_BYTES = counter('chatbot_prompt_bytes_total',
+                       'Request message bytes by whether they repeat the start of the previous request', ('part',))
+PROMPT_PREFIX_RATIO = histogram('chatbot_prompt_prefix_ratio',
+                                'Share of each request identical to the previous one of the conversation',
+                                buckets=(0.1, 0.25, 0.5, 0.75, 0.9, 0.95, 0.99, 1.0))
+
+# Fallback: words, numbers and punctuation are roughly one token each, long words a few
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# Real BPE tokenizer when tiktoken is installed (optional dependency, loaded on first use)
+_encoding = None
+_encoding_loaded = False
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding('cl100k_base')
+        except Exception:
+            _encoding = None
+    return _encoding
+
+@lru_cache(maxsize=8192)
+def count_tokens(text):
+    """Token count for a piece of text (cached - history turns are counted once)"""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return sum(1 + len(piece) // 6 for piece in _TOKEN_PATTERN.findall(text))
+
+def count_message_tokens(messages):
+    """Prompt tokens for a list of API messages"""
+    return sum(count_tokens(m['content']) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+@lru_cache(maxsize=4096)
+def summarize_turn(role, content):
+    """One-line extract of a turn for the running summary (first sentence, clipped)"""
+    text = ' '.join(content.split())
+    match = re.match(r'(.+?[.!?])(\s|$)', text)
+    if match:
+        text = match.group(1)
+    if len(text) > SUMMARY_LINE_CHARS:
+        text = text[:SUMMARY_LINE_CHARS - 3].rstrip() + '...'
+    speaker = 'User' if role == 'user' else 'You'
+    return f"{speaker}: {text}"
+
+class ContextBuilder:
+    """Builds the message list for a request from a Conversation
+
+    Walks the turns newest-first and keeps as many as fit in `token_budget` (the newest
+    turn is always kept). With `summarize`, turns that did not fit - plus any the
+    conversation already dropped - are folded into one short system note instead of
+    being lost entirely.
+
+    That window slides by a turn or two with every request, so no two requests start the
+    same after the system prompt. With `stable_prefix`, the window start (and the summary)
+    only move at a checkpoint: new turns are appended until they no longer fit, then the
+    newest turns filling CHECKPOINT_FILL of the budget are kept and the rest is summarized.
+    Between checkpoints each request repeats the previous one and adds to its end.
+    """
+
+    def __init__(self, token_budget=CONTEXT_TOKEN_BUDGET, summarize=False, summary_budget=SUMMARY_TOKEN_BUDGET,
+                 stable_prefix=False):
+        self.token_budget = token_budget
+        self.summarize = summarize
+        self.summary_budget = summary_budget
+        self.stable_prefix = stable_prefix
+        self.checkpoints = 0
+        self.reused_bytes = 0
+        self.total_bytes = 0
+
+    def pack(self, turns, token_budget=None):
+        """Split turns into (left out, kept) so the kept ones fit the token budget"""
+        token_budget = self.token_budget if token_budget is None else token_budget
+        turns = list(turns)
+        used = 0
+        start = len(turns)
+        while start > 0:
+            cost = count_tokens(turns[start - 1].content) + MESSAGE_OVERHEAD_TOKENS
+            if used + cost > token_budget and start < len(turns):
+                break
+            used += cost
+            start -= 1
+        return turns[:start], turns[start:]
+
+    def build_summary(self, earlier_lines):
+        """Newest summary lines that fit the summary budget, as one system message"""
+        lines = []
+        used = 0
+        for line in reversed(earlier_lines):
+            cost = count_tokens(line) + 1
+            if used + cost > self.summary_budget:
+                break
+            lines.append(line)
+            used += cost
+        if not lines:
+            return None
+        lines.reverse()
+        return {'role': 'system', 'content': "Earlier in this conversation:\n" + '\n'.join(lines)}
+
+    def _summary(self, conversation, left_out):
+        if not self.summarize:
+            return None
+        earlier = list(conversation.summary or ())
+        earlier.extend(summarize_turn(turn.role, turn.content) for turn in left_out)
+        return self.build_summary(earlier)
+
+    def _stable_window(self, conversation):
+        """(summary, turns from the checkpoint on), starting a new checkpoint when they no longer fit"""
+        turns = list(conversation.turns)
+        first = conversation.turn_count - len(turns)  # Number of the oldest turn still held
+        if conversation.checkpoint is None:
+            conversation.checkpoint = (first, None)
+        start, summary = conversation.checkpoint
+        # Turns the conversation already dropped (its max_turns) also force a checkpoint
+        kept = turns[start - first:] if first <= start < conversation.turn_count else None
+        if kept is None or sum(count_tokens(turn.content) + MESSAGE_OVERHEAD_TOKENS for turn in kept) > self.token_budget:
+            left_out, kept = self.pack(turns, int(self.token_budget * CHECKPOINT_FILL))
+            summary = self._summary(conversation, left_out)
+            conversation.checkpoint = (conversation.turn_count - len(kept), summary)
+            self.checkpoints += 1
+        return summary, kept
+
+    def _record_prefix(self, conversation, messages, summary, start, remember=True):
+        """Count how many bytes of this request repeat the start of the conversation's previous one"""
+        previous = conversation.last_prompt
+        kept = len(messages) - 1 - (summary is not None)
+        if remember:
+            conversation.last_prompt = (summary, start, kept)
+        if previous is None:
+            return
+        # The system prompt is always the same; the summary and turns only while unchanged
+        common = 1
+        previous_summary, previous_start, previous_kept = previous
+        if previous_summary == summary:
+            common += summary is not None
+            if previous_start == start:
+                common += min(previous_kept, kept)
+        sizes = [len(encode_message(m['role'], m['content'])) + 1 for m in messages]
+        reused, total = sum(sizes[:common]), sum(sizes)
+        self.reused_bytes += reused
+        self.total_bytes += total
+        PROMPT_BYTES.labels('reused').inc(reused)
+        PROMPT_BYTES.labels('new').inc(total - reused)
+        PROMPT_PREFIX_RATIO.observe(reused / total)
+
+    def build(self, conversation):
+        """Messages for the next request: system prompt, optional summary, newest turns that fit"""
+        # A channel view can end before turns a newer request there was already built from
+        # (that message was handled first): it leaves the channel's previous prompt as it is,
+        # and if it even ends before the checkpoint it is packed on its own, not re-checkpointed
+        previous = conversation.last_prompt
+        behind = previous is not None and conversation.turn_count < previous[1] + previous[2]
+        stale = behind and conversation.checkpoint is not None and conversation.checkpoint[0] >= conversation.turn_count
+        if self.stable_prefix and not stale:
+            summary, kept = self._stable_window(conversation)
+        else:
+            left_out, kept = self.pack(conversation.turns)
+            summary = self._summary(conversation, left_out)
+        messages = [conversation.system_message]
+        if summary is not None:
+            messages.append(summary)
+        messages.extend(turn.as_message() for turn in kept)
+        self._record_prefix(conversation, messages, summary, conversation.turn_count - len(kept), remember=not behind)
+        return messages
+
+    def stats(self):
+        """Share of request bytes identical to the previous request's start, and checkpoints taken"""
+        return {
+            'stable_prefix': self.stable_prefix,
+            'prefix_reuse': self.reused_bytes / self.total_bytes if self.total_bytes else 0.0,
+            'checkpoints': self.checkpoints,
+        }
@@ -0,0 +1,159 @@
+"""
+Conversation Database
+Optional SQLite persistence for conversation history with batched write-behind
+Message handling only enqueues writes (a background thread commits them in batches) and
+loads history back in a worker thread
+"""
+
+import sys
+sys.dont_write_bytecode = True
+
+import time
+import queue
+import sqlite3
+import threading
+from pathlib import Path
+from conversation_store import MAX_HISTORY_TURNS
+
+# How often the writer thread commits, and the most writes it puts in one transaction
+FLUSH_INTERVAL = 0.5  # seconds
+MAX_BATCH_SIZE = 1000
+
+# Turns kept on disk per history by default (the bot passes its store's max_turns)
+MAX_STORED_TURNS = MAX_HISTORY_TURNS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS turns_user ON turns (user_id, id);
+"""
+
+def connect(path):
+    """Open a connection in WAL mode (readers never wait for the writer)"""
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    return connection
+
+class ConversationDB:
+    """Write-behind SQLite backend for ConversationStore"""
+
+    def __init__(self, path, max_turns=MAX_STORED_TURNS, flush_interval=FLUSH_INTERVAL):
+        self.path = str(path)
+        self.max_turns = max_turns
+        self.flush_interval = flush_interval
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+
+        self._reader = connect(self.path)
+        self._reader.executescript(SCHEMA)
+        # load() runs in worker threads (ConversationStore.preload) - one read at a time on the connection
+        self._read_lock = threading.Lock()
+        self._queue = queue.SimpleQueue()
+        # Users with writes that are queued but not committed yet (user id -> count)
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._writer = threading.Thread(target=self._write_loop, name='conversation-db-writer', daemon=True)
+        self._writer.start()
+
+    def _enqueue(self, user_id, item):
+        with self._pending_lock:
+            self._pending[user_id] = self._pending.get(user_id, 0) + 1
+        self._queue.put(item)
+
+    def save_turn(self, user_id, role, content):
+        """Queue a turn to be written (returns immediately)"""
+        user_id = str(user_id)
+        self._enqueue(user_id, ('append', user_id, role, content, time.time()))
+
+    def clear(self, user_id):
+        """Queue deletion of a user's history (returns immediately)"""
+        user_id = str(user_id)
+        self._enqueue(user_id, ('clear', user_id))
+
+    def load(self, user_id, limit=None):
+        """Read a user's most recent turns as [(role, content), ...], oldest first
+
+        Blocks on the disk (and on a flush if the user has writes queued): call it from a
+        worker thread, not the event loop.
+        """
+        user_id = str(user_id)
+        with self._pending_lock:
+            pending = self._pending.get(user_id, 0)
+        if pending:
+            # Rare: the user was evicted from memory before their last turns hit the disk
+            self.flush()
+        with self._read_lock:
+            rows = self._reader.execute(
+                'SELECT role, content FROM turns WHERE user_id = ? ORDER BY id DESC LIMIT ?',
+                (user_id, limit or self.max_turns)
+            ).fetchall()
+        rows.reverse()
+        return rows
+
+    def flush(self, timeout=10):
+        """Block until everything queued so far is committed"""
+        done = threading.Event()
+        self._queue.put(('flush', done))
+        return done.wait(timeout)
+
+    def close(self):
+        """Commit outstanding writes and stop the writer thread"""
+        if self._writer.is_alive():
+            self._queue.put(('stop',))
+            self._writer.join()
+        self._reader.close()
+
+    def _write_loop(self):
+        connection = connect(self.path)
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            # Let writes pile up for a moment so they share one transaction
+            deadline = time.time() + self.flush_interval
+            while len(batch) < MAX_BATCH_SIZE and batch[-1][0] not in ('flush', 'stop'):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            waiters = [item[1] for item in batch if item[0] == 'flush']
+            running = not any(item[0] == 'stop' for item in batch)
+            touched = {}
+            for item in batch:
+                if item[0] in ('append', 'clear'):
+                    touched[item[1]] = touched.get(item[1], 0) + 1
+            try:
+                with connection:
+                    for item in batch:
+                        if item[0] == 'append':
+                            connection.execute(
+                                'INSERT INTO turns (user_id, role, content, created_at) VALUES (?, ?, ?, ?)', item[1:])
+                        elif item[0] == 'clear':
+                            connection.execute('DELETE FROM turns WHERE user_id = ?', (item[1],))
+                    # Only the newest turns are ever loaded - trim the rest
+                    for user_id in touched:
+                        connection.execute(
+                            'DELETE FROM turns WHERE user_id = ? AND id NOT IN '
+                            '(SELECT id FROM turns WHERE user_id = ? ORDER BY id DESC LIMIT ?)',
+                            (user_id, user_id, self.max_turns))
+            except Exception as e:
+                print(f"Error writing conversation history: {e}", flush=True)
+
+            with self._pending_lock:
+                for user_id, count in touched.items():
+                    left = self._pending.get(user_id, 0) - count
+                    if left > 0:
+                        self._pending[user_id] = left
+                    else:
+                        self._pending.pop(user_id, None)
+            for done in waiters:
+                done.set()
+        connection.close()
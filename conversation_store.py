@@ -0,0 +1,233 @@
+"""
+Conversation Store
+Bounded per-user (or per-channel) conversation history with LRU + idle-TTL eviction and a memory cap
+"""
+
+import sys
+sys.dont_write_bytecode = True
+
+import time
+import asyncio
+from itertools import islice
+from collections import OrderedDict, deque
+from context_builder import summarize_turn
+
+# Defaults (the Discord bot can override these from .env)
+# The context builder decides how many turns actually fit in a request's token budget
+MAX_HISTORY_TURNS = 32            # user + assistant turns kept per user
+CHANNEL_HISTORY_TURNS = 100       # turns kept per channel when history is shared by a channel
+SUMMARY_LINES = 16                # one-line extracts kept of turns that fell off the history
+MAX_CONVERSATIONS = 5000          # users kept in memory at once
+CONVERSATION_TTL = 6 * 60 * 60    # seconds of inactivity before a history is dropped
+MEMORY_LIMIT_BYTES = 64 * 1024 * 1024  # approximate cap on stored turn text
+
+class Turn:
+    """One message in a conversation"""
+    __slots__ = ('role', 'content', 'size')
+
+    def __init__(self, role, content):
+        self.role = role
+        self.content = content
+        self.size = sys.getsizeof(content) + TURN_OVERHEAD
+
+    def as_message(self):
+        return {'role': self.role, 'content': self.content}
+
+# Per-turn bookkeeping cost on top of the text itself (the Turn object + its deque slot)
+TURN_OVERHEAD = sys.getsizeof(Turn.__new__(Turn)) + 8
+
+class Conversation:
+    """History for one user: a shared system message plus a fixed-size deque of turns
+
+    The deque's maxlen drops the oldest turn on append, so trimming is O(1) and never
+    rebuilds the list. With `summarize`, a one-line extract of each dropped turn is kept
+    for the context builder's running summary.
+    """
+    __slots__ = ('system_message', 'turns', 'summary', 'last_active', 'size', 'turn_count',
+                 'checkpoint', 'last_prompt')
+
+    def __init__(self, system_message, max_turns=MAX_HISTORY_TURNS, summarize=False):
+        self.system_message = system_message  # Shared by every conversation - never copied
+        self.turns = deque(maxlen=max_turns)
+        self.summary = deque(maxlen=SUMMARY_LINES) if summarize else None
+        self.last_active = time.time()
+        self.size = 0
+        self.turn_count = 0       # Turns ever appended (numbers the turns across deque drops)
+        self.checkpoint = None    # Context builder state: (first turn number, summary) in stable mode
+        self.last_prompt = None   # Context builder state: shape of the previous request
+
+    def append(self, role, content):
+        """Add a turn, dropping the oldest one if full; returns the change in stored size"""
+        turn = Turn(role, content)
+        delta = turn.size
+        if len(self.turns) == self.turns.maxlen:
+            dropped = self.turns[0]
+            delta -= dropped.size
+            if self.summary is not None:
+                self.summary.append(summarize_turn(dropped.role, dropped.content))
+        self.turns.append(turn)
+        self.turn_count += 1
+        self.size += delta
+        self.last_active = time.time()
+        return delta
+
+    def messages(self):
+        """Messages in API format: system prompt followed by the kept turns"""
+        return [self.system_message] + [turn.as_message() for turn in self.turns]
+
+    def __len__(self):
+        return len(self.turns)
+
+class ConversationView:
+    """One user's window over a shared channel conversation, ending at that user's message
+
+    Reads like a Conversation for the context builder, but holds no turns of its own:
+    it is the channel's ring buffer cut off at `end` (turns other users added since are
+    left out). Context builder state stays with the channel, so requests from everyone in
+    the channel share one prompt prefix.
+    """
+    __slots__ = ('conversation', 'end')
+
+    def __init__(self, conversation, end=None):
+        self.conversation = conversation
+        self.end = conversation.turn_count if end is None else end
+
+    @property
+    def turns(self):
+        turns = self.conversation.turns
+        return islice(turns, max(0, len(turns) - (self.conversation.turn_count - self.end)))
+
+    @property
+    def turn_count(self):
+        return self.end
+
+    @property
+    def system_message(self):
+        return self.conversation.system_message
+
+    @property
+    def summary(self):
+        return self.conversation.summary
+
+    @property
+    def checkpoint(self):
+        return self.conversation.checkpoint
+
+    @checkpoint.setter
+    def checkpoint(self, value):
+        self.conversation.checkpoint = value
+
+    @property
+    def last_prompt(self):
+        return self.conversation.last_prompt
+
+    @last_prompt.setter
+    def last_prompt(self, value):
+        self.conversation.last_prompt = value
+
+class ConversationStore:
+    """Per-user conversations, evicted least-recently-used first
+
+    With scope='channel' conversations are keyed by channel instead: one ring buffer of
+    turns per channel that every user's message is appended to, and append() returns a
+    ConversationView of it rather than a per-user copy, so memory follows channel activity
+    instead of users x history.
+
+    A conversation is dropped when it has been idle longer than `ttl`, or when the store
+    holds more than `max_conversations` users or more than `memory_limit` bytes of turns.
+    With a persistent `backend` (see conversation_db), every turn is also queued for
+    writing, and a user's history is loaded back on first access after a restart or eviction.
+    On an event loop, await preload() first so that read happens in a worker thread.
+    """
+
+    def __init__(self, system_prompt, max_turns=MAX_HISTORY_TURNS, max_conversations=MAX_CONVERSATIONS,
+                 ttl=CONVERSATION_TTL, memory_limit=MEMORY_LIMIT_BYTES, backend=None, summarize=False, scope='user'):
+        self.backend = backend
+        self.scope = scope
+        self.summarize = summarize
+        self.system_message = {'role': 'system', 'content': system_prompt}
+        self.max_turns = max_turns
+        self.max_conversations = max_conversations
+        self.ttl = ttl
+        self.memory_limit = memory_limit
+        self.memory_used = 0
+        self.evictions = 0
+        self._conversations = OrderedDict()  # user (or channel) id -> Conversation, least recently used first
+
+    def get(self, user_id):
+        """Get or create the conversation for a user (marks it as most recently used)"""
+        self.expire()
+        conversation = self._conversations.get(user_id)
+        if conversation is None:
+            rows = self.backend.load(user_id, self.max_turns) if self.backend is not None else ()
+            conversation = self._install(user_id, rows)
+        else:
+            self._conversations.move_to_end(user_id)
+            conversation.last_active = time.time()
+        return conversation
+
+    async def preload(self, user_id):
+        """Load a conversation from the backend in a worker thread if it is not in memory
+
+        The disk read (and the flush of writes still queued for it) never blocks the event
+        loop; the next get() or append() finds the conversation in memory.
+        """
+        self.expire()
+        if self.backend is None or user_id in self._conversations:
+            return
+        rows = await asyncio.get_running_loop().run_in_executor(None, self.backend.load, user_id, self.max_turns)
+        if user_id not in self._conversations:
+            # (another message for the same history may have loaded it meanwhile)
+            self._install(user_id, rows)
+
+    def _install(self, user_id, rows):
+        """Add a conversation holding the given (role, content) turns as most recently used"""
+        conversation = Conversation(self.system_message, self.max_turns, self.summarize)
+        for role, content in rows:
+            self.memory_used += conversation.append(role, content)
+        self._conversations[user_id] = conversation
+        self._evict()
+        return conversation
+
+    def append(self, user_id, role, content):
+        """Add a turn to a user's conversation (channel scope: a view ending at this turn)"""
+        conversation = self.get(user_id)
+        self.memory_used += conversation.append(role, content)
+        if self.backend is not None:
+            self.backend.save_turn(user_id, role, content)
+        self._evict()
+        return ConversationView(conversation) if self.scope == 'channel' else conversation
+
+    def reset(self, user_id):
+        """Forget a user's conversation"""
+        conversation = self._conversations.pop(user_id, None)
+        if conversation is not None:
+            self.memory_used -= conversation.size
+        if self.backend is not None:
+            self.backend.clear(user_id)
+
+    def expire(self):
+        """Drop conversations idle for longer than the TTL (oldest are at the front)"""
+        cutoff = time.time() - self.ttl
+        while self._conversations:
+            conversation = next(iter(self._conversations.values()))
+            if conversation.last_active >= cutoff:
+                break
+            self._drop_oldest()
+
+    def _evict(self):
+        """Drop least recently used conversations until we are back under the caps"""
+        while len(self._conversations) > 1 and (
+                len(self._conversations) > self.max_conversations or self.memory_used > self.memory_limit):
+            self._drop_oldest()
+
+    def _drop_oldest(self):
+        _, conversation = self._conversations.popitem(last=False)
+        self.memory_used -= conversation.size
+        self.evictions += 1
+
+    def __len__(self):
+        return len(self._conversations)
+
+    def __contains__(self, user_id):
+        return user_id in self._conversations
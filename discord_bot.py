@@ -1,52 +1,35 @@
 """
 Discord Bot - Fully Customizable Personality
 Run: python discord_bot.py
+Importing this module is cheap (discord.py and dotenv load on first use); create_bot(config)
+builds a bot from a config dict, so tests and tooling need neither tokens nor a gateway
 """
 
 import sys
 sys.dont_write_bytecode = True
 
 import os
-import time
-import requests
-import discord
-from discord.ext import commands
-from dotenv import load_dotenv
+import asyncio
+import inspect
+import weakref
+from llm_client import DEFAULT_MAX_TOKENS
+from context_builder import ContextBuilder, count_message_tokens, CONTEXT_TOKEN_BUDGET
+from conversation_store import ConversationStore, MAX_CONVERSATIONS, CONVERSATION_TTL, MEMORY_LIMIT_BYTES, \
+    MAX_HISTORY_TURNS, CHANNEL_HISTORY_TURNS
+from response_cache import ResponseCache, CACHE_POLICIES, CACHE_TTL
+from request_scheduler import RequestScheduler, RequestExpired, RequestRejected, RequestSuperseded, \
+    PRIORITY_DIRECT, PRIORITY_CHANNEL, MAX_ESTIMATED_WAIT, MAX_PENDING_PER_USER, MAX_PENDING_PER_CHANNEL
+from metrics import REGISTRY, gauge, counter, start_metrics_server
 
 # Request throttling: Groq free tier allows 30 requests/minute, ~6000 tokens/minute
-MIN_REQUEST_INTERVAL = 2.5  # seconds between requests
-last_request_time = 0
-
-def estimate_tokens(text):
-    """Rough token estimation: 1 token ≈ 4 characters"""
-    return len(text) // 4
-
-def throttle_request(estimated_tokens=0):
-    """Ensure minimum time between requests to avoid rate limits"""
-    global last_request_time
-    current_time = time.time()
-    time_since_last = current_time - last_request_time
-    
-    min_interval = MIN_REQUEST_INTERVAL
-    if estimated_tokens > 4000:
-        min_interval = max(MIN_REQUEST_INTERVAL, estimated_tokens / 100)
-    
-    if time_since_last < min_interval:
-        wait_time = min_interval - time_since_last
-        if wait_time > 0.1:
-            print(f"⏳ Throttling: waiting {wait_time:.1f}s to avoid rate limits...")
-        time.sleep(wait_time)
-    
-    last_request_time = time.time()
-
-# Load environment variables
-load_dotenv()
-
-# Configuration
-DISCORD_BOT_TOKEN = os.getenv('DISCORD_BOT_TOKEN')
-GROQ_API_KEY = os.getenv('GROQ_API_KEY')
-TARGET_CHANNEL_ID = int(os.getenv('TARGET_CHANNEL_ID', '0'))
-PERSONALITY = os.getenv('PERSONALITY', """You are a helpful and friendly AI assistant. 
+# Budget is shared with any other bot processes through shared_rate_limiter, and requests
+# are released from a central queue (request_scheduler) as the budget allows
+
+def estimate_request_tokens(messages):
+    """Estimate what a request counts against the token budget (whole prompt + max completion)"""
+    return count_message_tokens(messages) + DEFAULT_MAX_TOKENS
+
+DEFAULT_PERSONALITY = """You are a helpful and friendly AI assistant. 
 You enjoy helping people and having conversations.
 
 CURRENT STATE & BEHAVIOR:
@@ -61,156 +44,507 @@ RULES:
 - DO NOT use asterisks, parentheses, or action descriptions
 - You are a REAL PERSON, NOT an AI assistant
 - Respond naturally to EVERYTHING people say
-- Match their energy and language style""")
-
-# Validate configuration
-if not DISCORD_BOT_TOKEN:
-    print("ERROR: DISCORD_BOT_TOKEN not found in .env file!")
-    print("Please copy .env.example to .env and add your Discord bot token.")
-    sys.exit(1)
-
-if not GROQ_API_KEY:
-    print("ERROR: GROQ_API_KEY not found in .env file!")
-    print("Please copy .env.example to .env and add your Groq API key.")
-    sys.exit(1)
-
-# Setup Discord bot
-intents = discord.Intents.default()
-intents.message_content = True
-bot = commands.Bot(command_prefix='!', intents=intents)
-
-# Per-user conversation history
-conversation_histories = {}
-
-def get_conversation_history(user_id):
-    """Get or create conversation history for a user"""
-    if user_id not in conversation_histories:
-        conversation_histories[user_id] = [
-            {'role': 'system', 'content': PERSONALITY}
-        ]
-    return conversation_histories[user_id]
-
-def reset_conversation_history(user_id):
-    """Reset conversation history for a user"""
-    conversation_histories[user_id] = [
-        {'role': 'system', 'content': PERSONALITY}
-    ]
-
-@bot.event
-async def on_ready():
-    print(f'✅ Bot logged in as {bot.user}')
-    if TARGET_CHANNEL_ID:
-        print(f' channel ID: {TARGET_CHANNEL_ID}')
+- Match their energy and language style"""
+
+def load_config(env=None):
+    """Bot settings from environment variables (os.environ, after load_dotenv, by default)"""
+    env = os.environ if env is None else env
+    # Sharding (optional - normally set per worker by shard_launcher.py)
+    shard_count = env.get('SHARD_COUNT', '0').lower()  # total shards: 0 = unsharded, auto = Discord's recommendation
+    return {
+        'discord_bot_token': env.get('DISCORD_BOT_TOKEN'),
+        'groq_api_key': env.get('GROQ_API_KEY'),
+        'target_channel_id': int(env.get('TARGET_CHANNEL_ID', '0')),
+        'bot_name': env.get('BOT_NAME', 'discord_bot'),
+        'stream_responses': env.get('STREAM_RESPONSES', 'true').lower() in ('1', 'true', 'yes'),
+        'max_conversations': int(env.get('MAX_CONVERSATIONS', MAX_CONVERSATIONS)),
+        'conversation_ttl': int(env.get('CONVERSATION_TTL', CONVERSATION_TTL)),
+        'conversation_memory_mb': int(env.get('CONVERSATION_MEMORY_MB', MEMORY_LIMIT_BYTES // (1024 * 1024))),
+        'context_token_budget': int(env.get('CONTEXT_TOKEN_BUDGET', CONTEXT_TOKEN_BUDGET)),
+        'context_summary': env.get('CONTEXT_SUMMARY', 'false').lower() in ('1', 'true', 'yes'),
+        'context_stable_prefix': env.get('CONTEXT_STABLE_PREFIX', 'false').lower() in ('1', 'true', 'yes'),
+        'conversation_scope': env.get('CONVERSATION_SCOPE', 'user').lower(),  # user or channel
+        'conversation_db': env.get('CONVERSATION_DB', ''),  # SQLite file path - empty keeps history in memory only
+        # Admission control: longest estimated queue wait accepted, and requests waiting per user / channel
+        'queue_max_wait': float(env.get('QUEUE_MAX_WAIT', MAX_ESTIMATED_WAIT)),
+        'queue_max_per_user': int(env.get('QUEUE_MAX_PER_USER', MAX_PENDING_PER_USER)),
+        'queue_max_per_channel': int(env.get('QUEUE_MAX_PER_CHANNEL', MAX_PENDING_PER_CHANNEL)),
+        # Multi-bot turn taking: every bot's name, and whether to ask turn_coordinator.py instead
+        # of deciding from the turn state file
+        'turn_bots': [name.strip() for name in env.get('TURN_BOTS', '').split(',') if name.strip()],
+        'turn_coordinator': env.get('TURN_COORDINATOR', 'false').lower() in ('1', 'true', 'yes'),
+        'turn_lock_free': env.get('TURN_LOCK_FREE', 'false').lower() in ('1', 'true', 'yes'),
+        'response_cache': env.get('RESPONSE_CACHE', 'off').lower(),  # off, exact or prompt
+        'response_cache_ttl': int(env.get('RESPONSE_CACHE_TTL', CACHE_TTL)),
+        'shard_count': None if shard_count == 'auto' else int(shard_count),
+        'shard_ids': [int(shard) for shard in env.get('SHARD_IDS', '').split(',') if shard.strip()],  # empty = all shards
+        'shard_worker': int(env['SHARD_WORKER']) if env.get('SHARD_WORKER') else None,
+        # Prometheus /metrics endpoint (0 = off); shard workers listen on METRICS_PORT + worker index
+        'metrics_port': int(env.get('METRICS_PORT', '0')),
+        'metrics_host': env.get('METRICS_HOST', '127.0.0.1'),
+        'personality': env.get('PERSONALITY', DEFAULT_PERSONALITY),
+    }
+
+def config_errors(config):
+    """What is missing for the bot to run (empty if nothing)"""
+    errors = []
+    if not config['discord_bot_token']:
+        errors.append("DISCORD_BOT_TOKEN not found in .env file!\n"
+                      "Please copy .env.example to .env and add your Discord bot token.")
+    if not config['groq_api_key']:
+        errors.append("GROQ_API_KEY not found in .env file!\n"
+                      "Please copy .env.example to .env and add your Groq API key.")
+    if config['conversation_scope'] not in ('user', 'channel'):
+        errors.append(f"CONVERSATION_SCOPE must be user or channel, not {config['conversation_scope']!r}")
+    return errors
+
+def create_scheduler(config, backend_pool):
+    """Request queue with the admission limits from a load_config() dict"""
+    return RequestScheduler(backend_pool, backend_pool, max_wait=config['queue_max_wait'],
+                            max_per_user=config['queue_max_per_user'], max_per_channel=config['queue_max_per_channel'])
+
+def create_turn_manager(config):
+    """Turn decider for a bot that takes turns with the others in TURN_BOTS (None if it does not)
+
+    With TURN_COORDINATOR the bot asks turn_coordinator.py (falling back to the turn state
+    file while it is down); otherwise it decides from the turn state file itself.
+    """
+    bots = config['turn_bots']
+    if len(bots) < 2 or config['bot_name'] not in bots:
+        return None
+    if config['turn_coordinator']:
+        from turn_coordinator import TurnCoordinatorClient
+        return TurnCoordinatorClient(bots=bots)
+    from turn_manager import TurnManager
+    return TurnManager(bots, lock_free=config['turn_lock_free'])
+
+def latency_summary():
+    """p50/p95 of where request time goes: queue, rate limiter, state locks, upstream API"""
+    parts = []
+    for label, name, scale, unit in (('queue', 'chatbot_queue_wait_seconds', 1, 's'),
+                                     ('throttle', 'chatbot_throttle_wait_seconds', 1, 's'),
+                                     ('lock', 'chatbot_lock_wait_seconds', 1000, 'ms'),
+                                     ('upstream', 'chatbot_upstream_latency_seconds', 1, 's')):
+        metric = REGISTRY.get(name)
+        if metric is not None and metric.count:
+            parts.append(f"{label} {metric.quantile(0.5) * scale:.1f}/{metric.quantile(0.95) * scale:.1f}{unit}")
+    return ', '.join(parts)
+
+
+# Streaming replies: Discord allows about 5 message edits per 5 seconds per channel,
+# so progressive edits are spaced out to stay well under that
+EDIT_INTERVAL = 1.2  # seconds between edits in one channel (shared by all replies there)
+DISCORD_MESSAGE_LIMIT = 2000  # characters
+
+class ChannelEditPacer:
+    """Spaces out one bot's message updates per channel, across all of its streaming replies
+
+    Discord's edit limit applies to the channel, so several replies streaming into the same
+    channel at once take turns: each update reserves the channel's next free slot.
+    """
+
+    def __init__(self, interval=EDIT_INTERVAL):
+        self.interval = interval
+        self._next = {}  # channel id -> earliest time of the next update there
+
+    async def wait(self, channel_id):
+        """Wait for (and take) the channel's next update slot"""
+        now = asyncio.get_running_loop().time()
+        if len(self._next) > 1024:
+            # Forget idle channels
+            self._next = {key: at for key, at in self._next.items() if at > now}
+        at = max(now, self._next.get(channel_id, 0.0))
+        self._next[channel_id] = at + self.interval
+        if at > now:
+            await asyncio.sleep(at - now)
+
+class StreamingReply:
+    """Shows a streamed response as it arrives by progressively editing Discord messages
+
+    Text past the 2000 character limit continues in a new message. Edits happen on a
+    background task, paced by the bot's ChannelEditPacer, so a fast stream (or several
+    streams in one channel) never floods the channel with edit requests.
+    """
+
+    def __init__(self, channel, pacer):
+        self.channel = channel
+        self.pacer = pacer
+        self.text = ''
+        self._messages = []  # Discord messages sent so far (one per 2000-char chunk)
+        self._shown = []     # Text currently shown in each of them
+        self._changed = asyncio.Event()
+        self._finished = False
+        self._task = None
+
+    def on_delta(self, delta):
+        """Append streamed text (called by the completion client for every delta)"""
+        self.text += delta
+        self._changed.set()
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._edit_loop())
+
+    async def _edit_loop(self):
+        while True:
+            await self._changed.wait()
+            await self.pacer.wait(self.channel.id)
+            self._changed.clear()
+            await self._flush()
+            # Text that arrived (or finish() replaced) during the flush still needs one more
+            if self._finished and not self._changed.is_set():
+                return
+
+    async def _flush(self):
+        """Bring the Discord messages in line with the text received so far"""
+        chunks = [self.text[i:i + DISCORD_MESSAGE_LIMIT] for i in range(0, len(self.text), DISCORD_MESSAGE_LIMIT)]
+        for i, chunk in enumerate(chunks):
+            if not chunk.strip():
+                continue  # Discord rejects empty messages
+            if i < len(self._messages):
+                if self._shown[i] != chunk:
+                    await self._messages[i].edit(content=chunk)
+                    self._shown[i] = chunk
+            else:
+                self._messages.append(await self.channel.send(chunk))
+                self._shown.append(chunk)
+
+    async def finish(self, final_text=None):
+        """Flush the complete response (optionally replacing the streamed text)"""
+        if final_text is not None:
+            self.text = final_text
+        self._finished = True
+        if self._task is None:
+            await self._flush()
+        else:
+            self._changed.set()
+            await self._task
+
+    def cancel(self):
+        """Stop the edit task (the request failed - whatever is shown stays as it is)"""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
+async def send_reply(channel, text):
+    """Send a complete response, split at Discord's message length limit"""
+    for i in range(0, len(text), DISCORD_MESSAGE_LIMIT):
+        await channel.send(text[i:i + DISCORD_MESSAGE_LIMIT])
+
+# Conversation stores of every bot in this process (several with bot_host.py), for the gauges
+_conversation_stores = weakref.WeakSet()
+
+# Conversation store size, read when /metrics is scraped
+gauge('chatbot_conversations', 'Conversations held in memory').set_function(
+    lambda: sum(len(store) for store in list(_conversation_stores)))
+gauge('chatbot_conversation_memory_bytes', 'Estimated memory used by conversation histories').set_function(
+    lambda: sum(store.memory_used for store in list(_conversation_stores)))
+counter('chatbot_conversation_evictions_total', 'Conversations evicted from memory').set_function(
+    lambda: sum(store.evictions for store in list(_conversation_stores)))
+
+def create_bot(config, backend_pool=None, scheduler=None, turn_manager=None):
+    """Build the Discord bot and everything it serves requests with from a load_config() dict
+
+    `backend_pool` replaces the one built from the config's API keys (e.g. a mock server),
+    and `scheduler` the request queue - bots hosted in one process share both. With a
+    `turn_manager`, bots answering the same channels take turns: a message that mentions
+    a bot goes to the bots it mentions, any other message to the bot the turn manager picks.
+    The components are attached to the returned bot (bot.backend_pool, bot.scheduler,
+    bot.conversation_store, bot.response_cache, bot.conversation_db, bot.config).
+    """
+    # Imported here: discord.py is by far the slowest import and only the running bot needs it
+    import discord
+    from discord.ext import commands
+
+    personality = config['personality']
+    target_channel_id = config['target_channel_id']
+    stream_responses = config['stream_responses']
+    sharded = config['shard_count'] != 0
+    shard_worker = config['shard_worker']
+    rate_limiter_name = config['bot_name']
+    if shard_worker is not None:
+        rate_limiter_name = f"{rate_limiter_name}-worker{shard_worker}"
+
+    # Setup Discord bot
+    intents = discord.Intents.default()
+    intents.message_content = True
+    if sharded:
+        # One gateway connection per shard in this process; other workers run the other shards
+        bot = commands.AutoShardedBot(command_prefix='!', intents=intents,
+                                      shard_count=config['shard_count'], shard_ids=config['shard_ids'] or None)
     else:
-        print('⚠️  No TARGET_CHANNEL_ID set - bot will respond to all channels')
-
-@bot.event
-async def on_message(message):
-    # Ignore bot's own messages
-    if message.author == bot.user:
-        return
-    
-    # Check if message is in target channel (if set)
-    if TARGET_CHANNEL_ID and message.channel.id != TARGET_CHANNEL_ID:
-        return
-    
-    # Check if bot is mentioned or message is a DM
-    is_mentioned = bot.user in message.mentions
-    is_dm = isinstance(message.channel, discord.DMChannel)
-    
-    # Only respond to mentions, DMs, or messages in target channel
-    if not (is_mentioned or is_dm or TARGET_CHANNEL_ID):
-        return
-    
-    # Process commands first
-    await bot.process_commands(message)
-    
-    # Don't respond to commands (they handle their own responses)
-    if message.content.startswith('!'):
-        return
-    
-    # Get conversation history for this user
-    conversation_history = get_conversation_history(message.author.id)
-    
-    # Add user message
-    conversation_history.append({'role': 'user', 'content': message.content})
-    
-    # Keep history manageable (last 4 exchanges)
-    if len(conversation_history) > 9:  # system + 4 exchanges
-        conversation_history = [conversation_history[0]] + conversation_history[-8:]
-        conversation_histories[message.author.id] = conversation_history
-    
-    # Estimate tokens and throttle
-    estimated_tokens = estimate_tokens(PERSONALITY + message.content)
-    throttle_request(estimated_tokens)
-    
-    # Show typing indicator
-    async with message.channel.typing():
-        # Make API request
-        try:
-            response = requests.post(
-                'https://api.groq.com/openai/v1/chat/completions',
-                headers={
-                    'Authorization': f'Bearer {GROQ_API_KEY}',
-                    'Content-Type': 'application/json'
-                },
-                json={
-                    'model': 'llama-3.1-8b-instant',
-                    'messages': conversation_history,
-                    'max_tokens': 200,
-                    'temperature': 0.9
-                },
-                timeout=15
-            )
-            
-            if response.status_code == 200:
-                response_data = response.json()
-                bot_response = response_data['choices'][0]['message']['content']
-                
-                # Add bot response to history
-                conversation_history.append({'role': 'assistant', 'content': bot_response})
-                
-                # Split long messages (Discord limit is 2000 chars)
-                if len(bot_response) > 2000:
-                    chunks = [bot_response[i:i+2000] for i in range(0, len(bot_response), 2000)]
-                    for chunk in chunks:
-                        await message.channel.send(chunk)
+        bot = commands.Bot(command_prefix='!', intents=intents)
+
+    # Completion backends (GROQ_API_KEY plus optional GROQ_API_KEYS / LLM_BACKENDS): each has its
+    # own shared rate budget and circuit breaker, requests go to the one with the most headroom
+    if backend_pool is None:
+        from backend_pool import get_backend_pool
+        backend_pool = get_backend_pool(rate_limiter_name, worker=shard_worker, api_key=config['groq_api_key'])
+
+    # Central request queue: DMs/mentions first, fair across users, identical prompts coalesced
+    # In a sharded deployment each worker's share of the budget follows its queue depth
+    # Under overload it sheds load: requests that would wait too long are turned away at once
+    if scheduler is None:
+        scheduler = create_scheduler(config, backend_pool)
+
+    # Per-user conversation history (bounded: LRU + idle TTL + memory cap), or with
+    # CONVERSATION_SCOPE=channel one shared history per channel that sees every message there
+    # Optionally persisted to SQLite with write-behind, so history survives restarts
+    # Sharded: guild messages arrive on the guild's shard and DMs on shard 0, so each worker
+    # only holds the histories of the users it serves
+    channel_scope = config['conversation_scope'] == 'channel'
+    max_turns = CHANNEL_HISTORY_TURNS if channel_scope else MAX_HISTORY_TURNS
+    conversation_db = None
+    if config['conversation_db']:
+        from conversation_db import ConversationDB
+        # Keeps as many turns on disk as the store holds in memory
+        conversation_db = ConversationDB(config['conversation_db'], max_turns=max_turns)
+    conversation_store = ConversationStore(
+        personality,
+        max_turns=max_turns,
+        max_conversations=config['max_conversations'],
+        ttl=config['conversation_ttl'],
+        memory_limit=config['conversation_memory_mb'] * 1024 * 1024,
+        backend=conversation_db,
+        summarize=config['context_summary'],
+        scope='channel' if channel_scope else 'user'
+    )
+
+    # Optional cache for repeated prompts (hits skip the API and the rate budget)
+    response_cache = None
+    if config['response_cache'] in CACHE_POLICIES:
+        response_cache = ResponseCache(ttl=config['response_cache_ttl'], policy=config['response_cache'])
+
+    # Each request gets the newest turns that fit the token budget (not a fixed turn count);
+    # with a stable prefix, turns are appended until a checkpoint instead of sliding the window
+    context_builder = ContextBuilder(config['context_token_budget'], summarize=config['context_summary'],
+                                     stable_prefix=config['context_stable_prefix'])
+
+    # Streaming replies of this bot share one edit budget per channel
+    edit_pacer = ChannelEditPacer()
+
+    async def remember(key, role, content):
+        """Append a turn to a history (one that is not in memory is read from disk in a worker thread first)"""
+        await conversation_store.preload(key)
+        return conversation_store.append(key, role, content)
+
+    _conversation_stores.add(conversation_store)
+
+    bot.config = config
+    bot.backend_pool = backend_pool
+    bot.scheduler = scheduler
+    bot.conversation_store = conversation_store
+    bot.conversation_db = conversation_db
+    bot.response_cache = response_cache
+
+    @bot.event
+    async def on_ready():
+        print(f'✅ Bot logged in as {bot.user}')
+        if sharded:
+            print(f' shards: {sorted(bot.shards)} of {bot.shard_count} ({len(bot.guilds)} guilds)')
+        if target_channel_id:
+            print(f' channel ID: {target_channel_id}')
+        else:
+            print('⚠️  No TARGET_CHANNEL_ID set - bot will respond to all channels')
+        if config['metrics_port']:
+            await start_metrics_server(config['metrics_port'] + (shard_worker or 0), config['metrics_host'])
+
+    @bot.event
+    async def on_message(message):
+        # Ignore bot's own messages
+        if message.author == bot.user:
+            return
+
+        # Check if message is in target channel (if set)
+        if target_channel_id and message.channel.id != target_channel_id:
+            return
+
+        # Check if bot is mentioned or message is a DM
+        is_mentioned = bot.user in message.mentions
+        is_dm = isinstance(message.channel, discord.DMChannel)
+
+        # Channel scope: every message in the channel is context, whichever bot answers it
+        # (the view returned ends at this message, whatever arrives while it is handled)
+        history_key = message.channel.id if channel_scope else message.author.id
+        conversation = None
+        if channel_scope and not message.content.startswith('!'):
+            conversation = await remember(history_key, 'user', f"{message.author.display_name}: {message.content}")
+
+        # Only respond to mentions, DMs, or messages in target channel
+        if not (is_mentioned or is_dm or target_channel_id):
+            return
+
+        # Several bots in this channel: a message for another bot is theirs, anything else
+        # goes to whichever bot's turn it is (every bot computes the same answer)
+        if turn_manager is not None and not (is_mentioned or is_dm):
+            if any(user.bot for user in message.mentions):
+                return
+            # A file-based or in-memory turn manager answers at once, the coordinator client asynchronously
+            respond = turn_manager.should_respond(config['bot_name'], message.id)
+            if inspect.isawaitable(respond):
+                respond = await respond
+            if not respond:
+                return
+
+        # Process commands first
+        await bot.process_commands(message)
+
+        # Don't respond to commands (they handle their own responses)
+        if message.content.startswith('!'):
+            return
+
+        # Add user message, then pack the newest turns into the token budget
+        if conversation is None:
+            conversation = await remember(history_key, 'user', message.content)
+        conversation_history = context_builder.build(conversation)
+
+        # Repeated prompt? Answer from the cache without touching the API or the rate budget
+        cache_key = response_cache.key(conversation_history) if response_cache else None
+        cached_response = response_cache.get(cache_key) if cache_key else None
+        if cached_response is not None:
+            await remember(history_key, 'assistant', cached_response)
+            await send_reply(message.channel, cached_response)
+            return
+
+        # DMs and mentions jump ahead of ordinary channel chatter
+        priority = PRIORITY_DIRECT if (is_dm or is_mentioned) else PRIORITY_CHANNEL
+
+        # Show typing indicator
+        async with message.channel.typing():
+            # Queue the request - the scheduler releases it when the shared budget allows
+            try:
+                reply = StreamingReply(message.channel, edit_pacer) if stream_responses else None
+                response = await scheduler.submit(
+                    conversation_history,
+                    message.author.id,
+                    priority=priority,
+                    estimated_tokens=estimate_request_tokens(conversation_history),
+                    on_delta=reply.on_delta if reply else None,
+                    channel_id=message.channel.id,
+                    supersede=True,
+                    # Only this bot's own waiting requests for this history can be replaced
+                    conversation_key=(config['bot_name'], history_key)
+                )
+
+                if response.status_code == 200:
+                    bot_response = response.content
+
+                    # Add bot response to history (and the cache, if enabled)
+                    await remember(history_key, 'assistant', bot_response)
+                    if cache_key:
+                        response_cache.put(cache_key, bot_response)
+
+                    if reply:
+                        # Already shown progressively - just make sure the final text is there
+                        await reply.finish(bot_response)
+                    else:
+                        # Split long messages (Discord limit is 2000 chars)
+                        await send_reply(message.channel, bot_response)
+
+                elif response.status_code == 429:
+                    # Still rate limited after the automatic retries - tell the user how long from the server's Retry-After
+                    retry_after = response.rate_limit.get('retry_after')
+                    wait = f" Please try again in {retry_after:.0f}s." if retry_after is not None else " Please wait a moment..."
+                    await message.channel.send(f"⏳ Rate limited!{wait}")
                 else:
-                    await message.channel.send(bot_response)
-                    
-            elif response.status_code == 429:
-                await message.channel.send("⏳ Rate limited! Please wait a moment...")
-            else:
-                await message.channel.send(f"❌ Error: {response.status_code}")
-                
-        except Exception as e:
-            print(f"Error: {e}")
-            await message.channel.send(f"❌ Error occurred: {str(e)}")
-
-@bot.command(name='ping')
-async def ping(ctx):
-    """Check if bot is responding"""
-    await ctx.send('Pong!')
-
-@bot.command(name='reset')
-async def reset(ctx):
-    """Reset conversation history"""
-    reset_conversation_history(ctx.author.id)
-    await ctx.send('✅ Conversation history reset!')
-
-@bot.command(name='status')
-async def status(ctx):
-    """Check bot status"""
-    status_msg = f"✅ Bot is online!\n"
-    status_msg += f"📝 Personality loaded: {len(PERSONALITY)} characters\n"
-    status_msg += f"💬 Active conversations: {len(conversation_histories)}"
-    await ctx.send(status_msg)
+                    await message.channel.send(f"❌ Error: {response.status_code}")
 
-if __name__ == '__main__':
+            except RequestSuperseded:
+                # The user sent another message before this one was answered - that reply covers both
+                pass
+            except RequestRejected as e:
+                await message.channel.send(f"⏳ Too busy right now - please try again in {max(e.retry_after, 1):.0f}s!")
+            except RequestExpired:
+                await message.channel.send("⏳ Too busy right now - please try again in a moment!")
+            except Exception as e:
+                print(f"Error: {e}")
+                await message.channel.send(f"❌ Error occurred: {str(e)}")
+            finally:
+                # A stream that failed partway never reaches finish() - don't leave its edit task behind
+                if reply:
+                    reply.cancel()
+
+    @bot.command(name='ping')
+    async def ping(ctx):
+        """Check if bot is responding"""
+        await ctx.send('Pong!')
+
+    @bot.command(name='reset')
+    async def reset(ctx):
+        """Reset conversation history"""
+        if channel_scope:
+            conversation_store.reset(ctx.channel.id)
+            await ctx.send('✅ Channel conversation history reset!')
+            return
+        conversation_store.reset(ctx.author.id)
+        await ctx.send('✅ Conversation history reset!')
+
+    @bot.command(name='status')
+    async def status(ctx):
+        """Check bot status"""
+        status_msg = f"✅ Bot is online!\n"
+        status_msg += f"📝 Personality loaded: {len(personality)} characters\n"
+        if sharded:
+            status_msg += f"🧩 Shard {ctx.guild.shard_id if ctx.guild else 0} of {bot.shard_count} "
+            status_msg += f"(worker {shard_worker if shard_worker is not None else 0}: shards {sorted(bot.shards)}, {len(bot.guilds)} guilds)\n"
+        status_msg += f"💬 Active conversations: {len(conversation_store)} "
+        status_msg += f"({conversation_store.memory_used / 1024:.0f} KB, {conversation_store.evictions} evicted)\n"
+        stats = scheduler.stats()
+        status_msg += f"📬 Queue: {stats['queue_depth']} waiting, {stats['in_flight']} in flight "
+        status_msg += f"(wait p50 {stats['wait_p50']:.1f}s, p95 {stats['wait_p95']:.1f}s, {stats['coalesced']} coalesced, "
+        status_msg += f"{stats['superseded']} superseded, {stats['rejected']} turned away; next wait ~{stats['estimated_wait']:.0f}s)"
+        latency = latency_summary()
+        if latency:
+            status_msg += f"\n⏱️ Latency p50/p95: {latency}"
+        context = context_builder.stats()
+        if context['prefix_reuse']:
+            status_msg += f"\n🧱 Prompt prefix reuse: {context['prefix_reuse']:.0%} of request bytes repeat the user's previous request"
+            if context['stable_prefix']:
+                status_msg += f" ({context['checkpoints']} checkpoints)"
+        connections = backend_pool.transport.stats()
+        if connections['new_connections']:
+            status_msg += f"\n🔌 Connections: {connections['new_connections']} opened, {connections['reused_connections']} reused "
+            status_msg += f"({connections['reuse_rate']:.0%} reuse{', HTTP/2' if connections['http2'] else ''})"
+        if len(backend_pool.backends) > 1:
+            status_msg += "\n🔀 Backends: " + ", ".join(
+                f"{backend['name']} ({backend['state']}, {backend['requests']} requests, {backend['errors']} errors)"
+                for backend in backend_pool.stats())
+        if response_cache:
+            cache = response_cache.stats()
+            status_msg += f"\n🗂️ Response cache ({response_cache.policy}): {cache['hits']} hits, {cache['misses']} misses "
+            status_msg += f"({cache['hit_rate']:.0%} hit rate, {cache['entries']} entries)"
+        await ctx.send(status_msg)
+
+    return bot
+
+def main():
+    # Imported here so importing this module does not need python-dotenv
+    from dotenv import load_dotenv
+
+    # Load environment variables
+    load_dotenv()
+    config = load_config()
+
+    # Validate configuration
+    errors = config_errors(config)
+    for error in errors:
+        print(f"ERROR: {error}")
+    if errors:
+        sys.exit(1)
+
+    bot = None
+    turn_manager = create_turn_manager(config)
     try:
         print("Starting Discord bot...")
-        print(f"Personality loaded: {len(PERSONALITY)} characters")
-        bot.run(DISCORD_BOT_TOKEN)
+        print(f"Personality loaded: {len(config['personality'])} characters")
+        bot = create_bot(config, turn_manager=turn_manager)
+        bot.run(config['discord_bot_token'])
     except Exception as e:
         print(f"Fatal error: {e}")
         sys.exit(1)
+    finally:
+        if bot is not None and bot.conversation_db is not None:
+            bot.conversation_db.close()
+        # (a coordinator client's connection just closes with the process)
+        if turn_manager is not None and not config['turn_coordinator']:
+            turn_manager.close()
+
+if __name__ == '__main__':
+    main()
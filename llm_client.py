@@ -0,0 +1,211 @@
+"""
+Async LLM Client
+Non-blocking completion client for OpenAI-compatible APIs (Groq by default)
+Shared by chat.py and discord_bot.py so many conversations can be in flight at once
+"""
+
+import sys
+sys.dont_write_bytecode = True
+
+import re
+import json
+import time
+from email.utils import parsedate_to_datetime
+from upstream_transport import UpstreamTransport
+from request_body import RequestBody
+
+# Groq OpenAI-compatible endpoint
+GROQ_API_URL = 'https://api.groq.com/openai/v1/chat/completions'
+DEFAULT_MODEL = 'llama-3.1-8b-instant'
+DEFAULT_MAX_TOKENS = 200
+DEFAULT_TEMPERATURE = 0.9
+
+# Extra fields of a streamed request (usage arrives on the last chunk)
+STREAM_FIELDS = {'stream': True, 'stream_options': {'include_usage': True}}
+
+# Rate-limit durations as sent by Groq/OpenAI: '7', '7.66s', '2m59.56s', '1h2m', '250ms'
+NUMBER = re.compile(r'\d+(?:\.\d+)?')
+DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+DURATION_UNITS = {'h': 3600.0, 'm': 60.0, 's': 1.0, 'ms': 0.001}
+
+def parse_duration(value):
+    """Seconds in a rate-limit duration header value (None if it cannot be parsed)"""
+    value = value.strip()
+    if NUMBER.fullmatch(value):
+        return float(value)
+    parts = DURATION_PART.findall(value)
+    if not parts or ''.join(amount + unit for amount, unit in parts) != value:
+        return None
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in parts)
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After value (delay in seconds or an HTTP date)"""
+    seconds = parse_duration(value)
+    if seconds is None:
+        try:
+            seconds = max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+    return seconds
+
+def parse_rate_limit_headers(headers):
+    """Server rate-limit state from response headers
+
+    Returns a dict with whichever of retry_after, remaining_requests, remaining_tokens,
+    reset_requests and reset_tokens (seconds) the response carried.
+    """
+    headers = {name.lower(): value for name, value in headers.items()}
+    limits = {}
+    if 'retry-after' in headers:
+        retry_after = parse_retry_after(headers['retry-after'])
+        if retry_after is not None:
+            limits['retry_after'] = retry_after
+    for kind in ('requests', 'tokens'):
+        remaining = headers.get(f'x-ratelimit-remaining-{kind}')
+        if remaining is not None and remaining.strip().isdigit():
+            limits[f'remaining_{kind}'] = int(remaining)
+        reset = headers.get(f'x-ratelimit-reset-{kind}')
+        if reset is not None:
+            seconds = parse_duration(reset)
+            if seconds is not None:
+                limits[f'reset_{kind}'] = seconds
+    return limits
+
+class CompletionResult:
+    """Result of a completion request (status code, parsed JSON body and response headers)"""
+
+    def __init__(self, status_code, data=None, headers=None):
+        self.status_code = status_code
+        self.data = data
+        self.headers = headers or {}
+
+    @property
+    def content(self):
+        """Text of the first choice, or None if the request failed"""
+        if self.status_code != 200 or not self.data:
+            return None
+        return self.data['choices'][0]['message']['content']
+
+    @property
+    def usage(self):
+        """Token usage reported by the API ({} if not present)"""
+        if not self.data:
+            return {}
+        return self.data.get('usage') or {}
+
+    @property
+    def rate_limit(self):
+        """Rate-limit state the server reported with this response (see parse_rate_limit_headers)"""
+        return parse_rate_limit_headers(self.headers)
+
+class CompletionClient:
+    """Async completion client over a pooled, keep-alive upstream transport
+
+    Clients for different keys can share one UpstreamTransport (the backend pool does);
+    without one the client opens its own and closes it in close(). Request bodies are
+    assembled from pre-encoded segments (see request_body), so the system prompt and the
+    turns already sent are not serialized again for every request.
+    """
+
+    def __init__(self, api_key, api_url=GROQ_API_URL, model=DEFAULT_MODEL,
+                 max_tokens=DEFAULT_MAX_TOKENS, temperature=DEFAULT_TEMPERATURE, transport=None):
+        self.api_key = api_key
+        self.api_url = api_url
+        self.model = model
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self._owns_transport = transport is None
+        self.transport = transport if transport is not None else UpstreamTransport()
+        self.headers = {
+            'Authorization': f'Bearer {self.api_key}',
+            'Content-Type': 'application/json'
+        }
+        self._body = RequestBody(self._fields())
+        self._stream_body = RequestBody(self._fields(**STREAM_FIELDS))
+
+    def _fields(self, **overrides):
+        """Request fields other than the messages"""
+        fields = {'model': self.model, 'max_tokens': self.max_tokens, 'temperature': self.temperature}
+        fields.update(overrides)
+        return fields
+
+    def build_payload(self, messages, **overrides):
+        """Build the JSON request body for a chat completion"""
+        return dict(self._fields(**overrides), messages=messages)
+
+    def build_body(self, messages, stream=False, **overrides):
+        """build_payload() as encoded JSON, from cached segments (streamed with `stream`)"""
+        if overrides:
+            # Unusual fields: only the messages come from the cache
+            fields = dict(STREAM_FIELDS, **overrides) if stream else overrides
+            return RequestBody(self._fields(**fields)).encode(messages)
+        return (self._stream_body if stream else self._body).encode(messages)
+
+    async def complete(self, messages, **overrides):
+        """Request a completion for the given messages without blocking the event loop"""
+        async with self.transport.post(self.api_url, self.build_body(messages, **overrides),
+                                       self.headers) as response:
+            data = None
+            if response.status == 200:
+                data = await response.json()
+            else:
+                # Drain the body so the connection can go back to the pool
+                await response.read()
+            return CompletionResult(response.status, data, dict(response.headers))
+
+    async def stream_complete(self, messages, on_delta=None, **overrides):
+        """Request a streamed (SSE) completion, calling on_delta(text) as each piece arrives
+
+        Returns a CompletionResult shaped like a non-streamed response once the stream ends.
+        """
+        body = self.build_body(messages, stream=True, **overrides)
+        async with self.transport.post(self.api_url, body, self.headers) as response:
+            if response.status != 200:
+                await response.read()
+                return CompletionResult(response.status, None, dict(response.headers))
+
+            parts = []
+            usage = None
+            async for raw_line in response.lines():
+                line = raw_line.strip()
+                if not line.startswith('data:'):
+                    continue  # Blank separators, comments and keep-alives
+                data = line[5:].strip()
+                if data == '[DONE]':
+                    break
+                chunk = json.loads(data)
+                # OpenAI sends usage on the last chunk, Groq also nests it under x_groq
+                usage = chunk.get('usage') or (chunk.get('x_groq') or {}).get('usage') or usage
+                for choice in chunk.get('choices') or []:
+                    delta = (choice.get('delta') or {}).get('content')
+                    if delta:
+                        parts.append(delta)
+                        if on_delta is not None:
+                            on_delta(delta)
+
+            data = {
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ''.join(parts)}}],
+                'usage': usage or {}
+            }
+            return CompletionResult(response.status, data, dict(response.headers))
+
+    async def close(self):
+        """Close the transport and its pooled connections (if this client opened it)"""
+        if self._owns_transport:
+            await self.transport.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+# Global instance (one pool per process)
+_completion_client = None
+
+def get_completion_client(api_key=None):
+    """Get or create the shared completion client instance"""
+    global _completion_client
+    if _completion_client is None:
+        _completion_client = CompletionClient(api_key)
+    return _completion_client
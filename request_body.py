@@ -0,0 +1,47 @@
+"""
+Request Body
+Pre-encoded JSON for completion requests: each distinct message is serialized once and
+cached (above all the system prompt, several KB and part of every request), and a body is
+assembled by joining cached byte segments instead of re-encoding the whole history
+"""
+
+import sys
+sys.dont_write_bytecode = True
+
+import json
+from functools import lru_cache
+
+# Distinct messages whose encoding is kept: the personalities, plus the recent turns of
+# active conversations (each is part of several requests while it stays in the context)
+ENCODED_MESSAGES = 8192
+
+def _dumps(value):
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False).encode()
+
+@lru_cache(maxsize=ENCODED_MESSAGES)
+def encode_message(role, content):
+    """JSON bytes of one {'role', 'content'} message (cached - strings hash once)"""
+    return _dumps({'role': role, 'content': content})
+
+def encode_messages(messages):
+    """JSON array of messages, joined from the cached per-message segments"""
+    # Only plain {'role', 'content'} messages use the cache; anything else (a name, tool
+    # calls, a list of content parts) is encoded as it is
+    return b'[' + b','.join([encode_message(m['role'], m['content'])
+                             if m.keys() == {'role', 'content'} and isinstance(m['content'], str) else _dumps(m)
+                             for m in messages]) + b']'
+
+class RequestBody:
+    """Request bodies with a fixed set of fields (model, max_tokens, ...) and varying messages
+
+    The fields are encoded once; encode() only joins them with the messages' segments.
+    """
+    __slots__ = ('prefix',)
+
+    def __init__(self, fields):
+        encoded = _dumps(fields)
+        self.prefix = encoded[:-1] + (b',' if fields else b'') + b'"messages":'
+
+    def encode(self, messages):
+        """Complete JSON body for these messages"""
+        return self.prefix + encode_messages(messages) + b'}'
@@ -0,0 +1,310 @@
+"""
+Request Scheduler
+Central async queue in front of the completion API: DMs and mentions first, per-user
+fairness, deadline-aware dispatch, one upstream call for identical in-flight prompts, and
+admission control (bounded per-user/per-channel queues, early rejection, superseding)
+"""
+
+import sys
+sys.dont_write_bytecode = True
+
+import time
+import heapq
+import asyncio
+import hashlib
+from collections import deque
+from metrics import counter, gauge, histogram
+from request_body import encode_messages
+
+# Priorities (lower is served first)
+PRIORITY_DIRECT = 0   # DMs and mentions
+PRIORITY_CHANNEL = 1  # Ordinary messages in the target channel
+
+# How long a request may wait in the queue before it is dropped
+DEFAULT_DEADLINE = 120.0  # seconds
+
+# Admission control: a request is turned away at once if the queue ahead of it would take
+# longer than this to serve with the current budget, instead of being answered minutes late
+MAX_ESTIMATED_WAIT = 30.0  # seconds
+
+# Requests one user, and one channel, may have waiting at once
+MAX_PENDING_PER_USER = 2
+MAX_PENDING_PER_CHANNEL = 10
+
+# Number of recent queue wait times kept for the latency percentiles
+WAIT_SAMPLES = 500
+
+QUEUE_DEPTH = gauge('chatbot_queue_depth', 'Requests waiting in the scheduler queue')
+QUEUE_WAIT = histogram('chatbot_queue_wait_seconds', 'Time from submit until the request was sent')
+SCHEDULED = counter('chatbot_scheduled_requests_total', 'Submitted requests by outcome', ('outcome',))
+
+class RequestExpired(Exception):
+    """Raised to every waiter of a request that waited past its deadline"""
+
+class RequestRejected(Exception):
+    """Raised by submit() when the queue is full or would not serve the request in time"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after  # Estimated seconds until a new request would be served
+
+class RequestSuperseded(Exception):
+    """Raised to a queued request replaced by a newer one from the same user and channel"""
+
+class _Job:
+    """One queued upstream request (possibly shared by several waiters)"""
+    __slots__ = ('key', 'messages', 'user_id', 'channel_id', 'conversation_key', 'priority', 'deadline',
+                 'estimated_tokens', 'on_delta', 'enqueued_at', 'future', 'sort_key', 'waiters')
+
+    def __init__(self, key, messages, user_id, priority, deadline, estimated_tokens, future, on_delta=None,
+                 channel_id=None, conversation_key=None):
+        self.key = key
+        self.messages = messages
+        self.user_id = user_id
+        self.channel_id = channel_id
+        self.conversation_key = conversation_key
+        self.priority = priority
+        self.deadline = deadline
+        self.estimated_tokens = estimated_tokens
+        self.on_delta = on_delta
+        self.enqueued_at = time.time()
+        self.future = future
+        self.sort_key = None
+        self.waiters = 1
+
+    def __lt__(self, other):
+        return self.sort_key < other.sort_key
+
+def prompt_key(messages):
+    """Key identifying an upstream request - identical prompts share one call"""
+    return hashlib.sha1(encode_messages(messages)).hexdigest()
+
+class RequestScheduler:
+    """Orders completion requests and releases them as the shared rate budget allows
+
+    Jobs are ordered by (priority, fair-share round, deadline). Each user's n-th pending
+    job lands in round current+n, so a user with a burst of messages cannot starve
+    others at the same priority. A slot from the rate limiter is claimed first and then
+    given to whichever job is best at that moment, so a DM that arrives while the
+    dispatcher is waiting for budget still goes out next.
+
+    Under overload the queue is bounded instead of growing: a user or channel with too
+    many requests waiting, or a request whose estimated wait (from the rate limiter's
+    state) exceeds `max_wait`, is rejected at submit(). With `supersede`, a user's new
+    request replaces their requests still waiting in the same channel and conversation, so
+    a burst of messages becomes one request (its history already holds the earlier messages).
+    Bots sharing the scheduler pass their own `conversation_key`, so one bot's request never
+    replaces another's.
+    """
+
+    def __init__(self, client, rate_limiter, default_deadline=DEFAULT_DEADLINE, max_wait=MAX_ESTIMATED_WAIT,
+                 max_per_user=MAX_PENDING_PER_USER, max_per_channel=MAX_PENDING_PER_CHANNEL):
+        self.client = client
+        self.rate_limiter = rate_limiter
+        self.default_deadline = default_deadline
+        self.max_wait = max_wait
+        self.max_per_user = max_per_user
+        self.max_per_channel = max_per_channel
+        self._heap = []
+        self._inflight = {}      # prompt key -> job (queued or sending) shared by every waiter
+        self._user_rounds = {}   # user id -> last fair-share round assigned
+        self._round = 0
+        self._seq = 0
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._sending = 0
+        self._wait_times = deque(maxlen=WAIT_SAMPLES)
+        self.dispatched = 0
+        self.coalesced = 0
+        self.expired = 0
+        self.rejected = 0
+        self.superseded = 0
+
+    def _ensure_running(self):
+        """Start the dispatcher task (lazily, from inside the running event loop)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._dispatch_loop())
+
+    async def submit(self, messages, user_id, priority=PRIORITY_CHANNEL, deadline=None, estimated_tokens=0,
+                     on_delta=None, channel_id=None, supersede=False, conversation_key=None):
+        """Queue a completion request and wait for its CompletionResult
+
+        With on_delta the response is streamed and on_delta(text) is called as it arrives;
+        streamed requests belong to a single waiter, so they are never coalesced. Raises
+        RequestRejected at once if the request is not admitted, and RequestSuperseded if a
+        newer request from the same user, channel and conversation (the history the messages
+        were built from) replaces it while it waits.
+        """
+        self._ensure_running()
+        key = prompt_key(messages) if on_delta is None else None
+
+        # Identical prompt already queued or in flight - share its result
+        shared = self._inflight.get(key) if key is not None else None
+        if shared is not None:
+            shared.waiters += 1
+            self.coalesced += 1
+            SCHEDULED.labels('coalesced').inc()
+            return await asyncio.shield(shared.future)
+
+        # A newer message from the same user in the same channel and conversation takes the place
+        # of their waiting requests (and their deadline): its history already holds those messages
+        stale = self._stale(user_id, channel_id, conversation_key) if supersede else []
+        if stale:
+            stale_priority, user_round, deadline, seq = min(job.sort_key for job in stale)
+            priority = min(priority, stale_priority)
+        else:
+            if deadline is None:
+                deadline = time.time() + self.default_deadline
+            user_round = max(self._round, self._user_rounds.get(user_id, 0)) + 1
+            seq = self._seq + 1
+        sort_key = (priority, user_round, deadline, seq)
+        self._admit(user_id, channel_id, sort_key, estimated_tokens, stale)
+        self._supersede(stale)
+
+        future = asyncio.get_running_loop().create_future()
+        # Snapshot the messages - the caller's history keeps changing while we wait
+        job = _Job(key, list(messages), user_id, priority, deadline, estimated_tokens, future, on_delta,
+                   channel_id, conversation_key)
+        if not stale:
+            self._user_rounds[user_id] = user_round
+            self._seq += 1
+        job.sort_key = sort_key
+
+        heapq.heappush(self._heap, job)
+        if key is not None:
+            self._inflight[key] = job
+        self.rate_limiter.set_demand(len(self._heap))
+        QUEUE_DEPTH.set(len(self._heap))
+        self._wakeup.set()
+        return await asyncio.shield(future)
+
+    def estimate_wait(self, sort_key=None, estimated_tokens=0):
+        """Seconds until a request would be sent: the budget's next free slot plus the budget
+        every job queued ahead of it uses (the whole queue without a sort key)"""
+        ahead = [job for job in self._heap if sort_key is None or job.sort_key < sort_key]
+        wait = max(0.0, self.rate_limiter.available_in(ahead[0].estimated_tokens if ahead else estimated_tokens))
+        return wait + sum(self.rate_limiter.service_interval(job.estimated_tokens) for job in ahead)
+
+    def _reject(self, reason, retry_after):
+        self.rejected += 1
+        SCHEDULED.labels('rejected').inc()
+        raise RequestRejected(reason, retry_after)
+
+    def _admit(self, user_id, channel_id, sort_key, estimated_tokens, replacing=()):
+        """Raise RequestRejected unless the request fits the queue bounds and can be served in time"""
+        waiting = [job for job in self._heap if job not in replacing]
+        if sum(1 for job in waiting if job.user_id == user_id) >= self.max_per_user:
+            self._reject("Too many requests waiting for this user", self.estimate_wait())
+        if channel_id is not None and sum(1 for job in waiting if job.channel_id == channel_id) >= self.max_per_channel:
+            self._reject("Too many requests waiting in this channel", self.estimate_wait())
+        wait = self.estimate_wait(sort_key, estimated_tokens)
+        if wait > self.max_wait:
+            self._reject(f"Estimated wait {wait:.0f}s is over the {self.max_wait:.0f}s limit", wait)
+
+    def _stale(self, user_id, channel_id, conversation_key):
+        """The user's requests waiting in this channel and conversation (not ones shared with other waiters)"""
+        return [job for job in self._heap
+                if job.user_id == user_id and job.channel_id == channel_id
+                and job.conversation_key == conversation_key and job.waiters == 1]
+
+    def _supersede(self, stale):
+        """Drop replaced requests from the queue, failing them with RequestSuperseded"""
+        if not stale:
+            return
+        for job in stale:
+            self._heap.remove(job)
+            self._forget(job)
+            self.superseded += 1
+            SCHEDULED.labels('superseded').inc()
+            if not job.future.done():
+                job.future.set_exception(RequestSuperseded("Replaced by a newer request from the same user"))
+        heapq.heapify(self._heap)
+
+    def _forget(self, job):
+        """Stop sharing a job's result with new identical requests"""
+        if job.key is not None and self._inflight.get(job.key) is job:
+            del self._inflight[job.key]
+
+    def _pop_next(self):
+        """Pop the best job that is still worth sending, failing the ones past their deadline"""
+        now = time.time()
+        while self._heap:
+            job = heapq.heappop(self._heap)
+            if self._user_rounds.get(job.user_id) == job.sort_key[1]:
+                # That was the user's last queued job - forget them
+                del self._user_rounds[job.user_id]
+            if job.deadline >= now:
+                self._round = max(self._round, job.sort_key[1])
+                return job
+            self.expired += 1
+            SCHEDULED.labels('expired').inc()
+            self._forget(job)
+            if not job.future.done():
+                job.future.set_exception(RequestExpired(f"Request waited longer than {job.deadline - job.enqueued_at:.0f}s"))
+        return None
+
+    async def _dispatch_loop(self):
+        """Claim a rate-limit slot, then hand it to the best queued job"""
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            ticket = await self.rate_limiter.wait_if_needed(self._heap[0].estimated_tokens)
+            job = self._pop_next()
+            # Queue depth is this process's claim on the shared budget (sharded deployments)
+            self.rate_limiter.set_demand(len(self._heap))
+            QUEUE_DEPTH.set(len(self._heap))
+            if job is None:
+                # Everything expired while we waited - give the reserved tokens back
+                self.rate_limiter.record_usage(ticket, {'total_tokens': 0})
+                continue
+
+            self._wait_times.append(time.time() - job.enqueued_at)
+            QUEUE_WAIT.observe(self._wait_times[-1])
+            self.dispatched += 1
+            SCHEDULED.labels('dispatched').inc()
+            self._sending += 1
+            asyncio.get_running_loop().create_task(self._send(job, ticket))
+
+    async def _send(self, job, ticket):
+        """Make the upstream call and resolve every waiter"""
+        # A backend pool is both client and rate limiter: it sends on the backend the ticket reserved
+        route = {'ticket': ticket} if self.client is self.rate_limiter else {}
+        try:
+            if job.on_delta is not None:
+                result = await self.client.stream_complete(job.messages, on_delta=job.on_delta, **route)
+            else:
+                result = await self.client.complete(job.messages, **route)
+            self.rate_limiter.record_usage(ticket, result.usage)
+            if not job.future.done():
+                job.future.set_result(result)
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            self._sending -= 1
+            self._forget(job)
+
+    def stats(self):
+        """Queue depth and wait-time metrics"""
+        waits = sorted(self._wait_times)
+
+        def percentile(p):
+            if not waits:
+                return 0.0
+            return waits[min(len(waits) - 1, int(p * len(waits)))]
+
+        return {
+            'queue_depth': len(self._heap),
+            'in_flight': self._sending,
+            'dispatched': self.dispatched,
+            'coalesced': self.coalesced,
+            'expired': self.expired,
+            'rejected': self.rejected,
+            'superseded': self.superseded,
+            'estimated_wait': self.estimate_wait(),
+            'wait_p50': percentile(0.50),
+            'wait_p95': percentile(0.95),
+        }
@@ -0,0 +1,135 @@
+"""
+Response Cache
+Opt-in cache for repeated prompts ("hi", "what's up", the same FAQ) so they skip the
+API round trip and the rate budget entirely
+"""
+
+import sys
+sys.dont_write_bytecode = True
+
+import re
+import time
+import hashlib
+from collections import OrderedDict
+from metrics import counter
+
+# Defaults
+CACHE_MAX_ENTRIES = 1000
+CACHE_TTL = 10 * 60  # seconds
+# Only short prompts are worth caching - long ones are practically never repeated
+CACHE_MAX_PROMPT_CHARS = 200
+
+CACHE_LOOKUPS = counter('chatbot_response_cache_lookups_total', 'Response cache lookups by result', ('result',))
+
+# Hit policies
+# exact   - same prompt, same system prompt and the same recent context
+# prompt  - same prompt and system prompt, regardless of context (for greetings / FAQs)
+POLICY_EXACT = 'exact'
+POLICY_PROMPT = 'prompt'
+CACHE_POLICIES = (POLICY_EXACT, POLICY_PROMPT)
+
+# Recent turns (before the prompt) that are part of the key under the exact policy
+CONTEXT_TURNS = 2
+
+# Common spellings that mean the same thing
+_REPLACEMENTS = {
+    'whats': "what is", "what's": 'what is', 'wats': 'what is', 'sup': 'what is up',
+    'wassup': 'what is up', 'hows': 'how is', "how's": 'how is', 'u': 'you', 'ur': 'your',
+    'r': 'are', 'hey': 'hi', 'hello': 'hi', 'hiya': 'hi', 'yo': 'hi', 'thx': 'thanks',
+    'ty': 'thanks', 'pls': 'please', 'plz': 'please',
+}
+_WORD_PATTERN = re.compile(r"[a-z0-9']+")
+# "hiii" -> "hii", "sooooo" -> "soo"
+_REPEATS_PATTERN = re.compile(r'(.)\1{2,}')
+
+def normalize_prompt(text):
+    """Canonical form of a prompt: lowercase words, no punctuation, common variants folded"""
+    text = _REPEATS_PATTERN.sub(r'\1\1', text.lower())
+    words = []
+    for word in _WORD_PATTERN.findall(text):
+        word = word.strip("'")
+        if word:
+            words.append(_REPLACEMENTS.get(word, word))
+    return ' '.join(words)
+
+def _digest(*parts):
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        h.update(part.encode())
+        h.update(b'\x00')
+    return h.hexdigest()
+
+class ResponseCache:
+    """LRU + TTL cache of responses keyed by normalized prompt, system prompt and context"""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL, policy=POLICY_EXACT,
+                 max_prompt_chars=CACHE_MAX_PROMPT_CHARS):
+        if policy not in CACHE_POLICIES:
+            raise ValueError(f"Unknown cache policy {policy!r} (expected one of {', '.join(CACHE_POLICIES)})")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.policy = policy
+        self.max_prompt_chars = max_prompt_chars
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expires_at, response text), least recently used first
+        self._system_digests = {}      # system prompt -> digest (personalities are long, hash once)
+
+    def key(self, messages):
+        """Cache key for a request, or None if it should not be cached"""
+        if not messages or messages[-1]['role'] != 'user':
+            return None
+        prompt = messages[-1]['content']
+        if len(prompt) > self.max_prompt_chars:
+            return None
+        normalized = normalize_prompt(prompt)
+        if not normalized:
+            return None
+
+        system_prompt = messages[0]['content'] if messages[0]['role'] == 'system' else ''
+        system_digest = self._system_digests.get(system_prompt)
+        if system_digest is None:
+            system_digest = self._system_digests[system_prompt] = _digest(system_prompt)
+
+        if self.policy == POLICY_PROMPT:
+            return _digest(system_digest, normalized)
+        context = [f"{m['role']}:{normalize_prompt(m['content'])}"
+                   for m in messages[1:-1] if m['role'] != 'system'][-CONTEXT_TURNS:]
+        return _digest(system_digest, normalized, *context)
+
+    def get(self, key):
+        """Cached response text for a key, or None (counts as a hit or miss)"""
+        if key is None:
+            return None
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.time():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            CACHE_LOOKUPS.labels('miss').inc()
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        CACHE_LOOKUPS.labels('hit').inc()
+        return entry[1]
+
+    def put(self, key, response):
+        """Store a response (least recently used entries are evicted past max_entries)"""
+        if key is None or not response:
+            return
+        self._entries[key] = (time.time() + self.ttl, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def __len__(self):
+        return len(self._entries)
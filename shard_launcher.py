@@ -0,0 +1,122 @@
+"""
+Shard Launcher
+Runs the Discord bot as several worker processes, each connected to its own group of shards
+Workers share the Groq budget through shared_rate_limiter (split by each worker's queue depth)
+Run: python shard_launcher.py (SHARD_COUNT and SHARD_PROCESSES from .env)
+"""
+
+import sys
+sys.dont_write_bytecode = True
+
+import os
+import json
+import time
+import signal
+import subprocess
+import urllib.request
+from pathlib import Path
+from dotenv import load_dotenv
+
+BOT_SCRIPT = Path(__file__).parent / 'discord_bot.py'
+DISCORD_GATEWAY_URL = 'https://discord.com/api/v10/gateway/bot'
+
+# Seconds before a worker that exited is started again
+RESTART_DELAY = 5
+# Seconds workers get to shut down cleanly before they are killed
+STOP_TIMEOUT = 10
+
+def recommended_shard_count(token):
+    """Shard count Discord recommends for this bot (about one per 1000 guilds)"""
+    request = urllib.request.Request(DISCORD_GATEWAY_URL, headers={
+        'Authorization': f'Bot {token}',
+        'User-Agent': 'DiscordBot (free-chatbot-api, 1.0)',
+    })
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.load(response)['shards']
+
+def shard_groups(shard_count, processes):
+    """Split shard ids 0..shard_count-1 into contiguous groups, one per worker process"""
+    processes = max(1, min(processes, shard_count))
+    size, extra = divmod(shard_count, processes)
+    groups = []
+    start = 0
+    for worker in range(processes):
+        end = start + size + (1 if worker < extra else 0)
+        groups.append(list(range(start, end)))
+        start = end
+    return groups
+
+class ShardLauncher:
+    """Starts one discord_bot.py process per shard group and restarts any that exit"""
+
+    def __init__(self, shard_count, processes):
+        self.shard_count = shard_count
+        self.groups = shard_groups(shard_count, processes)
+        self.workers = {}     # worker index -> Popen
+        self.restart_at = {}  # worker index -> time to restart an exited worker
+        self.stopping = False
+
+    def start_worker(self, worker):
+        env = os.environ.copy()
+        env['SHARD_COUNT'] = str(self.shard_count)
+        env['SHARD_IDS'] = ','.join(str(shard) for shard in self.groups[worker])
+        env['SHARD_WORKER'] = str(worker)
+        if env.get('CONVERSATION_DB'):
+            # Each worker holds the histories of its own users, so it gets its own database file
+            # (shard groups are fixed for a given SHARD_COUNT, so a worker finds its file again)
+            path = Path(env['CONVERSATION_DB'])
+            env['CONVERSATION_DB'] = str(path.with_name(f"{path.stem}.worker{worker}{path.suffix}"))
+        self.workers[worker] = subprocess.Popen([sys.executable, str(BOT_SCRIPT)], env=env)
+        print(f"🚀 Worker {worker} started (pid {self.workers[worker].pid}, shards {env['SHARD_IDS']})", flush=True)
+
+    def stop(self, *_):
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        print(f"Launching {self.shard_count} shards in {len(self.groups)} worker processes...", flush=True)
+        for worker in range(len(self.groups)):
+            self.start_worker(worker)
+
+        while not self.stopping:
+            now = time.time()
+            for worker, process in self.workers.items():
+                if process.poll() is not None and worker not in self.restart_at:
+                    print(f"⚠️ Worker {worker} exited with code {process.returncode}, "
+                          f"restarting in {RESTART_DELAY}s", flush=True)
+                    self.restart_at[worker] = now + RESTART_DELAY
+            for worker, restart_at in list(self.restart_at.items()):
+                if restart_at <= now:
+                    del self.restart_at[worker]
+                    self.start_worker(worker)
+            time.sleep(0.5)
+
+        print("Stopping workers...", flush=True)
+        for process in self.workers.values():
+            if process.poll() is None:
+                process.terminate()
+        deadline = time.time() + STOP_TIMEOUT
+        for process in self.workers.values():
+            try:
+                process.wait(timeout=max(0, deadline - time.time()))
+            except subprocess.TimeoutExpired:
+                process.kill()
+        print("👋 All workers stopped", flush=True)
+
+def main():
+    load_dotenv()
+    token = os.getenv('DISCORD_BOT_TOKEN')
+    if not token:
+        print("ERROR: DISCORD_BOT_TOKEN not found in .env file!")
+        sys.exit(1)
+
+    processes = int(os.getenv('SHARD_PROCESSES', '2'))
+    shard_count = os.getenv('SHARD_COUNT', 'auto')
+    if shard_count == 'auto':
+        shard_count = recommended_shard_count(token)
+        print(f"Discord recommends {shard_count} shard(s)", flush=True)
+    ShardLauncher(int(shard_count), processes).run()
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
 """
 Shared Rate Limiter for Multiple Discord Bots
-Coordinates API requests across multiple bot processes using file-based locking
+Coordinates API requests across multiple bot processes: a GCRA bucket for requests/min and
+a sliding 60s window of actual token usage, both kept in a memory-mapped state region
 """
 
 import sys
@@ -8,168 +9,315 @@ sys.dont_write_bytecode = True
 
 import os
 import time
-import fcntl
+import mmap
+import struct
 import asyncio
 from pathlib import Path
+from shared_state import SharedState, LocalState, PAYLOAD_OFFSET
+from metrics import histogram
 
-# Shared state file location
-RATE_LIMIT_FILE = Path(__file__).parent / '.rate_limit_state'
-LOCK_FILE = Path(__file__).parent / '.rate_limit.lock'
+# Shared state file location (memory-mapped by every bot process; RATE_LIMIT_STATE_FILE moves it)
+RATE_LIMIT_FILE = Path(os.getenv('RATE_LIMIT_STATE_FILE') or Path(__file__).parent / '.rate_limit_state')
 
 # Groq API rate limits: 30 requests/minute, ~6000 tokens/minute
-# When 2 bots run together, we need to share this limit more conservatively
-MIN_REQUEST_INTERVAL = 6.0  # Increased to 6 seconds to be safe (30 req/min / 2 = 15 req/min per bot = 4 sec/req, but use 6 for safety)
 MAX_TOKENS_PER_MINUTE = 6000
 MAX_REQUESTS_PER_MINUTE = 30
+RATE_LIMIT_PERIOD = 60.0  # seconds
+# How long to hold off after a 429 that carries no Retry-After or reset header
+DEFAULT_RETRY_AFTER = 10.0  # seconds
+
+# Sustained rate + burst are chosen so that no 60s window can ever exceed the API limit:
+# 25 req/min sustained + 5 request burst <= 30 requests in any minute
+SAFE_REQUESTS_PER_MINUTE = MAX_REQUESTS_PER_MINUTE - 5
+REQUEST_BURST = 5
+# Tokens are accounted from real API usage, so only a small margin is kept for estimate error
+SAFE_TOKENS_PER_MINUTE = MAX_TOKENS_PER_MINUTE - 300
+
+# Usage ring buffer: one slot per request, must hold more requests than fit in one window
+USAGE_SLOTS = 128
+
+# State layout (after the shared state header): limiter header (request TAT, blocked-until,
+# next ticket) + usage ring buffer. Each ring slot is (send time, ticket, tokens) - tokens
+# start as the estimate and are replaced by the real usage once the response arrives
+STATE_MAGIC = b'RLv4'
+HEADER_STRUCT = struct.Struct('<ddQ')
+HEADER_OFFSET = PAYLOAD_OFFSET
+# Server view of the token budget from the last response's headers: (tokens remaining, when
+# the server's window resets), minus what was reserved since. Zeroed = nothing observed yet
+SERVER_STRUCT = struct.Struct('<dd')
+SERVER_OFFSET = HEADER_OFFSET + HEADER_STRUCT.size
+SLOT_STRUCT = struct.Struct('<dQI4x')
+RING_OFFSET = PAYLOAD_OFFSET + 64
+RING_SIZE = USAGE_SLOTS * SLOT_STRUCT.size
+# Worker demand slots (sharded deployments): (updated at, queued requests, worker TAT).
+# Each worker's share of the request budget follows its share of the queued requests
+WORKER_SLOTS = 32
+DEMAND_STRUCT = struct.Struct('<dI4xd')
+DEMAND_OFFSET = RING_OFFSET + RING_SIZE
+STATE_SIZE = mmap.PAGESIZE
+
+THROTTLE_WAIT = histogram('chatbot_throttle_wait_seconds',
+                          'Time a request waited for room in the shared rate budget', ('limiter',))
+
+def _initialize(state):
+    """Empty request bucket and usage ring"""
+    HEADER_STRUCT.pack_into(state, HEADER_OFFSET, 0.0, 0.0, 1)
 
 class SharedRateLimiter:
-    """Rate limiter that coordinates across multiple processes using file locking"""
-    
-    def __init__(self, bot_name="unknown"):
+    """Rate limiter shared across processes through a memory-mapped state region
+
+    Every request does a single atomic reserve under one short flock: the earliest start
+    time that keeps the request bucket conforming and the last 60s of token usage within
+    budget is computed and recorded, then the caller sleeps (asynchronously) until then.
+    Token usage is charged from the estimate at reserve time and corrected with the real
+    usage reported by the API, so the limiter never waits longer than the budget requires.
+    Status reads take no lock at all (see shared_state).
+
+    With a `worker` index (one per shard worker process), each worker also publishes its
+    queue depth, and gets a share of the request rate proportional to its share of the
+    queued requests - an idle worker's share flows to the busy ones within one update.
+    """
+
+    def __init__(self, bot_name="unknown", state_file=RATE_LIMIT_FILE,
+                 requests_per_minute=SAFE_REQUESTS_PER_MINUTE, request_burst=REQUEST_BURST,
+                 tokens_per_minute=SAFE_TOKENS_PER_MINUTE, period=RATE_LIMIT_PERIOD, worker=None):
         self.bot_name = bot_name
+        self.worker = worker
+        self.state_file = Path(state_file)
+        self.period = period
+        # Emission interval (seconds per request) and burst tolerance for the request bucket
+        self.request_interval = period / requests_per_minute
+        self.request_tolerance = request_burst * self.request_interval
+        self.tokens_per_minute = tokens_per_minute
+        self._state = None
         self.ensure_state_file()
-    
+
     def ensure_state_file(self):
-        """Ensure the state file exists"""
-        if not RATE_LIMIT_FILE.exists():
-            with open(RATE_LIMIT_FILE, 'w') as f:
-                f.write(f"{time.time()}\n0\n")  # last_request_time, request_count
-    
+        """Open and map the state file, initializing it if it is new or in an old format"""
+        self._state = SharedState(self.state_file, STATE_SIZE, STATE_MAGIC, _initialize)
+
+    def _window(self, state, since):
+        """Ring slots sent after `since`, oldest first, as (send_time, ticket, tokens)"""
+        next_ticket = HEADER_STRUCT.unpack_from(state, HEADER_OFFSET)[2]
+        slots = list(SLOT_STRUCT.iter_unpack(state[RING_OFFSET:RING_OFFSET + RING_SIZE]))
+        # Rotate so the ring reads oldest -> newest (tickets are handed out in send-time order)
+        head = next_ticket % USAGE_SLOTS
+        slots = slots[head:] + slots[:head]
+        oldest_ticket = next_ticket - USAGE_SLOTS
+        return [entry for i, entry in enumerate(slots)
+                if entry[1] == oldest_ticket + i and entry[0] > since]
+
     def read_state(self):
-        """Read current state from file (with lock)"""
-        max_retries = 5
-        for attempt in range(max_retries):
-            try:
-                # Create lock file if it doesn't exist
-                LOCK_FILE.parent.mkdir(parents=True, exist_ok=True)
-                RATE_LIMIT_FILE.parent.mkdir(parents=True, exist_ok=True)
-                
-                with open(LOCK_FILE, 'a+') as lock_f:
-                    try:
-                        fcntl.flock(lock_f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
-                    except (IOError, OSError):
-                        # Lock is held, wait a bit and retry
-                        if attempt < max_retries - 1:
-                            time.sleep(0.1)
-                            continue
-                        else:
-                            # Last attempt, wait for lock
-                            fcntl.flock(lock_f.fileno(), fcntl.LOCK_EX)
-                    
-                    try:
-                        if RATE_LIMIT_FILE.exists():
-                            with open(RATE_LIMIT_FILE, 'r') as f:
-                                lines = f.read().strip().split('\n')
-                                if len(lines) >= 2:
-                                    last_time = float(lines[0])
-                                    request_count = int(lines[1])
-                                    return last_time, request_count
-                        return 0.0, 0
-                    finally:
-                        fcntl.flock(lock_f.fileno(), fcntl.LOCK_UN)
-            except Exception as e:
-                if attempt < max_retries - 1:
-                    time.sleep(0.1)
-                    continue
-                else:
-                    print(f"[{self.bot_name}] Error reading state: {e}", flush=True)
-                    return 0.0, 0
-        return 0.0, 0
-    
-    def write_state(self, last_time, request_count):
-        """Write state to file (with lock)"""
-        max_retries = 5
-        for attempt in range(max_retries):
-            try:
-                # Create directories if needed
-                LOCK_FILE.parent.mkdir(parents=True, exist_ok=True)
-                RATE_LIMIT_FILE.parent.mkdir(parents=True, exist_ok=True)
-                
-                with open(LOCK_FILE, 'a+') as lock_f:
-                    try:
-                        fcntl.flock(lock_f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
-                    except (IOError, OSError):
-                        # Lock is held, wait a bit and retry
-                        if attempt < max_retries - 1:
-                            time.sleep(0.1)
-                            continue
-                        else:
-                            # Last attempt, wait for lock
-                            fcntl.flock(lock_f.fileno(), fcntl.LOCK_EX)
-                    
-                    try:
-                        with open(RATE_LIMIT_FILE, 'w') as f:
-                            f.write(f"{last_time}\n{request_count}\n")
-                        return  # Success
-                    finally:
-                        fcntl.flock(lock_f.fileno(), fcntl.LOCK_UN)
-            except Exception as e:
-                if attempt < max_retries - 1:
-                    time.sleep(0.1)
-                    continue
-                else:
-                    print(f"[{self.bot_name}] Error writing state: {e}", flush=True)
-    
+        """Return (request_tat, blocked_until, tokens in the last minute) - lock-free consistent snapshot"""
+        def read(state):
+            request_tat, blocked_until, _ = HEADER_STRUCT.unpack_from(state, HEADER_OFFSET)
+            tokens = sum(entry[2] for entry in self._window(state, time.time() - self.period))
+            return request_tat, blocked_until, tokens
+        return self._state.read(read)
+
+    def _demand_offset(self):
+        return DEMAND_OFFSET + (self.worker % WORKER_SLOTS) * DEMAND_STRUCT.size
+
+    def _worker_interval(self, state, now):
+        """Request interval for this worker at its current share of the queued demand"""
+        own = others = 0
+        for i, (updated_at, queued, _) in enumerate(DEMAND_STRUCT.iter_unpack(
+                state[DEMAND_OFFSET:DEMAND_OFFSET + WORKER_SLOTS * DEMAND_STRUCT.size])):
+            if i == self.worker % WORKER_SLOTS:
+                own = queued
+            elif updated_at > now - self.period:
+                others += queued
+        # A worker that is asking always counts as at least one queued request
+        ours = max(own, 1)
+        return self.request_interval * (ours + others) / ours
+
+    def set_demand(self, queued):
+        """Publish how many requests this worker has queued (no-op without a worker index)"""
+        if self.worker is None:
+            return
+        offset = self._demand_offset()
+        with self._state.locked() as state:
+            _, _, worker_tat = DEMAND_STRUCT.unpack_from(state, offset)
+            DEMAND_STRUCT.pack_into(state, offset, time.time(), queued, worker_tat)
+
+    def _token_cost(self, estimated_tokens):
+        # A request bigger than the whole budget can never fit, so charge it the full budget
+        return min(max(int(estimated_tokens), 0), self.tokens_per_minute)
+
+    def _earliest_start(self, state, now, token_cost):
+        """Earliest send time that keeps the request bucket and the token window within budget"""
+        request_tat, blocked_until, _ = HEADER_STRUCT.unpack_from(state, HEADER_OFFSET)
+        server_tokens, server_reset_at = SERVER_STRUCT.unpack_from(state, SERVER_OFFSET)
+        window = self._window(state, now - self.period)
+
+        # Earliest time the request bucket lets this request through; requests are
+        # sent in ticket order so the token window only ever has to look backwards
+        request_ready = max(request_tat, now) + self.request_interval - self.request_tolerance
+        last_send = window[-1][0] if window else 0.0
+        start = max(now, request_ready, blocked_until, last_send)
+
+        # Wait only until enough of the token window has expired to fit this request
+        used = sum(entry[2] for entry in window if entry[0] > start - self.period)
+        for send_time, _, tokens in window:
+            if used + token_cost <= self.tokens_per_minute:
+                break
+            if send_time > start - self.period:
+                used -= tokens
+                start = send_time + self.period
+
+        # The server may count differently (or other clients share the key) - if it says the
+        # request does not fit in what it has left, wait for its window to reset
+        if start < server_reset_at and token_cost > server_tokens:
+            start = server_reset_at
+        return start
+
+    def available_in(self, estimated_tokens=0, now=None):
+        """Seconds until a request of this size could be sent (lock-free peek, reserves nothing)"""
+        if now is None:
+            now = time.time()
+        token_cost = self._token_cost(estimated_tokens)
+
+        def read(state):
+            start = self._earliest_start(state, now, token_cost)
+            if self.worker is not None:
+                worker_tat = DEMAND_STRUCT.unpack_from(state, self._demand_offset())[2]
+                start = max(start, worker_tat - self.request_tolerance)
+            return start
+        return self._state.read(read) - now
+
+    def service_interval(self, estimated_tokens=0):
+        """Seconds of budget one request of this size uses at the sustained rate (for queue wait estimates)"""
+        return max(self.request_interval, self.period * self._token_cost(estimated_tokens) / self.tokens_per_minute)
+
+    def reserve(self, estimated_tokens=0, now=None):
+        """Atomically reserve a slot for one request
+
+        Returns (wait_time, ticket): how long to wait before sending, and the ticket to pass
+        to record_usage() once the response (and its real token usage) is known. A worker
+        that is over its share gets (wait_time, None) instead: nothing was reserved, ask
+        again after wait_time (so other workers' slots are never pushed back).
+        """
+        if now is None:
+            now = time.time()
+        token_cost = self._token_cost(estimated_tokens)
+
+        with self._state.locked() as state:
+            request_tat, blocked_until, ticket = HEADER_STRUCT.unpack_from(state, HEADER_OFFSET)
+            if self.worker is not None:
+                worker_interval = self._worker_interval(state, now)
+                updated_at, queued, worker_tat = DEMAND_STRUCT.unpack_from(state, self._demand_offset())
+                # Per-worker GCRA: worker_tat is the theoretical arrival time of its next request
+                worker_ready = worker_tat - self.request_tolerance
+                if worker_ready > now:
+                    return worker_ready - now, None
+            start = self._earliest_start(state, now, token_cost)
+            request_tat = max(request_tat, start) + self.request_interval
+            server_tokens, server_reset_at = SERVER_STRUCT.unpack_from(state, SERVER_OFFSET)
+            if start < server_reset_at:
+                SERVER_STRUCT.pack_into(state, SERVER_OFFSET, max(0.0, server_tokens - token_cost), server_reset_at)
+            SLOT_STRUCT.pack_into(state, RING_OFFSET + (ticket % USAGE_SLOTS) * SLOT_STRUCT.size,
+                                  start, ticket, token_cost)
+            HEADER_STRUCT.pack_into(state, HEADER_OFFSET, request_tat, blocked_until, ticket + 1)
+            if self.worker is not None:
+                DEMAND_STRUCT.pack_into(state, self._demand_offset(), updated_at, queued,
+                                        max(worker_tat, start) + worker_interval)
+
+        return start - now, ticket
+
+    def record_usage(self, ticket, usage):
+        """Replace a reservation's estimated tokens with the real usage from the API response"""
+        if not ticket or not usage:
+            return
+        tokens = usage.get('total_tokens') or (usage.get('prompt_tokens', 0) + usage.get('completion_tokens', 0))
+        offset = RING_OFFSET + (ticket % USAGE_SLOTS) * SLOT_STRUCT.size
+        with self._state.locked() as state:
+            send_time, slot_ticket, _ = SLOT_STRUCT.unpack_from(state, offset)
+            # The slot may have been reused by a much newer request - then it is out of the window anyway
+            if slot_ticket == ticket:
+                SLOT_STRUCT.pack_into(state, offset, send_time, ticket, int(tokens))
+
     async def wait_if_needed(self, estimated_tokens=0):
-        """Wait if needed to respect rate limits"""
-        current_time = time.time()
-        
-        # Read current state
-        last_request_time, request_count = self.read_state()
-        
-        # Calculate time since last request
-        time_since_last = current_time - last_request_time
-        
-        # Check if we need to wait
-        min_interval = MIN_REQUEST_INTERVAL
-        
-        # If request is large, increase interval
-        if estimated_tokens > 4000:
-            min_interval = max(MIN_REQUEST_INTERVAL, estimated_tokens / 100)
-        
-        # Check per-minute limits - be more conservative (only allow 25 requests per minute to leave buffer)
-        safe_max_requests = MAX_REQUESTS_PER_MINUTE - 5  # Leave 5 request buffer
-        if request_count >= safe_max_requests:
-            # Reset if a minute has passed
-            if time_since_last >= 60:
-                request_count = 0
-            else:
-                # Wait until minute resets
-                wait_time = 60 - time_since_last
-                if wait_time > 0.1:
-                    print(f"[{self.bot_name}] ⏳ Rate limit: {request_count}/{safe_max_requests} requests this minute. Waiting {wait_time:.1f}s...", flush=True)
-                    await asyncio.sleep(wait_time)
-                    current_time = time.time()
-                    time_since_last = current_time - last_request_time
-                    request_count = 0
-        
-        # Wait for minimum interval
-        if time_since_last < min_interval:
-            wait_time = min_interval - time_since_last
+        """Wait if needed to respect rate limits (never blocks the event loop); returns the ticket"""
+        waited = 0.0
+        wait_time, ticket = self.reserve(estimated_tokens)
+        while ticket is None:
+            # Over this worker's share of the budget - let the other workers go first
+            await asyncio.sleep(wait_time)
+            waited += wait_time
+            wait_time, ticket = self.reserve(estimated_tokens)
+        THROTTLE_WAIT.labels(self.bot_name).observe(waited + max(0.0, wait_time))
+        if wait_time > 0:
             if wait_time > 0.1:
-                print(f"[{self.bot_name}] ⏳ Throttling: waiting {wait_time:.1f}s (minimum {MIN_REQUEST_INTERVAL}s between requests)...", flush=True)
+                print(f"[{self.bot_name}] ⏳ Throttling: waiting {wait_time:.1f}s to respect shared rate limits...", flush=True)
             await asyncio.sleep(wait_time)
-            current_time = time.time()
-        
-        # Update state BEFORE making request
-        new_request_count = request_count + 1 if time_since_last < 60 else 1
-        self.write_state(current_time, new_request_count)
-        
-        return current_time
-    
-    def mark_rate_limited(self, wait_seconds=60):
-        """Mark that we hit a rate limit and need to wait"""
-        current_time = time.time()
-        # Set last request time to current + wait, so next request waits
-        self.write_state(current_time + wait_seconds, MAX_REQUESTS_PER_MINUTE)
+        return ticket
+
+    def apply_server_limits(self, limits, rate_limited=False):
+        """Feed the rate-limit state from an API response into the shared state
+
+        `limits` is CompletionResult.rate_limit. After a 429 every process holds off for the
+        server's Retry-After (or the reset time of whichever budget ran out); otherwise the
+        server's remaining tokens cap what is reserved until its window resets, and an
+        exhausted request budget (Groq: requests per day) blocks until it resets.
+        Returns how long requests are now blocked for (None if not blocked).
+        """
+        now = time.time()
+        wait = None
+        if rate_limited:
+            wait = limits.get('retry_after')
+            if wait is None:
+                exhausted = [limits[f'reset_{kind}'] for kind in ('requests', 'tokens')
+                             if limits.get(f'remaining_{kind}') == 0 and f'reset_{kind}' in limits]
+                wait = max(exhausted) if exhausted else DEFAULT_RETRY_AFTER
+        elif limits.get('remaining_requests') == 0 and 'reset_requests' in limits:
+            wait = limits['reset_requests']
+        server = None
+        if 'remaining_tokens' in limits and 'reset_tokens' in limits:
+            server = (float(limits['remaining_tokens']), now + limits['reset_tokens'])
+        if wait is None and server is None:
+            return None
+
+        with self._state.locked() as state:
+            if wait is not None:
+                request_tat, blocked_until, next_ticket = HEADER_STRUCT.unpack_from(state, HEADER_OFFSET)
+                HEADER_STRUCT.pack_into(state, HEADER_OFFSET, request_tat, max(blocked_until, now + wait), next_ticket)
+            if server is not None:
+                SERVER_STRUCT.pack_into(state, SERVER_OFFSET, *server)
+        if wait is not None:
+            print(f"[{self.bot_name}] ⚠️ Rate limit hit! Server asks to wait {wait:.1f}s...", flush=True)
+        return wait
+
+    def mark_rate_limited(self, wait_seconds=DEFAULT_RETRY_AFTER):
+        """Mark that we hit a rate limit so every process holds off for wait_seconds"""
+        with self._state.locked() as state:
+            request_tat, blocked_until, next_ticket = HEADER_STRUCT.unpack_from(state, HEADER_OFFSET)
+            blocked_until = max(blocked_until, time.time() + wait_seconds)
+            HEADER_STRUCT.pack_into(state, HEADER_OFFSET, request_tat, blocked_until, next_ticket)
         print(f"[{self.bot_name}] ⚠️ Rate limit hit! Marking state to wait {wait_seconds}s...", flush=True)
 
+    def close(self):
+        """Unmap and close the state file"""
+        if self._state is not None:
+            self._state.close()
+            self._state = None
+
+class InMemoryRateLimiter(SharedRateLimiter):
+    """The same limiter with its state in process memory instead of a mapped file
+
+    For several bots hosted on one event loop (bot_host.py): reserving a slot is a plain
+    function call instead of a flock. The budget is not shared with other processes, so
+    nothing else may use the same API key. `state_file` is accepted and ignored.
+    """
+
+    def ensure_state_file(self):
+        self._state = LocalState(STATE_SIZE, STATE_MAGIC, _initialize)
+
 # Global instance (will be created per bot)
 _rate_limiter = None
 
-def get_rate_limiter(bot_name="unknown"):
+def get_rate_limiter(bot_name="unknown", worker=None):
     """Get or create the shared rate limiter instance"""
     global _rate_limiter
     if _rate_limiter is None:
-        _rate_limiter = SharedRateLimiter(bot_name)
+        _rate_limiter = SharedRateLimiter(bot_name, worker=worker)
     return _rate_limiter
@@ -0,0 +1,161 @@
+"""
+Shared State
+Fixed-layout binary state in a memory-mapped file, shared by every bot process
+Writers take a short flock; readers never lock or touch the filesystem - a sequence
+counter (seqlock) tells them when to retry a read that overlapped an update
+LocalState offers the same interface over process memory, for bots hosted in one process
+"""
+
+import sys
+sys.dont_write_bytecode = True
+
+import os
+import mmap
+import time
+import fcntl
+import struct
+from contextlib import contextmanager
+from pathlib import Path
+from metrics import histogram
+
+# Region header: magic (identifies the layout) + sequence counter (odd while an update is in progress)
+HEADER_STRUCT = struct.Struct('<4s4xQ')
+SEQUENCE_STRUCT = struct.Struct('<Q')
+SEQUENCE_OFFSET = 8
+# Callers lay out their own structs from here (one cache line after the header)
+PAYLOAD_OFFSET = 64
+
+# Lock-free reads that overlap an update are retried this many times before taking the lock
+READ_RETRIES = 100
+
+LOCK_WAIT = histogram('chatbot_lock_wait_seconds', 'Time spent waiting for a shared state flock', ('state',))
+
+class SharedState:
+    """A memory-mapped state region with a seqlock
+
+    `initialize(buffer)` writes the initial payload when the file is new, holds a different
+    layout (magic mismatch), fails `validate(buffer)`, or was left half-written by a process
+    that died mid-update - so a torn file is reset instead of being parsed.
+    """
+
+    def __init__(self, path, size, magic, initialize=None, validate=None):
+        self.path = Path(path)
+        self.size = max(size, PAYLOAD_OFFSET)
+        self.magic = magic
+        self._initialize = initialize
+        self._validate = validate
+        self._fd = None
+        self._pid = None
+        self._lock_wait = LOCK_WAIT.labels(self.path.name)
+        self.map = None
+        self.open()
+
+    def open(self):
+        """Open and map the file, resetting it if it does not hold a valid region of this layout"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._open_fd()
+        with self._flock():
+            if os.fstat(self._fd).st_size != self.size:
+                os.ftruncate(self._fd, self.size)
+            self.map = mmap.mmap(self._fd, self.size)
+            magic, sequence = HEADER_STRUCT.unpack_from(self.map)
+            if magic != self.magic or sequence & 1 or (self._validate and not self._validate(self.map)):
+                self._reset()
+
+    def _open_fd(self):
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._pid = os.getpid()
+
+    def _reset(self):
+        self.map[:self.size] = bytes(self.size)
+        if self._initialize is not None:
+            self._initialize(self.map)
+        HEADER_STRUCT.pack_into(self.map, 0, self.magic, 0)
+
+    @contextmanager
+    def _flock(self):
+        if self._pid != os.getpid():
+            # flock is per open file description - a forked child needs its own
+            # (the shared mapping itself stays valid across fork)
+            os.close(self._fd)
+            self._open_fd()
+        started = time.perf_counter()
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        self._lock_wait.observe(time.perf_counter() - started)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @property
+    def sequence(self):
+        return SEQUENCE_STRUCT.unpack_from(self.map, SEQUENCE_OFFSET)[0]
+
+    @contextmanager
+    def locked(self):
+        """Exclusive update: holds the flock and keeps the sequence counter odd while writing"""
+        with self._flock():
+            sequence = self.sequence
+            if sequence & 1:
+                # A writer died mid-update - never trust a half-written region
+                print(f"⚠️ {self.path.name} was left mid-update by a crashed process, resetting it", flush=True)
+                self._reset()
+                sequence = 0
+            SEQUENCE_STRUCT.pack_into(self.map, SEQUENCE_OFFSET, sequence + 1)
+            try:
+                yield self.map
+            finally:
+                SEQUENCE_STRUCT.pack_into(self.map, SEQUENCE_OFFSET, sequence + 2)
+
+    def read(self, reader):
+        """Run reader(buffer) against a consistent view without locking; returns its result"""
+        for _ in range(READ_RETRIES):
+            before = self.sequence
+            if before & 1:
+                # An update is in progress - let the writer finish
+                time.sleep(0)
+                continue
+            try:
+                result = reader(self.map)
+            except Exception:
+                if self.sequence == before:
+                    raise
+                continue
+            if self.sequence == before:
+                return result
+        # Updates kept overlapping the read (or a writer died) - read under the lock
+        with self.locked() as state:
+            return reader(state)
+
+    def close(self):
+        """Unmap and close the file (callers must drop any memoryviews into the map first)"""
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+class LocalState:
+    """The SharedState interface over a bytearray, for state used by one process only
+
+    Bots hosted together on one event loop (bot_host.py) update it from a single thread,
+    so locked() and read() are plain function calls - no file, flock, syscall or retry.
+    """
+
+    def __init__(self, size, magic=None, initialize=None):
+        self.size = max(size, PAYLOAD_OFFSET)
+        self.magic = magic
+        self.map = bytearray(self.size)
+        if initialize is not None:
+            initialize(self.map)
+
+    @contextmanager
+    def locked(self):
+        yield self.map
+
+    def read(self, reader):
+        return reader(self.map)
+
+    def close(self):
+        self.map = None
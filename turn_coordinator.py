@@ -0,0 +1,206 @@
+"""
+Turn Coordinator
+Small local service that holds turn state in memory and answers "who responds to message X"
+once per message id, so bot processes no longer serialize on the .turn_state file
+Run: python turn_coordinator.py (bots connect with TurnCoordinatorClient)
+"""
+
+import sys
+sys.dont_write_bytecode = True
+
+import os
+import asyncio
+from collections import OrderedDict
+from pathlib import Path
+from turn_manager import TurnWeights, TurnManager, block_size, load_bot_names
+
+# Unix domain socket the coordinator listens on
+COORDINATOR_SOCKET = Path(__file__).parent / '.turn_coordinator.sock'
+
+# Decisions remembered per message id (every bot asks about the same message within seconds)
+MAX_CACHED_DECISIONS = 10000
+
+# How long a bot waits for the coordinator before falling back to the file-based TurnManager
+CLIENT_TIMEOUT = 2.0  # seconds
+
+class TurnCoordinator:
+    """In-memory turn state served over a Unix socket
+
+    Line protocol: "SELECT <message id>" -> "<bot name>", "RESET" -> "OK". The first request
+    for a message id runs the selection and updates the probabilities; every later request
+    for the same id gets the cached answer, so the decay is applied once per message.
+    """
+
+    def __init__(self, socket_path=COORDINATOR_SOCKET, bots=None, max_decisions=MAX_CACHED_DECISIONS):
+        self.socket_path = str(socket_path)
+        self.bots = tuple(bots or load_bot_names())
+        self.max_decisions = max_decisions
+        # Same state as the turn state file, just in process memory
+        self.weights = TurnWeights(bytearray(block_size(len(self.bots))), len(self.bots))
+        self.weights.reset()
+        self.selections = 0
+        self.cache_hits = 0
+        self._decisions = OrderedDict()  # message id -> selected bot, oldest first
+        self._server = None
+
+    def select(self, message_id=None):
+        """Responder for a message (computed once per message id, then cached)"""
+        message_id = str(message_id) if message_id else None
+        if message_id:
+            selected = self._decisions.get(message_id)
+            if selected is not None:
+                self.cache_hits += 1
+                return selected
+        selected = self.bots[self.weights.select(message_id)]
+        self.selections += 1
+        if message_id:
+            self._decisions[message_id] = selected
+            if len(self._decisions) > self.max_decisions:
+                self._decisions.popitem(last=False)
+        return selected
+
+    def reset(self):
+        """Reset all probabilities to equal (1.0 each)"""
+        self.weights.reset()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command, _, argument = line.decode().strip().partition(' ')
+                if command == 'SELECT':
+                    reply = self.select(argument or None)
+                elif command == 'RESET':
+                    self.reset()
+                    reply = 'OK'
+                else:
+                    reply = 'ERROR unknown command'
+                writer.write(reply.encode() + b'\n')
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        """Bind the socket (replacing a stale one left by a crashed coordinator)"""
+        if os.path.exists(self.socket_path):
+            try:
+                _, writer = await asyncio.open_unix_connection(self.socket_path)
+            except OSError:
+                os.unlink(self.socket_path)
+            else:
+                writer.close()
+                raise RuntimeError(f"A turn coordinator is already listening on {self.socket_path}")
+        self._server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        print(f"🔀 Turn coordinator listening on {self.socket_path}", flush=True)
+        return self._server
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+class TurnCoordinatorClient:
+    """Async client used by each bot process (same questions as TurnManager)
+
+    Keeps one connection open. If the coordinator is not running, it falls back to the
+    file-based TurnManager so the bots still take turns. The fallback always decides under
+    the lock (never TURN_LOCK_FREE), so every decision is published by whichever bot asks
+    first and the bots that fell back agree with each other. They do not agree with bots
+    still asking the coordinator, whose weights live only in its memory: while only some
+    bots have lost it, a message can get two responders or none.
+    """
+
+    def __init__(self, socket_path=COORDINATOR_SOCKET, timeout=CLIENT_TIMEOUT, bots=None):
+        self.socket_path = str(socket_path)
+        self.timeout = timeout
+        self.bots = bots
+        self.fallbacks = 0  # Calls served from the turn state file because the coordinator was down
+        self._reader = None
+        self._writer = None
+        self._lock = None
+        self._turn_manager = None
+
+    def _fallback(self):
+        """Locked file-based turn manager used while the coordinator is unavailable"""
+        self.fallbacks += 1
+        if self._turn_manager is None:
+            self._turn_manager = TurnManager(self.bots, lock_free=False)
+        return self._turn_manager
+
+    async def _request(self, line):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._writer is None:
+                self._reader, self._writer = await asyncio.wait_for(
+                    asyncio.open_unix_connection(self.socket_path), self.timeout)
+            try:
+                self._writer.write(line.encode() + b'\n')
+                await self._writer.drain()
+                reply = await asyncio.wait_for(self._reader.readline(), self.timeout)
+                if not reply:
+                    raise ConnectionError("Turn coordinator closed the connection")
+                return reply.decode().strip()
+            except BaseException:
+                self._disconnect()
+                raise
+
+    def _disconnect(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def select_responder(self, message_id=None):
+        """Select which bot should respond to a message (guarantees one response)"""
+        try:
+            return await self._request(f"SELECT {message_id or ''}")
+        except (OSError, asyncio.TimeoutError) as e:
+            print(f"⚠️ Turn coordinator unavailable ({e}), using the turn state file", flush=True)
+            return self._fallback().select_responder(message_id)
+
+    async def should_respond(self, bot_name, message_id=None):
+        """Determine if this bot should respond based on turn system"""
+        try:
+            return await self._request(f"SELECT {message_id or ''}") == bot_name
+        except (OSError, asyncio.TimeoutError) as e:
+            print(f"⚠️ Turn coordinator unavailable ({e}), using the turn state file", flush=True)
+            return self._fallback().should_respond(bot_name, message_id)
+
+    async def reset_probabilities(self):
+        """Reset all probabilities to equal (1.0 each)"""
+        try:
+            await self._request('RESET')
+        except (OSError, asyncio.TimeoutError):
+            self._fallback().reset_probabilities()
+
+    async def close(self):
+        self._disconnect()
+        if self._turn_manager is not None:
+            self._turn_manager.close()
+            self._turn_manager = None
+
+async def main():
+    coordinator = TurnCoordinator()
+    try:
+        await coordinator.serve_forever()
+    finally:
+        await coordinator.close()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\n👋 Turn coordinator stopped", flush=True)
@@ -1,252 +1,368 @@
 """
 Turn Manager for Discord Bots
 Manages turn-based responses when all bots are running together
+Works for any number of bots: weights live in Fenwick trees in a memory-mapped state region
 """
 
 import sys
 sys.dont_write_bytecode = True
 
 import os
+import math
 import time
-import fcntl
 import random
+import struct
+import hashlib
 from pathlib import Path
+from shared_state import SharedState, LocalState, PAYLOAD_OFFSET
+from metrics import histogram
 
-# Shared state file location
+# Shared state file location (memory-mapped by every bot process)
 TURN_STATE_FILE = Path(__file__).parent / '.turn_state'
-TURN_LOCK_FILE = Path(__file__).parent / '.turn_lock'
 
-# Bot identifiers (customize these for your bots)
+# Default bot identifiers - set TURN_BOTS (comma separated) to run any number of personalities
 BOT_1 = "Bot1"
 BOT_2 = "Bot2"
 BOT_3 = "Bot3"
+DEFAULT_BOTS = (BOT_1, BOT_2, BOT_3)
 
-# Decay factor - each time a bot responds, their chance is multiplied by this
+# Probability decay factor (how much to reduce after a bot responds)
 # Lower decay = less reduction per response = more even distribution
 DECAY_FACTOR = 0.97  # Reduced to 0.97 for much better flow (only 3% reduction per response)
 
+# Recovery factor - every selection moves reduced probabilities back toward 1.0
+# Faster recovery = better conversation flow
+RECOVERY_FACTOR = 1.10  # Increased to 1.10 for even faster recovery
+
+# Minimum probability (don't let it go below 0.3 for better flow)
+MIN_PROBABILITY = 0.3
+
+# Weights are stored as fixed-point integers so the tree sums stay exact
+WEIGHT_SCALE = 1 << 20
+MIN_WEIGHT = int(MIN_PROBABILITY * WEIGHT_SCALE)
+
+# A bot at the minimum is back to 1.0 after this many selections, and only one bot is
+# decayed per selection - so at most this many bots are ever recovering at once
+RECOVERY_STEPS = math.ceil(math.log(1 / MIN_PROBABILITY) / math.log(RECOVERY_FACTOR))
+RECOVERY_SLOTS = 16
+
+# Longest bot name (UTF-8 bytes) that fits in the state file
+NAME_SIZE = 32
+
+# Weight snapshots kept in the state file - a bot that decides a message late still finds
+# the snapshot that was current when the message arrived, as long as fewer than this many
+# newer messages have been published since
+SNAPSHOT_SLOTS = 32
+
+TURN_DECISION = histogram('chatbot_turn_decision_seconds', 'Time to decide whether this bot responds', ('mode',))
+
+# State layout (after the shared state header): turn header (bot count, latest snapshot
+# version), bot names, then SNAPSHOT_SLOTS weight blocks. Each block is (version, newest
+# message seen when it was published, message it was published for), the recovering bot
+# indices, weights (one uint32 per bot) and a Fenwick tree (uint64)
+STATE_MAGIC = b'TMv5'
+HEADER_STRUCT = struct.Struct('<I4xQ')
+HEADER_OFFSET = PAYLOAD_OFFSET
+NAMES_OFFSET = HEADER_OFFSET + HEADER_STRUCT.size
+BLOCK_HEADER_STRUCT = struct.Struct('<QQQ')
+RECOVERING_STRUCT = struct.Struct(f'<I{RECOVERY_SLOTS}I')
+WEIGHTS_OFFSET = BLOCK_HEADER_STRUCT.size + (RECOVERING_STRUCT.size + 7) // 8 * 8
+
+def block_size(count):
+    """Bytes of one weight block for `count` bots"""
+    return WEIGHTS_OFFSET + (4 * count + 7) // 8 * 8 + 8 * (count + 1)
+
+def state_layout(count):
+    """(offset of the first weight block, total size) of the state file for `count` bots"""
+    blocks_offset = NAMES_OFFSET + (NAME_SIZE * count + 7) // 8 * 8
+    return blocks_offset, blocks_offset + SNAPSHOT_SLOTS * block_size(count)
+
+def load_bot_names():
+    """Bot names from TURN_BOTS (comma separated), or the three defaults"""
+    names = [name.strip() for name in os.getenv('TURN_BOTS', '').split(',') if name.strip()]
+    return names or list(DEFAULT_BOTS)
+
+def _message_random(message_id):
+    """Random number in [0, 1) that every bot derives identically from a message id"""
+    if not message_id:
+        return random.random()
+    # Create a deterministic seed from message_id
+    seed = int(hashlib.md5(str(message_id).encode()).hexdigest()[:8], 16)
+    return random.Random(seed).random()
+
+def _message_order(message_id):
+    """Message id as an int if it has a natural order (Discord snowflakes do), else None"""
+    if isinstance(message_id, int):
+        return message_id
+    if isinstance(message_id, str) and message_id.isdigit():
+        return int(message_id)
+    return None
+
+class TurnWeights:
+    """One block of per-bot response weights inside a writable buffer (an mmap or a bytearray)
+
+    Weights sit in a Fenwick tree, so a weighted pick and a single weight update are
+    O(log N). The block always holds the weights for the *next* pick (recovery is applied
+    when a selection is recorded), so picking is read-only: a pure function of the message
+    id and the block. Recovery only touches the few bots that were recently decayed (at
+    most RECOVERY_STEPS), so recording a selection is O(log N) too.
+    Callers hold whatever lock the buffer needs for writes.
+    """
+
+    def __init__(self, buffer, count, offset=0):
+        if count < 1:
+            raise ValueError("At least one bot is required")
+        self.buffer = buffer
+        self.count = count
+        self.offset = offset
+        self.size = block_size(count)
+        tree_offset = offset + WEIGHTS_OFFSET + (4 * count + 7) // 8 * 8
+        view = memoryview(buffer)
+        self._weights = view[offset + WEIGHTS_OFFSET:offset + WEIGHTS_OFFSET + 4 * count].cast('I')
+        self._tree = view[tree_offset:tree_offset + 8 * (count + 1)].cast('Q')
+        view.release()
+        self._top = 1 << (count.bit_length() - 1)
+
+    @property
+    def version(self):
+        return BLOCK_HEADER_STRUCT.unpack_from(self.buffer, self.offset)[0]
+
+    @property
+    def message(self):
+        """Order key of the newest message recorded up to this block (0 if none)"""
+        return BLOCK_HEADER_STRUCT.unpack_from(self.buffer, self.offset)[1]
+
+    @property
+    def recorded(self):
+        """Order key of the message this block was published for (0 if none)"""
+        return BLOCK_HEADER_STRUCT.unpack_from(self.buffer, self.offset)[2]
+
+    def stamp(self, version, message=0, recorded=0):
+        BLOCK_HEADER_STRUCT.pack_into(self.buffer, self.offset, version, message, recorded)
+
+    def reset(self):
+        """Every bot back to full weight"""
+        RECOVERING_STRUCT.pack_into(self.buffer, self.offset + BLOCK_HEADER_STRUCT.size, 0,
+                                    *([0] * RECOVERY_SLOTS))
+        for i in range(self.count):
+            self._weights[i] = WEIGHT_SCALE
+        # Linear-time Fenwick build
+        tree = self._tree
+        tree[0] = 0
+        for i in range(1, self.count + 1):
+            tree[i] = WEIGHT_SCALE
+        for i in range(1, self.count + 1):
+            parent = i + (i & -i)
+            if parent <= self.count:
+                tree[parent] += tree[i]
+
+    def copy_from(self, other):
+        """Copy another block's weights (not its version stamp) into this one"""
+        start = BLOCK_HEADER_STRUCT.size
+        self.buffer[self.offset + start:self.offset + self.size] = \
+            other.buffer[other.offset + start:other.offset + other.size]
+
+    def _set(self, index, weight):
+        delta = weight - self._weights[index]
+        self._weights[index] = weight
+        tree = self._tree
+        i = index + 1
+        while i <= self.count:
+            tree[i] += delta
+            i += i & -i
+
+    def total(self):
+        total = 0
+        i = self.count
+        while i:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def _find(self, target):
+        """Index of the bot whose cumulative weight range contains `target`"""
+        tree = self._tree
+        position = 0
+        step = self._top
+        while step:
+            child = position + step
+            if child <= self.count and tree[child] <= target:
+                position = child
+                target -= tree[child]
+            step >>= 1
+        return position
+
+    def pick(self, message_id=None):
+        """Weighted pick of a bot index (read-only - every bot gets the same answer)"""
+        return self._find(int(_message_random(message_id) * self.total()))
+
+    def advance(self, selected):
+        """Record a selection: decay the selected bot, then recover the recently decayed ones"""
+        offset = self.offset + BLOCK_HEADER_STRUCT.size
+        recovering_count, *slots = RECOVERING_STRUCT.unpack_from(self.buffer, offset)
+        recovering = slots[:recovering_count]
+
+        # Decrease the selected bot's weight (never below the minimum, for better flow)
+        self._set(selected, max(MIN_WEIGHT, int(self._weights[selected] * DECAY_FACTOR)))
+        if selected not in recovering:
+            if len(recovering) == RECOVERY_SLOTS:
+                # Cannot happen with the default factors - finish the oldest recovery early
+                self._set(recovering.pop(0), WEIGHT_SCALE)
+            recovering.append(selected)
+
+        # Gradually recover probabilities (move them back toward 1.0) for the next pick
+        still_recovering = []
+        for index in recovering:
+            weight = min(WEIGHT_SCALE, int(self._weights[index] * RECOVERY_FACTOR))
+            self._set(index, weight)
+            if weight < WEIGHT_SCALE:
+                still_recovering.append(index)
+
+        RECOVERING_STRUCT.pack_into(self.buffer, offset, len(still_recovering), *still_recovering,
+                                    *([0] * (RECOVERY_SLOTS - len(still_recovering))))
+
+    def select(self, message_id=None):
+        """Pick a bot and record the selection; returns the selected index"""
+        selected = self.pick(message_id)
+        self.advance(selected)
+        return selected
+
+    def probabilities(self):
+        """Current weights as a list of probabilities in [MIN_PROBABILITY, 1.0]"""
+        return [weight / WEIGHT_SCALE for weight in self._weights]
+
+    def release(self):
+        """Drop the views into the buffer (required before an mmap can be closed)"""
+        self._weights.release()
+        self._tree.release()
+
 class TurnManager:
-    """Manages turn-based responses for bots"""
-    
-    def __init__(self):
+    """Manages turn-based responses for bots
+
+    State for every bot lives in one shared state region (see shared_state) as a ring of
+    versioned weight snapshots. Each snapshot is tagged with the message whose selection produced it, so
+    the decision for a message is a pure function of its id and the newest snapshot
+    published before it - and the decay is recorded once per message, not once per bot.
+
+    By default every bot decides under a short flock. With `lock_free`, bots read the
+    snapshot through the seqlock without any lock, syscall or IPC, and only the elected
+    responder takes the lock, to publish the next snapshot. All bots sharing the file must use the same bot names.
+    """
+
+    def __init__(self, bots=None, state_file=TURN_STATE_FILE, lock_free=False):
+        self.bots = tuple(bots or load_bot_names())
+        if len(set(self.bots)) != len(self.bots):
+            raise ValueError("Bot names must be unique")
+        self._names = [bot.encode() for bot in self.bots]
+        if any(len(name) > NAME_SIZE for name in self._names):
+            raise ValueError(f"Bot names must be at most {NAME_SIZE} bytes")
+        self.state_file = Path(state_file)
+        self.lock_free = lock_free
+        self._state = None
+        self._blocks = None
         self.ensure_state_file()
-        # Cache for message selections (message_id -> selected_bot)
-        self._message_selections = {}
-    
+
     def ensure_state_file(self):
-        """Ensure the state file exists"""
-        if not TURN_STATE_FILE.exists():
-            # Initialize with equal probabilities
-            self.write_state(BOT_1, {BOT_1: 1.0, BOT_2: 1.0, BOT_3: 1.0})
-    
-    def read_state(self, lock_file=None):
-        """Read current state from file (with optional lock file handle)"""
-        # If lock_file is provided, we're already holding the lock
-        if lock_file is not None:
-            try:
-                if TURN_STATE_FILE.exists():
-                    with open(TURN_STATE_FILE, 'r') as f:
-                        lines = f.read().strip().split('\n')
-                        if len(lines) >= 4:
-                            last_bot = lines[0]
-                            probs = {
-                                BOT_1: float(lines[1]),
-                                BOT_2: float(lines[2]),
-                                BOT_3: float(lines[3])
-                            }
-                            return last_bot, probs
-                # Default state
-                return BOT_1, {BOT_1: 1.0, BOT_2: 1.0, BOT_3: 1.0}
-            except Exception as e:
-                print(f"Error reading turn state: {e}", flush=True)
-                return BOT_1, {BOT_1: 1.0, BOT_2: 1.0, BOT_3: 1.0}
-        
-        # Otherwise, acquire lock and read
-        max_retries = 5
-        for attempt in range(max_retries):
-            try:
-                TURN_LOCK_FILE.parent.mkdir(parents=True, exist_ok=True)
-                TURN_STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
-                
-                with open(TURN_LOCK_FILE, 'a+') as lock_f:
-                    try:
-                        fcntl.flock(lock_f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
-                    except (IOError, OSError):
-                        if attempt < max_retries - 1:
-                            time.sleep(0.1)
-                            continue
-                        else:
-                            fcntl.flock(lock_f.fileno(), fcntl.LOCK_EX)
-                    
-                    try:
-                        if TURN_STATE_FILE.exists():
-                            with open(TURN_STATE_FILE, 'r') as f:
-                                lines = f.read().strip().split('\n')
-                                if len(lines) >= 4:
-                                    last_bot = lines[0]
-                                    probs = {
-                                        BOT_1: float(lines[1]),
-                                        BOT_2: float(lines[2]),
-                                        BOT_3: float(lines[3])
-                                    }
-                                    return last_bot, probs
-                        # Default state
-                        return BOT_1, {BOT_1: 1.0, BOT_2: 1.0, BOT_3: 1.0}
-                    finally:
-                        fcntl.flock(lock_f.fileno(), fcntl.LOCK_UN)
-            except Exception as e:
-                if attempt < max_retries - 1:
-                    time.sleep(0.1)
-                    continue
-                else:
-                    print(f"Error reading turn state: {e}", flush=True)
-                    return BOT_1, {BOT_1: 1.0, BOT_2: 1.0, BOT_3: 1.0}
-        return BOT_1, {BOT_1: 1.0, BOT_2: 1.0, BOT_3: 1.0}
-    
-    def write_state(self, last_bot, probabilities, lock_file=None):
-        """Write state to file (with optional lock file handle)"""
-        # If lock_file is provided, we're already holding the lock
-        if lock_file is not None:
-            try:
-                with open(TURN_STATE_FILE, 'w') as f:
-                    f.write(f"{last_bot}\n")
-                    f.write(f"{probabilities[BOT_1]}\n")
-                    f.write(f"{probabilities[BOT_2]}\n")
-                    f.write(f"{probabilities[BOT_3]}\n")
-                return
-            except Exception as e:
-                print(f"Error writing turn state: {e}", flush=True)
-                return
-        
-        # Otherwise, acquire lock and write
-        max_retries = 5
-        for attempt in range(max_retries):
-            try:
-                TURN_LOCK_FILE.parent.mkdir(parents=True, exist_ok=True)
-                TURN_STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
-                
-                with open(TURN_LOCK_FILE, 'a+') as lock_f:
-                    try:
-                        fcntl.flock(lock_f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
-                    except (IOError, OSError):
-                        if attempt < max_retries - 1:
-                            time.sleep(0.1)
-                            continue
-                        else:
-                            fcntl.flock(lock_f.fileno(), fcntl.LOCK_EX)
-                    
-                    try:
-                        with open(TURN_STATE_FILE, 'w') as f:
-                            f.write(f"{last_bot}\n")
-                            f.write(f"{probabilities[BOT_1]}\n")
-                            f.write(f"{probabilities[BOT_2]}\n")
-                            f.write(f"{probabilities[BOT_3]}\n")
-                        return
-                    finally:
-                        fcntl.flock(lock_f.fileno(), fcntl.LOCK_UN)
-            except Exception as e:
-                if attempt < max_retries - 1:
-                    time.sleep(0.1)
-                    continue
-                else:
-                    print(f"Error writing turn state: {e}", flush=True)
-    
+        """Open and map the state file, initializing it if it is new, in an old format or for other bots"""
+        blocks_offset, size = state_layout(len(self.bots))
+        self._state = self._open_state(size)
+        stride = block_size(len(self.bots))
+        self._blocks = [TurnWeights(self._state.map, len(self.bots), blocks_offset + i * stride)
+                        for i in range(SNAPSHOT_SLOTS)]
+
+    def _open_state(self, size):
+        return SharedState(self.state_file, size, STATE_MAGIC, self._initialize, self._matches)
+
+    def _matches(self, state):
+        """True if the state already holds weights for exactly these bots"""
+        if HEADER_STRUCT.unpack_from(state, HEADER_OFFSET)[0] != len(self.bots):
+            return False
+        return all(state[NAMES_OFFSET + i * NAME_SIZE:NAMES_OFFSET + (i + 1) * NAME_SIZE].rstrip(b'\x00') == name
+                   for i, name in enumerate(self._names))
+
+    def _initialize(self, state):
+        """Write the names and publish equal weights as version 1"""
+        for i, name in enumerate(self._names):
+            struct.pack_into(f'{NAME_SIZE}s', state, NAMES_OFFSET + i * NAME_SIZE, name)
+        blocks_offset = state_layout(len(self.bots))[0]
+        block = TurnWeights(state, len(self.bots), blocks_offset + (1 % SNAPSHOT_SLOTS) * block_size(len(self.bots)))
+        # Initialize with equal probabilities
+        block.reset()
+        block.stamp(1)
+        block.release()
+        HEADER_STRUCT.pack_into(state, HEADER_OFFSET, len(self.bots), 1)
+
+    def _latest(self, state):
+        return HEADER_STRUCT.unpack_from(state, HEADER_OFFSET)[1]
+
+    def _snapshot(self, state, order):
+        """Newest snapshot block published before message `order` (the oldest kept one if none is)"""
+        latest = self._latest(state)
+        oldest = max(1, latest - SNAPSHOT_SLOTS + 1)
+        for version in range(latest, oldest - 1, -1):
+            block = self._blocks[version % SNAPSHOT_SLOTS]
+            if order is None or block.message < order or version == oldest:
+                return block
+
+    def _pick(self, state, message_id):
+        """Index of the responder for a message, picked from its snapshot"""
+        return self._snapshot(state, _message_order(message_id)).pick(message_id)
+
+    def _publish(self, state, selected, message_id):
+        """Publish the snapshot after `selected` responded to a message (lock held)"""
+        order = _message_order(message_id)
+        latest = self._latest(state)
+        if order is not None:
+            # Another bot already recorded this message
+            oldest = max(1, latest - SNAPSHOT_SLOTS + 1)
+            for version in range(latest, oldest - 1, -1):
+                if self._blocks[version % SNAPSHOT_SLOTS].recorded == order:
+                    return
+        source = self._blocks[latest % SNAPSHOT_SLOTS]
+        target = self._blocks[(latest + 1) % SNAPSHOT_SLOTS]
+        target.copy_from(source)
+        target.advance(selected)
+        # Lookups go by the newest message seen (messages can be recorded out of order),
+        # duplicate checks by the message itself
+        target.stamp(latest + 1, max(order or 0, source.message), order or 0)
+        HEADER_STRUCT.pack_into(state, HEADER_OFFSET, len(self.bots), latest + 1)
+
+    def version(self):
+        """Latest published snapshot version (one more per recorded message)"""
+        return self._state.read(self._latest)
+
     def select_responder(self, message_id=None):
-        """Select which bot should respond to the current message (guarantees one response)"""
+        """Select which bot should respond to the current message (guarantees one response)
+
+        In lock-free mode this only reads - the responder records its turn in should_respond().
+        """
         try:
-            # Use file-based lock to ensure only one bot updates probabilities per message
-            max_retries = 10
-            for attempt in range(max_retries):
-                try:
-                    TURN_LOCK_FILE.parent.mkdir(parents=True, exist_ok=True)
-                    TURN_STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
-                    
-                    with open(TURN_LOCK_FILE, 'a+') as lock_f:
-                        try:
-                            fcntl.flock(lock_f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
-                        except (IOError, OSError):
-                            if attempt < max_retries - 1:
-                                time.sleep(0.05)
-                                continue
-                            else:
-                                fcntl.flock(lock_f.fileno(), fcntl.LOCK_EX)
-                        
-                        try:
-                            # Read current state (we already have the lock, so pass None to skip locking)
-                            last_bot, probabilities = self.read_state(lock_file=lock_f)
-                            
-                            # Ensure we have valid probabilities
-                            if not probabilities:
-                                probabilities = {BOT_1: 1.0, BOT_2: 1.0, BOT_3: 1.0}
-                            
-                            # Gradually recover probabilities (move them back toward 1.0)
-                            # Faster recovery = better conversation flow
-                            recovery_factor = 1.10  # Increased to 1.10 for even faster recovery
-                            for bot in probabilities:
-                                if probabilities[bot] < 1.0:
-                                    probabilities[bot] = min(1.0, probabilities[bot] * recovery_factor)
-                            
-                            # Normalize probabilities to sum to 3
-                            total = sum(probabilities.values())
-                            if total == 0:
-                                probabilities = {BOT_1: 1.0, BOT_2: 1.0, BOT_3: 1.0}
-                                total = 3.0
-                            
-                            # Calculate normalized probabilities (sum to 1.0)
-                            normalized = {k: v / total for k, v in probabilities.items()}
-                            
-                            # Make selection deterministic based on message_id so all bots get same result
-                            if message_id:
-                                # Use message_id to seed random for deterministic selection
-                                import hashlib
-                                # Create a deterministic seed from message_id
-                                seed = int(hashlib.md5(str(message_id).encode()).hexdigest()[:8], 16)
-                                local_random = random.Random(seed)
-                            else:
-                                local_random = random
-                            
-                            # Select a bot based on weighted random choice (guarantees one selection)
-                            bots = list(normalized.keys())
-                            weights = list(normalized.values())
-                            selected_bot = local_random.choices(bots, weights=weights, k=1)[0]
-                            
-                            # Update probabilities - decrease selected bot's probability
-                            new_probs = probabilities.copy()
-                            new_probs[selected_bot] = probabilities[selected_bot] * DECAY_FACTOR
-                            
-                            # Ensure minimum probability (don't let it go below 0.3 for better flow)
-                            # Higher minimum ensures conversation keeps flowing smoothly
-                            if new_probs[selected_bot] < 0.3:
-                                new_probs[selected_bot] = 0.3
-                            
-                            # Write updated state (while holding lock, so pass lock_file)
-                            self.write_state(selected_bot, new_probs, lock_file=lock_f)
-                            
-                            return selected_bot
-                        finally:
-                            fcntl.flock(lock_f.fileno(), fcntl.LOCK_UN)
-                    break  # Success, exit retry loop
-                except Exception as e:
-                    if attempt < max_retries - 1:
-                        time.sleep(0.05)
-                        continue
-                    else:
-                        raise e
-            # If we get here, something went wrong
-            return random.choice([BOT_1, BOT_2, BOT_3])
+            if self.lock_free:
+                # Seqlock read: no lock, no syscall - retried only if it overlapped a publish
+                return self.bots[self._state.read(lambda state: self._pick(state, message_id))]
+            with self._state.locked() as state:
+                selected = self._pick(state, message_id)
+                self._publish(state, selected, message_id)
+            return self.bots[selected]
         except Exception as e:
             print(f"Error in turn_manager.select_responder: {e}", flush=True)
             import traceback
             traceback.print_exc()
             # On error, return random bot
-            return random.choice([BOT_1, BOT_2, BOT_3])
-    
+            return random.choice(self.bots)
+
     def should_respond(self, bot_name, message_id=None):
         """Determine if this bot should respond based on turn system"""
+        started = time.perf_counter()
         try:
             # Select which bot should respond (guarantees one response per message)
             # Use message_id to ensure all bots get the same selection for the same message
             selected_bot = self.select_responder(message_id)
+            if self.lock_free and selected_bot == bot_name:
+                # Only the elected responder publishes the decay update
+                with self._state.locked() as state:
+                    self._publish(state, self.bots.index(bot_name), message_id)
+            TURN_DECISION.labels('lock_free' if self.lock_free else 'locked').observe(time.perf_counter() - started)
             return selected_bot == bot_name
         except Exception as e:
             print(f"Error in turn_manager.should_respond: {e}", flush=True)
@@ -254,17 +370,46 @@ class TurnManager:
             traceback.print_exc()
             # On error, allow response (fail open)
             return True
-    
+
     def reset_probabilities(self):
         """Reset all probabilities to equal (1.0 each)"""
-        self.write_state(BOT_1, {BOT_1: 1.0, BOT_2: 1.0, BOT_3: 1.0})
+        with self._state.locked() as state:
+            self._initialize(state)
+
+    def probabilities(self):
+        """Snapshot of the current probabilities (lock-free, for status)"""
+        def read(state):
+            return self._blocks[self._latest(state) % SNAPSHOT_SLOTS].probabilities()
+        return dict(zip(self.bots, self._state.read(read)))
+
+    def close(self):
+        """Unmap and close the state file"""
+        if self._blocks is not None:
+            for block in self._blocks:
+                block.release()
+            self._blocks = None
+        if self._state is not None:
+            self._state.close()
+            self._state = None
+
+class InMemoryTurnManager(TurnManager):
+    """The same turn manager with its state in process memory instead of a mapped file
+
+    For several bots hosted on one event loop (bot_host.py): every decision is a plain
+    function call. `state_file` is accepted and ignored.
+    """
+
+    def _open_state(self, size):
+        return LocalState(size, STATE_MAGIC, self._initialize)
 
 # Global instance
 _turn_manager = None
 
-def get_turn_manager():
-    """Get or create the turn manager instance"""
+def get_turn_manager(bots=None, lock_free=None):
+    """Get or create the turn manager instance (lock-free mode from TURN_LOCK_FREE unless given)"""
     global _turn_manager
     if _turn_manager is None:
-        _turn_manager = TurnManager()
+        if lock_free is None:
+            lock_free = os.getenv('TURN_LOCK_FREE', 'false').lower() == 'true'
+        _turn_manager = TurnManager(bots, lock_free=lock_free)
     return _turn_manager
@@ -0,0 +1,300 @@
+"""
+Upstream Transport
+One long-lived HTTP transport for every completion request in the process: keep-alive
+connection pooling, DNS caching, split connect/read/total timeouts and optional HTTP/2
+multiplexing (httpx), with connection-level stats showing how often connections are reused
+"""
+
+import sys
+sys.dont_write_bytecode = True
+
+import os
+import json
+import time
+import socket
+import asyncio
+import ipaddress
+from contextlib import asynccontextmanager
+from metrics import counter
+
+# Connection pool: max open connections (0 = unlimited), per host (HTTP/1.1 only), and how
+# long idle keep-alive connections are kept for the next request
+POOL_SIZE = 100
+POOL_SIZE_PER_HOST = 0
+KEEPALIVE_TIMEOUT = 60  # seconds
+
+# Resolved upstream addresses are reused for this long instead of a DNS lookup per connection
+DNS_CACHE_TTL = 300  # seconds
+
+# Timeouts: opening a connection (waiting for a pooled one included), the longest gap
+# between received bytes (a stalled stream), and the whole request
+CONNECT_TIMEOUT = 5    # seconds
+READ_TIMEOUT = 15      # seconds
+TOTAL_TIMEOUT = 60     # seconds
+
+UPSTREAM_CONNECTIONS = counter('chatbot_upstream_connections_total',
+                               'Upstream requests by whether they opened a new connection or reused one', ('kind',))
+UPSTREAM_DNS = counter('chatbot_upstream_dns_lookups_total', 'Upstream DNS resolutions by cache result', ('result',))
+
+def transport_config():
+    """Transport settings from the environment (UPSTREAM_* variables, defaults above)"""
+    return {
+        'pool_size': int(os.getenv('UPSTREAM_POOL_SIZE', POOL_SIZE)),
+        'pool_size_per_host': int(os.getenv('UPSTREAM_POOL_SIZE_PER_HOST', POOL_SIZE_PER_HOST)),
+        'keepalive_timeout': float(os.getenv('UPSTREAM_KEEPALIVE_TIMEOUT', KEEPALIVE_TIMEOUT)),
+        'dns_cache_ttl': int(os.getenv('UPSTREAM_DNS_CACHE_TTL', DNS_CACHE_TTL)),
+        'connect_timeout': float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', CONNECT_TIMEOUT)),
+        'read_timeout': float(os.getenv('UPSTREAM_READ_TIMEOUT', READ_TIMEOUT)),
+        'total_timeout': float(os.getenv('UPSTREAM_TIMEOUT', TOTAL_TIMEOUT)),
+        'http2': os.getenv('UPSTREAM_HTTP2', 'false').lower() == 'true',
+    }
+
+class UpstreamResponse:
+    """The parts of an HTTP response the completion client reads, for either HTTP library"""
+
+    def __init__(self, status, headers, read, lines):
+        self.status = status
+        self.headers = headers
+        self._read = read
+        self._lines = lines
+
+    async def read(self):
+        """The whole body (also returns the connection to the pool)"""
+        return await self._read()
+
+    async def json(self):
+        return json.loads(await self._read())
+
+    def lines(self):
+        """Async iterator over the body's lines as text (server-sent events)"""
+        return self._lines()
+
+async def _decoded_lines(stream):
+    async for line in stream:
+        yield line.decode('utf-8')
+
+class _CachingNetworkBackend:
+    """httpcore network backend that reuses resolved addresses for `ttl` seconds
+
+    httpx resolves the host for every new connection; this resolves it once per TTL and
+    connects to the address directly. TLS still verifies and sends SNI for the original host
+    (httpcore takes the server name from the URL, not from the connected address).
+    """
+
+    def __init__(self, backend, ttl, record):
+        self._backend = backend
+        self._ttl = ttl
+        self._record = record
+        self._cache = {}  # (host, port) -> (address, expires at)
+
+    async def _resolve(self, host, port):
+        try:
+            ipaddress.ip_address(host)
+            return host
+        except ValueError:
+            pass
+        cached = self._cache.get((host, port))
+        if cached and cached[1] > time.monotonic():
+            self._record(True)
+            return cached[0]
+        self._record(False)
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        address = infos[0][4][0]
+        self._cache[(host, port)] = (address, time.monotonic() + self._ttl)
+        return address
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        address = await self._resolve(host, port)
+        return await self._backend.connect_tcp(address, port, timeout=timeout, local_address=local_address,
+                                               socket_options=socket_options)
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return await self._backend.connect_unix_socket(path, timeout=timeout, socket_options=socket_options)
+
+    async def sleep(self, seconds):
+        await self._backend.sleep(seconds)
+
+class UpstreamTransport:
+    """Shared keep-alive connection pool for upstream API calls
+
+    Uses aiohttp (HTTP/1.1) by default, or httpx with HTTP/2 when `http2` is set and httpx
+    is installed with its http2 extra - many concurrent requests then share one connection
+    per host instead of one connection each. Both cache DNS for `dns_cache_ttl` seconds. Counts new vs reused connections
+    for stats(); the pool is created on first use inside the running event loop.
+    """
+
+    def __init__(self, config=None):
+        self.config = dict(transport_config(), **(config or {}))
+        self.http2 = self.config['http2'] and self._httpx_available()
+        if self.config['http2'] and not self.http2:
+            print("⚠️ UPSTREAM_HTTP2 needs httpx with HTTP/2 support (pip install 'httpx[http2]'), "
+                  "using HTTP/1.1 keep-alive", flush=True)
+        self._session = None
+        self._loop = None
+        self.new_connections = 0
+        self.reused_connections = 0
+        self.dns_hits = 0
+        self.dns_misses = 0
+        self.protocols = {}
+
+    def errors(self):
+        """Exceptions a request can raise because of the network or the server (not the request)"""
+        import aiohttp
+        errors = (aiohttp.ClientError, asyncio.TimeoutError)
+        if self.http2:
+            import httpx
+            errors += (httpx.TransportError,)
+        return errors
+
+    @staticmethod
+    def _httpx_available():
+        try:
+            import httpx
+            import h2
+        except ImportError:
+            return False
+        return True
+
+    def _record_connection(self, reused):
+        if reused:
+            self.reused_connections += 1
+        else:
+            self.new_connections += 1
+        UPSTREAM_CONNECTIONS.labels('reused' if reused else 'new').inc()
+
+    def _record_protocol(self, version):
+        self.protocols[version] = self.protocols.get(version, 0) + 1
+
+    def _record_dns(self, hit):
+        if hit:
+            self.dns_hits += 1
+        else:
+            self.dns_misses += 1
+        UPSTREAM_DNS.labels('hit' if hit else 'miss').inc()
+
+    def _trace_config(self):
+        """aiohttp hooks that tell new connections from reused ones and cached DNS from lookups"""
+        import aiohttp
+        trace = aiohttp.TraceConfig()
+
+        async def connection_created(session, context, params):
+            self._record_connection(False)
+
+        async def connection_reused(session, context, params):
+            self._record_connection(True)
+
+        async def dns_hit(session, context, params):
+            self._record_dns(True)
+
+        async def dns_miss(session, context, params):
+            self._record_dns(False)
+
+        trace.on_connection_create_end.append(connection_created)
+        trace.on_connection_reuseconn.append(connection_reused)
+        trace.on_dns_cache_hit.append(dns_hit)
+        trace.on_dns_cache_miss.append(dns_miss)
+        return trace
+
+    def _get_session(self):
+        """Get or create the pooled session (must be called from inside the event loop)"""
+        loop = asyncio.get_running_loop()
+        if self._session is not None and (self._loop is not loop or self._session_closed()):
+            # A new event loop (e.g. another asyncio.run) cannot use connections of the old one
+            self._session = None
+        if self._session is None:
+            config = self.config
+            if self.http2:
+                import httpx
+                transport = httpx.AsyncHTTPTransport(
+                    http2=True,
+                    limits=httpx.Limits(max_connections=config['pool_size'] or None,
+                                        max_keepalive_connections=config['pool_size'] or None,
+                                        keepalive_expiry=config['keepalive_timeout']))
+                # httpx has no option for the network backend, so the pool's default one is wrapped
+                pool = transport._pool
+                pool._network_backend = _CachingNetworkBackend(pool._network_backend, config['dns_cache_ttl'],
+                                                               self._record_dns)
+                self._session = httpx.AsyncClient(
+                    transport=transport,
+                    timeout=httpx.Timeout(config['read_timeout'], connect=config['connect_timeout'],
+                                          pool=config['connect_timeout']))
+            else:
+                # Imported on first use so importing the client stack stays cheap (CLI startup, tooling)
+                import aiohttp
+                connector = aiohttp.TCPConnector(
+                    limit=config['pool_size'], limit_per_host=config['pool_size_per_host'],
+                    keepalive_timeout=config['keepalive_timeout'],
+                    use_dns_cache=True, ttl_dns_cache=config['dns_cache_ttl'])
+                self._session = aiohttp.ClientSession(
+                    connector=connector,
+                    timeout=aiohttp.ClientTimeout(total=config['total_timeout'], connect=config['connect_timeout'],
+                                                  sock_read=config['read_timeout']),
+                    trace_configs=[self._trace_config()])
+            self._loop = loop
+        return self._session
+
+    def _session_closed(self):
+        return self._session.is_closed if self.http2 else self._session.closed
+
+    @asynccontextmanager
+    async def post(self, url, body, headers):
+        """POST an encoded request `body` (headers give its type); yields an UpstreamResponse
+        whose body is readable inside the block"""
+        session = self._get_session()
+        if self.http2:
+            # httpx has no whole-request timeout, so the total is enforced around the request
+            async with asyncio.timeout(self.config['total_timeout']):
+                async with self._httpx_post(session, url, body, headers) as response:
+                    yield response
+            return
+        async with session.post(url, data=body, headers=headers) as response:
+            self._record_protocol(f"HTTP/{response.version.major}.{response.version.minor}")
+            yield UpstreamResponse(response.status, dict(response.headers), response.read,
+                                   lambda: _decoded_lines(response.content))
+
+    @asynccontextmanager
+    async def _httpx_post(self, session, url, body, headers):
+        connected = []
+
+        async def trace(event, info):
+            # httpcore reports each new TCP connection; a request without one reused a connection
+            if event == 'connection.connect_tcp.complete':
+                connected.append(True)
+
+        request = session.build_request('POST', url, content=body, headers=headers, extensions={'trace': trace})
+        response = await session.send(request, stream=True)
+        try:
+            self._record_connection(not connected)
+            self._record_protocol(response.http_version)
+            yield UpstreamResponse(response.status_code, dict(response.headers), response.aread,
+                                   response.aiter_lines)
+        finally:
+            await response.aclose()
+
+    def stats(self):
+        """Connection reuse and DNS cache counts since startup"""
+        connections = self.new_connections + self.reused_connections
+        return {
+            'http2': self.http2,
+            'new_connections': self.new_connections,
+            'reused_connections': self.reused_connections,
+            'reuse_rate': self.reused_connections / connections if connections else 0.0,
+            'dns_hits': self.dns_hits,
+            'dns_misses': self.dns_misses,
+            'protocols': dict(self.protocols),
+        }
+
+    async def close(self):
+        """Close the pool and its connections"""
+        if self._session is not None and not self._session_closed():
+            if self.http2:
+                await self._session.aclose()
+            else:
+                await self._session.close()
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()